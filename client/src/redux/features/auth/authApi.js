@@ -27,4 +27,11 @@ export const signupApi = async (userData) => {
   }
 };
 
-
+export const logoutApi = async () => {
+  // Revoke the token server-side; the caller clears it locally either way
+  try {
+    await network.post('/api/logout');
+  } catch (error) {
+    console.error("Logout API Error:", error);
+  }
+};
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
 import { useDispatch } from 'react-redux';
 import { websocketConnect, websocketDisconnect } from '../redux/features/webSocket/webSocketSlice';
+import { logoutApi } from '../redux/features/auth/authApi';
 // Material UI imports
 import { 
   Box, 
@@ -147,7 +148,7 @@ const Home = () => {
         setCurrentSession(newSession);
         setChatSessions([...savedSessions, newSession]);
         localStorage.setItem('chatSessions', JSON.stringify([...savedSessions, newSession]));
-        dispatch(websocketConnect(`wss://your-websocket-url/api/chat?session_id=${sessionIdFromQuery}`));
+        dispatch(websocketConnect(`wss://your-websocket-url/api/chat?session_id=${sessionIdFromQuery}&token=${encodeURIComponent(localStorage.getItem('token'))}`));
       } else if (savedSessions.length > 0) {
         setChatSessions(savedSessions);
         setCurrentSession(savedSessions[0]);
@@ -163,7 +164,7 @@ const Home = () => {
   useEffect(() => {
     if (currentSession) {
       // Connect to WebSocket when the component mounts
-      socketRef.current = new WebSocket(`wss://shastra-service-410805250566.us-central1.run.app/api/chat?session_id=${currentSession.id}`);
+      socketRef.current = new WebSocket(`wss://shastra-service-410805250566.us-central1.run.app/api/chat?session_id=${currentSession.id}&token=${encodeURIComponent(localStorage.getItem('token'))}`);
 
       socketRef.current.onopen = () => {
         console.log('WebSocket connection established');
@@ -180,6 +181,11 @@ const Home = () => {
           newMessage = { content: event.data, sender: 'ai', timestamp: new Date().toISOString() }; // Create a message object
         }
 
+        // The server was too busy to take the question; show its retry hint instead of an answer
+        if (newMessage.type === 'busy') {
+          newMessage = { content: `${newMessage.message} (retry in ${Math.ceil(newMessage.retry_after_seconds)}s)`, sender: 'ai', timestamp: new Date().toISOString() };
+        }
+
         console.log('Received message:', newMessage); // Log the incoming message
         setMessages((prevMessages) => [...prevMessages, newMessage]); // Update state with the new message
         setIsThinking(false); // Stop loading indicator when response received
@@ -229,7 +235,7 @@ const Home = () => {
       localStorage.setItem(`messages_${newSession.id}`, JSON.stringify([]));
       
       // Connect to WebSocket
-      dispatch(websocketConnect(`wss://your-websocket-url/api/chat?session_id=${randomSessionId}`));
+      dispatch(websocketConnect(`wss://your-websocket-url/api/chat?session_id=${randomSessionId}&token=${encodeURIComponent(localStorage.getItem('token'))}`));
       
       setTimeout(() => {
         setNewSessionAnimation(false);
@@ -242,6 +248,7 @@ const Home = () => {
 
   // Ensure handleLogout and formatDate are defined
   const handleLogout = () => {
+    logoutApi();
     localStorage.removeItem('token');
     navigate('/auth/login');
   };
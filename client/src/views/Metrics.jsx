@@ -2,6 +2,7 @@ import React, { useEffect } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { useNavigate } from 'react-router-dom';
 import { fetchMetrics } from '../redux/features/metrics/metricSlice';
+import { logoutApi } from '../redux/features/auth/authApi';
 import { CircularProgress, Typography, Paper, Grid, Box, IconButton } from '@mui/material';
 import ReactApexChart from 'react-apexcharts';
 import Sidebar from '../components/sidebar';
@@ -18,6 +19,7 @@ const Metrics = () => {
     };
 
     const handleLogout = () => {
+        logoutApi();
         localStorage.removeItem('token');
         navigate('/auth/login');
     };
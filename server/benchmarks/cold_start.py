@@ -0,0 +1,90 @@
+"""Cold-start time of the API server, for tracking startup regressions.
+
+Each run launches a fresh uvicorn process, as Cloud Run does on a cold start,
+polls the liveness probe until it answers, then reads the readiness probe for
+the server's own measurements:
+
+    spawn_to_live   process spawn until /healthz first answers (wall clock)
+    import_to_*     seconds from importing the app to startup, the first
+                    request and every required dependency being warm
+
+Run from the server directory with the usual environment (.env is loaded):
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --runs 5 --wait-ready 30
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def _get(url: str):
+    """(status, JSON body), or (None, None) while nothing is listening"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None, None
+
+
+def cold_start(port: int, timeout: float, wait_ready: float):
+    env = dict(os.environ)
+    env.setdefault("JWT_SECRET_KEY", "cold-start-benchmark")  # startup refuses to run without one
+    base = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while _get(f"{base}/healthz")[0] != 200:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with status {server.returncode}")
+            if time.perf_counter() - spawned > timeout:
+                raise RuntimeError(f"server not live after {timeout}s")
+            time.sleep(0.01)
+        spawn_to_live = time.perf_counter() - spawned
+
+        deadline = time.perf_counter() + wait_ready
+        status, readiness = _get(f"{base}/readyz")
+        while status != 200 and time.perf_counter() < deadline:
+            time.sleep(0.1)
+            status, readiness = _get(f"{base}/readyz")
+        return {"spawn_to_live": spawn_to_live, **readiness["startup"], "dependencies": readiness["dependencies"]}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for liveness")
+    parser.add_argument("--wait-ready", type=float, default=10, help="seconds to wait for readiness after liveness")
+    args = parser.parse_args()
+
+    results = [cold_start(args.port, args.timeout, args.wait_ready) for _ in range(args.runs)]
+    for name in ("spawn_to_live", "import_to_startup_seconds", "import_to_first_request_seconds", "import_to_ready_seconds"):
+        values = [r[name] for r in results if r[name] is not None]
+        if values:
+            print(f"{name:>32}: median {statistics.median(values):.3f}s, max {max(values):.3f}s")
+        else:
+            print(f"{name:>32}: not reached")
+    for name, dependency in results[-1]["dependencies"].items():
+        detail = f"{dependency['warmup_seconds']:.3f}s" if dependency["state"] == "ready" else dependency["error"]
+        print(f"{name:>32}: {dependency['state']} ({detail})")
+
+
+if __name__ == "__main__":
+    main()
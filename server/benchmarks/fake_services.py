@@ -0,0 +1,449 @@
+"""In-process stand-ins for Gemini, Vertex AI, Pinecone, Redis and Firestore with realistic latency.
+
+install() patches the client libraries, so it must run before main, or anything
+else that imports the models or storage modules. Each stand-in sleeps for a
+latency drawn from its distribution in the active profile, then does the work
+in memory. Every call is counted in CALLS, so a benchmark can report external
+calls per chat turn:
+
+    generate         Gemini generate_content[_stream], sync or async
+    embed            embed_content calls (a batched call counts once)
+    embed_texts      texts embedded across those calls
+    count_tokens     count_tokens calls (the Vertex warm-up probe)
+    vertex_client    google.genai clients built, once per region
+    pinecone_query   index queries
+    pinecone_upsert  upsert calls
+    redis            round-trips; a pipeline counts once
+    firestore        document reads and commits
+
+Redis is fakeredis, which implements the TS.* time-series commands the
+metrics code uses.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+import types
+import numpy as np
+
+DIMENSION = 768
+RESPONSE_WORDS = "retrieval augmented generation grounds the model in context fetched from the vector index".split()
+
+
+class Latency:
+    """Log-normal latency described by its median and p99, in seconds"""
+
+    def __init__(self, median: float, p99: float):
+        self.median = median
+        self.p99 = max(p99, median)
+        # 2.326 is the z-score of the 99th percentile
+        self.sigma = math.log(self.p99 / median) / 2.326 if median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, text: str) -> "Latency":
+        """'0.6,2.5' (median,p99) or a single fixed value"""
+        parts = [float(p) for p in text.split(",")]
+        return cls(parts[0], parts[-1])
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0, self.sigma))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"median": self.median, "p99": self.p99}
+
+
+DEFAULT_PROFILE: Dict[str, Latency] = {
+    "generate_first_chunk": Latency(0.6, 2.5),  # Gemini time to first streamed chunk
+    "generate_chunk": Latency(0.04, 0.15),  # between streamed chunks
+    "embed": Latency(0.08, 0.3),
+    "pinecone_query": Latency(0.03, 0.12),
+    "pinecone_upsert": Latency(0.05, 0.2),
+    "firestore": Latency(0.015, 0.08),
+    "redis": Latency(0.0005, 0.003),  # per round-trip
+}
+RESPONSE_CHUNKS = 12  # streamed chunks per generated reply
+
+PROFILE: Dict[str, Latency] = dict(DEFAULT_PROFILE)
+CALLS: Counter = Counter()
+_calls_lock = threading.Lock()
+
+
+def count(name: str, n: int = 1) -> None:
+    with _calls_lock:
+        CALLS[name] += n
+
+
+def reset_calls() -> Dict[str, int]:
+    """Zero the counters, returning what they held"""
+    with _calls_lock:
+        snapshot = dict(CALLS)
+        CALLS.clear()
+    return snapshot
+
+
+def _delay(name: str) -> None:
+    time.sleep(PROFILE[name].sample())
+
+
+async def _delay_async(name: str) -> None:
+    await asyncio.sleep(PROFILE[name].sample())
+
+
+def _vector(text: str) -> List[float]:
+    """Deterministic unit vector for a text, so repeated texts embed identically"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=DIMENSION)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+# Gemini
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Stream:
+    def __init__(self, chunks: List[str]):
+        self._chunks = chunks
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                await _delay_async("generate_chunk")
+            yield _Chunk(chunk)
+
+
+def _reply_chunks() -> List[str]:
+    return [" ".join(random.choices(RESPONSE_WORDS, k=5)) + " " for _ in range(RESPONSE_CHUNKS)]
+
+
+class _Embedding:
+    def __init__(self, values: List[float]):
+        self.values = values
+
+
+class _EmbedResponse:
+    def __init__(self, embeddings: List[List[float]]):
+        self.embeddings = [_Embedding(values) for values in embeddings]
+
+
+class _TokenCount:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+
+def _contents(contents) -> List[str]:
+    return contents if isinstance(contents, list) else [contents]
+
+
+class _FakeModels:
+    """google.genai's client.models"""
+
+    def generate_content(self, model=None, contents=None, config=None):
+        count("generate")
+        chunks = _reply_chunks()
+        _delay("generate_first_chunk")
+        for _ in chunks[1:]:
+            _delay("generate_chunk")
+        return _Chunk("".join(chunks))
+
+    def embed_content(self, model=None, contents=None, config=None):
+        texts = _contents(contents)
+        count("embed")
+        count("embed_texts", len(texts))
+        _delay("embed")
+        return _EmbedResponse([_vector(text) for text in texts])
+
+    def count_tokens(self, model=None, contents=None, config=None):
+        count("count_tokens")
+        _delay("embed")
+        return _TokenCount(sum(len(str(text).split()) for text in _contents(contents)))
+
+
+class _FakeAsyncModels:
+    """google.genai's client.aio.models"""
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        count("generate")
+        chunks = _reply_chunks()
+        await _delay_async("generate_first_chunk")
+        for _ in chunks[1:]:
+            await _delay_async("generate_chunk")
+        return _Chunk("".join(chunks))
+
+    async def generate_content_stream(self, model=None, contents=None, config=None):
+        count("generate")
+        chunks = _reply_chunks()
+        await _delay_async("generate_first_chunk")
+        return _Stream(chunks)
+
+    async def embed_content(self, model=None, contents=None, config=None):
+        texts = _contents(contents)
+        count("embed")
+        count("embed_texts", len(texts))
+        await _delay_async("embed")
+        return _EmbedResponse([_vector(text) for text in texts])
+
+    async def count_tokens(self, model=None, contents=None, config=None):
+        count("count_tokens")
+        await _delay_async("embed")
+        return _TokenCount(sum(len(str(text).split()) for text in _contents(contents)))
+
+
+class FakeGenaiClient:
+    def __init__(self, vertexai: bool = False, project: Optional[str] = None, location: Optional[str] = None, **kwargs):
+        count("vertex_client")
+        self.location = location
+        self.models = _FakeModels()
+        self.aio = types.SimpleNamespace(models=_FakeAsyncModels())
+
+
+# Pinecone
+
+class FakeIndex:
+    """Brute-force cosine index with equality metadata filters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._metadata: List[Dict[str, Any]] = []
+        self._matrix = np.zeros((0, DIMENSION), dtype=np.float32)
+
+    def upsert(self, vectors, **kwargs):
+        count("pinecone_upsert")
+        _delay("pinecone_upsert")
+        with self._lock:
+            new_rows = []
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype=np.float32)
+                values /= np.linalg.norm(values) or 1.0
+                position = self._positions.get(vector["id"])
+                if position is None:
+                    self._positions[vector["id"]] = len(self._ids) + len(new_rows)
+                    new_rows.append(values)
+                    self._metadata.append(vector.get("metadata", {}))
+                    self._ids.append(vector["id"])
+                else:
+                    self._matrix[position] = values
+                    self._metadata[position] = vector.get("metadata", {})
+            if new_rows:
+                self._matrix = np.vstack([self._matrix, np.stack(new_rows)])
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k=10, include_metadata=False, include_values=False, filter=None, **kwargs):
+        count("pinecone_query")
+        _delay("pinecone_query")
+        with self._lock:
+            if not self._ids:
+                return {"matches": []}
+            scores = self._matrix @ np.asarray(vector, dtype=np.float32) / (np.linalg.norm(vector) or 1.0)
+            order = np.argsort(-scores)
+            matches = []
+            for position in order:
+                metadata = self._metadata[position]
+                if filter and any(metadata.get(key) != value for key, value in filter.items()):
+                    continue
+                match = {"id": self._ids[position], "score": float(scores[position])}
+                if include_metadata:
+                    match["metadata"] = dict(metadata)
+                if include_values:
+                    match["values"] = self._matrix[position].tolist()
+                matches.append(match)
+                if len(matches) >= top_k:
+                    break
+        return {"matches": matches}
+
+
+class FakePinecone:
+    indexes: Dict[str, FakeIndex] = {}
+
+    def __init__(self, api_key=None, **kwargs):
+        pass
+
+    def list_indexes(self):
+        return {"indexes": [{"name": name} for name in self.indexes]}
+
+    def create_index(self, name, dimension=DIMENSION, **kwargs):
+        self.indexes.setdefault(name, FakeIndex())
+
+    def Index(self, name):
+        return self.indexes.setdefault(name, FakeIndex())
+
+
+# Firestore
+
+class _Snapshot:
+    def __init__(self, doc_id: str, data: Dict[str, Any]):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+
+class _DocumentReference:
+    def __init__(self, store: Dict[str, Dict[str, Any]], doc_id: str):
+        self._store = store
+        self.id = doc_id
+
+    async def get(self):
+        count("firestore")
+        await _delay_async("firestore")
+        return _Snapshot(self.id, self._store.get(self.id, {}))
+
+    async def update(self, fields: Dict[str, Any]):
+        count("firestore")
+        await _delay_async("firestore")
+        self._store[self.id].update(fields)
+
+
+class _Query:
+    def __init__(self, store: Dict[str, Dict[str, Any]], filters=(), limit: Optional[int] = None):
+        self._store = store
+        self._filters = list(filters)
+        self._limit = limit
+
+    def where(self, filter=None, **kwargs):
+        return _Query(self._store, self._filters + [filter], self._limit)
+
+    def limit(self, n: int):
+        return _Query(self._store, self._filters, n)
+
+    async def stream(self):
+        count("firestore")
+        await _delay_async("firestore")
+        found = 0
+        for doc_id, data in list(self._store.items()):
+            if all(data.get(f.field_path) == f.value for f in self._filters):
+                yield _Snapshot(doc_id, data)
+                found += 1
+                if self._limit is not None and found >= self._limit:
+                    return
+
+    async def get(self):
+        return [snapshot async for snapshot in self.stream()]
+
+
+class _Collection(_Query):
+    def document(self, doc_id: str) -> _DocumentReference:
+        return _DocumentReference(self._store, doc_id)
+
+
+class _Batch:
+    def __init__(self):
+        self._writes = []
+
+    def create(self, ref: _DocumentReference, data: Dict[str, Any]):
+        self._writes.append(("create", ref, data))
+
+    def set(self, ref: _DocumentReference, data: Dict[str, Any]):
+        self._writes.append(("set", ref, data))
+
+    async def commit(self):
+        from google.api_core.exceptions import Conflict
+        count("firestore")
+        await _delay_async("firestore")
+        for kind, ref, _ in self._writes:
+            if kind == "create" and ref.id in ref._store:
+                raise Conflict(f"Document already exists: {ref.id}")
+        for _, ref, data in self._writes:
+            ref._store[ref.id] = dict(data)
+
+
+class FakeFirestore:
+    """The slice of firestore.AsyncClient that storage/users.py uses"""
+
+    collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    _firestore_api_internal = None  # no gRPC channel to close
+
+    @classmethod
+    def from_service_account_json(cls, path=None, **kwargs):
+        return cls()
+
+    def collection(self, name: str) -> _Collection:
+        return _Collection(self.collections.setdefault(name, {}))
+
+    def batch(self) -> _Batch:
+        return _Batch()
+
+    def close(self):
+        pass
+
+
+# Redis
+
+def _install_redis() -> None:
+    try:
+        import fakeredis
+        import fakeredis.aioredis
+    except ImportError:
+        raise SystemExit("Install fakeredis to run the offline benchmarks")
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server)
+
+        def execute_command(self, *args, **options):
+            count("redis")
+            _delay("redis")
+            return super().execute_command(*args, **options)
+
+    class FakeAsyncRedis(fakeredis.aioredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server)
+
+        async def execute_command(self, *args, **options):
+            count("redis")
+            await _delay_async("redis")
+            return await super().execute_command(*args, **options)
+
+    sync_execute = redis.client.Pipeline.execute
+    async_execute = redis.asyncio.client.Pipeline.execute
+
+    def pipeline_execute(self, *args, **kwargs):
+        count("redis")
+        _delay("redis")
+        return sync_execute(self, *args, **kwargs)
+
+    async def async_pipeline_execute(self, *args, **kwargs):
+        count("redis")
+        await _delay_async("redis")
+        return await async_execute(self, *args, **kwargs)
+
+    redis.Redis = FakeRedis
+    redis.asyncio.Redis = FakeAsyncRedis
+    redis.asyncio.ConnectionPool = lambda *args, **kwargs: None
+    redis.asyncio.BlockingConnectionPool = lambda *args, **kwargs: None
+    redis.client.Pipeline.execute = pipeline_execute
+    redis.asyncio.client.Pipeline.execute = async_pipeline_execute
+
+
+def install(profile: Optional[Dict[str, Latency]] = None) -> None:
+    """Patch every external client library; call before importing the app"""
+    PROFILE.update(profile or {})
+
+    from google import genai
+    genai.Client = FakeGenaiClient
+
+    import pinecone
+    pinecone.Pinecone = FakePinecone
+
+    from google.cloud import firestore
+    firestore.AsyncClient = FakeFirestore
+
+    _install_redis()
@@ -0,0 +1,377 @@
+"""Offline load test of the chat server against stand-ins for every external service.
+
+Starts main:app under uvicorn in a child process with benchmarks.fake_services
+installed (stub Gemini and embeddings, in-memory Pinecone and Firestore,
+fakeredis), then:
+
+  1. signs up --users accounts, whose tokens the chat sessions share,
+  2. drives --sessions concurrent /api/chat WebSocket sessions of --turns turns,
+  3. meanwhile fires a burst of --login-burst concurrent logins every
+     --login-interval seconds.
+
+It reports turn latency, time to first byte, throughput, login latency,
+server event-loop lag and external calls per turn. The report is written as
+JSON to --output. Pass an earlier report as --baseline to print the change in
+each headline number.
+
+Run from the server directory; needs fakeredis and httpx:
+
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --sessions 100 --turns 5 --output after.json --baseline before.json
+    python -m benchmarks.loadtest --latency generate_first_chunk=1.2,4 --latency embed=0.05,0.2 --no-stream
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from benchmarks.fake_services import DEFAULT_PROFILE, Latency
+
+QUESTIONS = [
+    "What is retrieval augmented generation?",
+    "How does the vector index choose which context to return?",
+    "Summarize what we discussed so far.",
+    "Why would a cached answer be reused here?",
+    "Explain hedged requests in one paragraph.",
+    "What happens when a region is ejected?",
+    "How are conversation turns persisted?",
+    "Give me three examples of prompt compression.",
+    "What is the difference between p95 and p99 latency?",
+    "How should I size the Redis connection pool?",
+]
+PROBE_INTERVAL = 0.01  # event-loop lag probe period, as in login_throughput
+
+
+def _sketch_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    from utils.metrics import QuantileSketch, summarize
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    summary = summarize(sketch)
+    summary["max"] = max(values) if values else None
+    return summary
+
+
+# Server side (child process)
+
+def serve(port: int, profile: Dict[str, Latency]) -> None:
+    """Run the app on fakes, plus two harness-only routes for the parent"""
+    from benchmarks import fake_services
+    fake_services.install(profile)
+
+    import logging
+    import uvicorn
+    import main
+
+    lags: List[float] = []
+
+    async def probe():
+        while True:
+            expected = time.perf_counter() + PROBE_INTERVAL
+            await asyncio.sleep(PROBE_INTERVAL)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def reset():
+        lags.clear()
+        fake_services.reset_calls()
+        return {"status": "reset"}
+
+    async def stats():
+        return {"event_loop_lag_seconds": _sketch_summary(lags), "calls": dict(fake_services.CALLS)}
+
+    main.app.add_api_route("/_loadtest/reset", reset, methods=["POST"])
+    main.app.add_api_route("/_loadtest/stats", stats, methods=["GET"])
+
+    async def run():
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", ws_max_size=2**24))
+        probe_task = asyncio.create_task(probe())
+        try:
+            await server.serve()
+        finally:
+            probe_task.cancel()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run())
+
+
+# Client side
+
+async def wait_ready(http, timeout: float) -> Dict:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            response = await http.get("/readyz")
+            if response.status_code == 200:
+                return response.json()
+        except Exception:
+            pass
+        if time.perf_counter() > deadline:
+            raise SystemExit(f"Server not ready after {timeout}s")
+        await asyncio.sleep(0.1)
+
+
+async def create_users(http, count: int, password: str) -> List[Dict[str, str]]:
+    run_id = uuid.uuid4().hex[:8]
+
+    async def signup(i: int):
+        email = f"loadtest-{run_id}-{i}@example.com"
+        response = await http.post("/api/signup", json={"email": email, "password": password, "name": f"Load test {i}"})
+        response.raise_for_status()
+        return {"email": email, "token": response.json()["access_token"]}
+
+    return list(await asyncio.gather(*(signup(i) for i in range(count))))
+
+
+async def login_bursts(http, users, password: str, size: int, interval: float, stop: asyncio.Event, results: Dict):
+    async def login(user):
+        start = time.perf_counter()
+        try:
+            response = await http.post("/api/login", json={"email": user["email"], "password": password})
+            status = response.status_code
+        except Exception:
+            status = None
+        if status == 200:
+            results["latencies"].append(time.perf_counter() - start)
+        else:
+            results["errors"][str(status)] = results["errors"].get(str(status), 0) + 1
+
+    while not stop.is_set():
+        await asyncio.gather(*(login(random.choice(users)) for _ in range(size)))
+        results["bursts"] += 1
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def chat_session(url: str, turns: int, stream: bool, think_time: float, repeat_rate: float, delay: float, results: Dict):
+    import websockets
+
+    await asyncio.sleep(delay)
+    asked: List[str] = []
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=30) as ws:
+            for _ in range(turns):
+                if asked and random.random() < repeat_rate:
+                    message = random.choice(asked)
+                else:
+                    message = f"{random.choice(QUESTIONS)} ({uuid.uuid4().hex[:6]})"
+                asked.append(message)
+
+                start = time.perf_counter()
+                await ws.send(message)
+                frame = await ws.recv()
+                if frame.startswith('{"type": "busy"'):
+                    # Not admitted; counted, and not retried, so overload shows up in the report
+                    results["busy"] += 1
+                    continue
+                results["ttfb"].append(time.perf_counter() - start)
+                if stream:
+                    while json.loads(frame)["type"] == "delta":
+                        frame = await ws.recv()
+                    if json.loads(frame)["type"] == "error":
+                        results["errors"] += 1
+                        continue
+                results["latency"].append(time.perf_counter() - start)
+                if think_time > 0:
+                    await asyncio.sleep(random.expovariate(1 / think_time))
+    except Exception as e:
+        results["failed_sessions"] += 1
+        results["failures"].append(f"{type(e).__name__}: {e}")
+
+
+async def drive(args, base_url: str) -> Dict:
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("Install httpx to run this benchmark")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as http:
+        readiness = await wait_ready(http, args.startup_timeout)
+        password = "loadtest-password"
+        users = await create_users(http, args.users, password)
+
+        await http.post("/_loadtest/reset")
+        chat = {"latency": [], "ttfb": [], "errors": 0, "busy": 0, "failed_sessions": 0, "failures": []}
+        logins = {"latencies": [], "errors": {}, "bursts": 0}
+        stop = asyncio.Event()
+        burst_task = None
+        if args.login_burst > 0:
+            burst_task = asyncio.create_task(login_bursts(http, users, password, args.login_burst, args.login_interval, stop, logins))
+
+        ws_base = base_url.replace("http://", "ws://")
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            chat_session(
+                f"{ws_base}/api/chat?session_id=loadtest-{uuid.uuid4().hex}&stream={'true' if args.stream else 'false'}"
+                f"&token={users[i % len(users)]['token']}",
+                args.turns, args.stream, args.think_time, args.repeat_rate,
+                args.ramp * i / max(1, args.sessions), chat,
+            )
+            for i in range(args.sessions)
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if burst_task is not None:
+            await burst_task
+
+        # Let write-behind work (evaluation, Pinecone flushes, compaction) land in the call counts
+        await asyncio.sleep(args.settle)
+        server = (await http.get("/_loadtest/stats")).json()
+
+    completed = len(chat["latency"])
+    return {
+        "turns": {
+            "completed": completed,
+            "errors": chat["errors"],
+            "busy": chat["busy"],
+            "failed_sessions": chat["failed_sessions"],
+            "failures": chat["failures"][:10],
+            "throughput_per_second": completed / elapsed if elapsed > 0 else None,
+            "elapsed_seconds": elapsed,
+            "latency_seconds": _sketch_summary(chat["latency"]),
+            "time_to_first_byte_seconds": _sketch_summary(chat["ttfb"]),
+        },
+        "logins": {
+            "bursts": logins["bursts"],
+            "completed": len(logins["latencies"]),
+            "errors": logins["errors"],
+            "per_second": len(logins["latencies"]) / elapsed if elapsed > 0 else None,
+            "latency_seconds": _sketch_summary(logins["latencies"]),
+        },
+        "event_loop_lag_seconds": server["event_loop_lag_seconds"],
+        "external_calls": server["calls"],
+        "external_calls_per_turn": {name: n / completed for name, n in server["calls"].items()} if completed else {},
+        "startup": readiness["startup"],
+    }
+
+
+# Reporting
+
+HEADLINES = [
+    ("turns.throughput_per_second", True),
+    ("turns.busy", False),
+    ("turns.latency_seconds.p50", False),
+    ("turns.latency_seconds.p99", False),
+    ("turns.time_to_first_byte_seconds.p50", False),
+    ("turns.time_to_first_byte_seconds.p99", False),
+    ("logins.latency_seconds.p99", False),
+    ("event_loop_lag_seconds.p99", False),
+    ("external_calls_per_turn.redis", False),
+    ("external_calls_per_turn.embed", False),
+    ("external_calls_per_turn.pinecone_query", False),
+    ("external_calls_per_turn.generate", False),
+]
+
+
+def _lookup(report: Dict, path: str):
+    value = report["results"]
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def print_report(report: Dict, baseline: Optional[Dict]) -> None:
+    for path, higher_is_better in HEADLINES:
+        value = _lookup(report, path)
+        line = f"{path:>42}: " + (f"{value:.4f}" if value is not None else "n/a")
+        if baseline is not None:
+            before = _lookup(baseline, path)
+            if value is not None and before:
+                change = (value - before) / before * 100
+                better = change > 0 if higher_is_better else change < 0
+                line += f"   (baseline {before:.4f}, {change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})"
+        print(line)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent chat WebSocket sessions")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a reply and the next message")
+    parser.add_argument("--repeat-rate", type=float, default=0.1, help="chance a turn repeats an earlier message of its session")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which sessions connect")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="use whole-response replies instead of delta frames")
+    parser.add_argument("--login-burst", type=int, default=10, help="concurrent logins per burst; 0 disables")
+    parser.add_argument("--login-interval", type=float, default=2.0, help="seconds between login bursts")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--latency", action="append", default=[], metavar="NAME=MEDIAN,P99",
+                        help=f"override a latency distribution in seconds; names: {', '.join(DEFAULT_PROFILE)}")
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait for background work before reading counters")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default="loadtest-results.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--server-log", help="file for the server's output (default: discarded)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    profile = {}
+    for override in args.latency:
+        name, _, value = override.partition("=")
+        if name not in DEFAULT_PROFILE:
+            parser.error(f"unknown latency {name!r}; choose from {', '.join(DEFAULT_PROFILE)}")
+        profile[name] = Latency.parse(value)
+
+    if args.serve:
+        serve(args.port, {name: Latency(**value) for name, value in json.loads(args.profile).items()})
+        return
+
+    env = dict(os.environ)
+    env.update({
+        "JWT_SECRET_KEY": "loadtest-secret-" + "x" * 32,
+        "FIRESTORE_ACCOUNT_KEY_FILE": "fake-key.json",
+        "PINECONE_API_KEY": "fake",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+    })
+    full_profile = {**DEFAULT_PROFILE, **profile}
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest", "--serve", "--port", str(args.port),
+         "--profile", json.dumps({name: latency.to_dict() for name, latency in full_profile.items()})],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        results = asyncio.run(drive(args, f"http://127.0.0.1:{args.port}"))
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "timestamp": time.time(),
+        "git_commit": _git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("serve", "profile", "output", "baseline", "server_log")},
+        "latency_profile": {name: latency.to_dict() for name, latency in full_profile.items()},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"{results['turns']['completed']} turns over {args.sessions} sessions, "
+          f"{results['logins']['completed']} logins in {results['logins']['bursts']} bursts; report in {args.output}")
+    print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
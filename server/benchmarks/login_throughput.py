@@ -0,0 +1,104 @@
+"""Concurrent-login throughput and its effect on chat latency, for each place bcrypt can run.
+
+A burst of password verifications runs while a probe coroutine stands in for an
+active chat socket: it wakes every 10 ms and records how late it was. Three
+modes are compared:
+
+    inline   bcrypt on the event loop thread (the original code path)
+    threads  the shared blocking-I/O thread pool (run_blocking)
+    process  the PasswordHasher process pool used by login and signup
+
+Run from the server directory:
+
+    python -m benchmarks.login_throughput
+    python -m benchmarks.login_throughput --logins 64 --rounds 10
+"""
+import argparse
+import asyncio
+import math
+import os
+import time
+
+PROBE_INTERVAL = 0.01
+MIN_SAMPLES_FOR_PERCENTILES = 100  # below this p99 is just the max, so only the max is printed
+
+
+def nearest_rank(sorted_values: list, q: float) -> float:
+    """The q-quantile of sorted values by the nearest-rank method, so p99 never falls below p50"""
+    return sorted_values[min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1)]
+
+
+async def probe(stop: asyncio.Event, lags: list):
+    """Event-loop lag seen by a coroutine that should wake every PROBE_INTERVAL"""
+    while not stop.is_set():
+        expected = time.perf_counter() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_mode(mode: str, logins: int, password_hash: str):
+    from services.passwords import password_hasher, pwd_context
+    from utils.concurrency import run_blocking
+
+    if mode == "inline":
+        async def verify():
+            return pwd_context.verify("correct horse", password_hash)
+    elif mode == "threads":
+        async def verify():
+            return await run_blocking(pwd_context.verify, "correct horse", password_hash)
+    else:
+        await password_hasher.verify_and_update("correct horse", password_hash)  # start the worker processes
+
+        async def verify():
+            return (await password_hasher.verify_and_update("correct horse", password_hash))[0]
+
+    stop, lags = asyncio.Event(), []
+    probe_task = asyncio.create_task(probe(stop, lags))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    assert all(results)
+
+    lags.sort()
+    return {
+        "mode": mode,
+        "logins_per_second": logins / elapsed,
+        "probe_samples": len(lags),
+        "probe_lag_p50_ms": nearest_rank(lags, 0.5) * 1000 if lags else None,
+        "probe_lag_p99_ms": nearest_rank(lags, 0.99) * 1000 if lags else None,
+        "probe_lag_max_ms": lags[-1] * 1000 if lags else None,
+    }
+
+
+def describe_lag(result: dict) -> str:
+    """Probe lag percentiles, or only the max when a blocked loop left too few samples for them to mean anything"""
+    samples = result["probe_samples"]
+    if samples == 0:
+        return "no probe samples"
+    if samples < MIN_SAMPLES_FOR_PERCENTILES:
+        return f"max {result['probe_lag_max_ms']:.1f} ms ({samples} samples)"
+    return (f"p50 {result['probe_lag_p50_ms']:.1f} ms, p99 {result['probe_lag_p99_ms']:.1f} ms, "
+            f"max {result['probe_lag_max_ms']:.1f} ms ({samples} samples)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins per mode")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    args = parser.parse_args()
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)  # read by the pool's worker processes too
+
+    from services.passwords import password_hasher, pwd_context
+    password_hash = pwd_context.hash("correct horse")
+
+    print(f"{args.logins} concurrent logins, bcrypt cost {args.rounds}, {password_hasher.workers} hash processes")
+    for mode in ("inline", "threads", "process"):
+        result = asyncio.run(run_mode(mode, args.logins, password_hash))
+        print(f"{result['mode']:>8}: {result['logins_per_second']:7.1f} logins/s, chat probe lag {describe_lag(result)}")
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Redis round-trips and latency of the per-turn persistence path, before and after pipelining.
+
+Replays the writes one chat turn makes (history, turn counter, evaluator list and
+time-series samples) the old way, one command per round-trip, and the new way,
+one pipeline on the request path plus one in the evaluation worker. A fixed
+per-round-trip delay stands in for network latency so the difference is visible
+against an in-process server.
+
+Run from the server directory:
+
+    python -m benchmarks.redis_turn_writes                  # fakeredis, 1 ms simulated RTT
+    python -m benchmarks.redis_turn_writes --rtt-ms 0.5 --turns 500
+    REDIS_URL=redis://localhost:6379/15 python -m benchmarks.redis_turn_writes --rtt-ms 0
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import redis
+
+SAMPLES = {
+    "latency_seconds": 1.2,
+    "time_to_first_token_seconds": 0.4,
+    "query_relevance": 0.8,
+    "context_relevance": 0.7,
+}
+
+
+class CountingClient:
+    """Wraps a redis client, counting round-trips and adding a fixed delay to each"""
+
+    def __init__(self, client, rtt_seconds: float):
+        self.client = client
+        self.rtt_seconds = rtt_seconds
+        self.round_trips = 0
+        self.commands = 0
+
+    def _round_trip(self, commands: int) -> None:
+        self.round_trips += 1
+        self.commands += commands
+        if self.rtt_seconds:
+            time.sleep(self.rtt_seconds)
+
+    def execute_command(self, *args):
+        self._round_trip(1)
+        return self.client.execute_command(*args)
+
+    def execute_pipeline(self, pipe):
+        self._round_trip(len(pipe.command_stack))
+        return pipe.execute()
+
+
+def connect():
+    url = os.getenv("REDIS_URL")
+    if url:
+        return redis.Redis.from_url(url)
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("Set REDIS_URL or install fakeredis to run this benchmark")
+    return fakeredis.FakeRedis()
+
+
+def create_series(client) -> None:
+    for name in SAMPLES:
+        try:
+            client.execute_command("TS.CREATE", f"bench:metric:{name}", "DUPLICATE_POLICY", "LAST",
+                                   "LABELS", "metric", name, "kind", "raw")
+        except redis.ResponseError:
+            pass
+
+
+def turn_before(r: CountingClient, turn: int) -> None:
+    """One command per round-trip, with the TS.INFO existence check on every sample"""
+    r.execute_command("RPUSH", "bench:chat_history", f"User: question {turn}")
+    r.execute_command("RPUSH", "bench:chat_history", f"Chatbot: answer {turn}")
+    r.execute_command("INCR", "bench:chat_turns")
+    r.execute_command("LPUSH", "bench:response_metrics", json.dumps(SAMPLES))
+    r.execute_command("EXPIRE", "bench:response_metrics", 60*60*24*30)
+    timestamp = int(time.time() * 1000)
+    for name, value in SAMPLES.items():
+        r.execute_command("TS.INFO", f"bench:metric:{name}")
+        r.execute_command("TS.ADD", f"bench:metric:{name}", timestamp, value)
+
+
+def turn_after(r: CountingClient, turn: int) -> None:
+    """History and turn counter in one MULTI, evaluator writes in one pipeline"""
+    pipe = r.client.pipeline(transaction=True)
+    pipe.rpush("bench:chat_history", f"User: question {turn}", f"Chatbot: answer {turn}")
+    pipe.incr("bench:chat_turns")
+    r.execute_pipeline(pipe)
+
+    timestamp = int(time.time() * 1000)
+    samples = []
+    for name, value in SAMPLES.items():
+        samples.extend([f"bench:metric:{name}", timestamp, value])
+    pipe = r.client.pipeline(transaction=False)
+    pipe.lpush("bench:response_metrics", json.dumps(SAMPLES))
+    pipe.expire("bench:response_metrics", 60*60*24*30)
+    pipe.execute_command("TS.MADD", *samples)
+    r.execute_pipeline(pipe)
+
+
+def run(name, turn_fn, client, turns: int, rtt_seconds: float):
+    r = CountingClient(client, rtt_seconds)
+    latencies = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        turn_fn(r, turn)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "path": name,
+        "round_trips_per_turn": r.round_trips / turns,
+        "commands_per_turn": r.commands / turns,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="simulated network delay per round-trip")
+    args = parser.parse_args()
+
+    client = connect()
+    client.delete("bench:chat_history", "bench:chat_turns", "bench:response_metrics",
+                  *[f"bench:metric:{name}" for name in SAMPLES])
+    create_series(client)
+
+    for result in (
+        run("before", turn_before, client, args.turns, args.rtt_ms / 1000),
+        run("after", turn_after, client, args.turns, args.rtt_ms / 1000),
+    ):
+        print(f"{result['path']:>6}: {result['round_trips_per_turn']:.0f} round-trips, "
+              f"{result['commands_per_turn']:.0f} commands, "
+              f"mean {result['mean_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms per turn")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Cost of the tracing instrumentation on the chat path.
+
+Times an empty `with tracer.span(...)` block outside any trace, inside an
+unsampled trace and inside a sampled one, and the cost of opening and closing
+a trace. A turn opens one trace and about ten spans.
+
+Run from the server directory:
+
+    python -m benchmarks.tracing_overhead
+    python -m benchmarks.tracing_overhead --iterations 1000000
+"""
+import argparse
+import time
+
+
+def per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    func(iterations)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    from utils.tracing import Tracer
+
+    def spans(tracer):
+        def run(n):
+            for _ in range(n):
+                with tracer.span("stage"):
+                    pass
+        return run
+
+    def spans_in_trace(sample_rate):
+        tracer = Tracer(sample_rate, 300)
+
+        def run(n):
+            # New trace every 10 spans, as in a turn, so sampled span lists stay realistic
+            for i in range(0, n, 10):
+                with tracer.trace("session"):
+                    for _ in range(min(10, n - i)):
+                        with tracer.span("stage"):
+                            pass
+        return run
+
+    def traces(n):
+        tracer = Tracer(0.0, 300)
+        for _ in range(n):
+            with tracer.trace("session"):
+                pass
+
+    results = {
+        "span, no trace": per_call(spans(Tracer(0.0, 300)), args.iterations),
+        "span, unsampled trace": per_call(spans_in_trace(0.0), args.iterations),
+        "span, sampled trace": per_call(spans_in_trace(1.0), args.iterations),
+        "trace open/close": per_call(traces, args.iterations),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>24}: {seconds * 1e6:6.2f} us")
+    turn = results["trace open/close"] + 10 * results["span, unsampled trace"]
+    print(f"{'per turn (10 spans)':>24}: {turn * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
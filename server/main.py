@@ -1,18 +1,69 @@
+from services.readiness import readiness, FirstRequestTimer
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from routes.routes import router as chat_router
 from fastapi.middleware.cors import CORSMiddleware
-from storage.redis import redis_client
+from storage.redis import async_redis_client
 from services.logger import configure_logging
+from utils.concurrency import get_executor, run_blocking
+from middlewares.evaluation import evaluator, evaluation_queue
+from middlewares.cluster_metrics import metrics_publisher
+from storage.pinecone import upsert_buffer, get_index
+from storage.session_index import session_index_sync
+from services.memory import conversation_memory
+from services.persistence import turn_persister
+from services.admission import chat_admission
+from storage.users import user_store
+from services.passwords import password_hasher
+from middlewares.token import token_verifier
+from models import embedding, llm
+from utils.tracing import tracer
 import logging
 
 configure_logging()
 logger = logging.getLogger(__name__)
 
+async def _warm_vertex():
+    await asyncio.gather(llm.warm_up(), embedding.warm_up())
+
+readiness.register("redis", lambda: async_redis_client.ping())
+readiness.register("pinecone", lambda: run_blocking(get_index))
+readiness.register("firestore", user_store.ping)
+readiness.register("vertex", _warm_vertex)
+readiness.register("time_series", lambda: run_blocking(evaluator.ensure_time_series), required=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers, then warm external clients up without holding back the first request"""
+    await token_verifier.start()
+    await session_index_sync.start()
+    await evaluation_queue.start()
+    await upsert_buffer.start()
+    await metrics_publisher.start()
+    await readiness.start()
+    yield
+    # Release pooled connections and blocking-I/O threads
+    await readiness.stop()
+    await turn_persister.stop()
+    await evaluation_queue.stop()
+    await upsert_buffer.stop()
+    await metrics_publisher.stop()
+    await conversation_memory.stop()
+    await session_index_sync.stop()
+    await token_verifier.stop()
+    await user_store.close()
+    await async_redis_client.aclose()
+    get_executor().shutdown(wait=False)
+    password_hasher.shutdown()
+
 app = FastAPI(
     title="Shashtra API",
     description="API for chat application with authentication",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 origins = [
     "http://localhost:3000",  # React frontend default
@@ -30,24 +81,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so it sees the first request before anything else handles it
+app.add_middleware(FirstRequestTimer, readiness=readiness)
+
 app.include_router(chat_router, prefix="/api")
 
 @app.get("/", tags=["Health"])
+@app.get("/healthz", tags=["Health"])
 async def health_check():
-    """Health check endpoint for monitoring"""
-    try:
-        logger.info("Checking Redis connection")
-        redis_status = redis_client.ping()
-        
-        return {
-            "status": "healthy", 
-            "services": {
-                "redis": "connected" if redis_status else "disconnected"
-            }
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {"status": "unhealthy", "error": str(e)}
+    """Liveness probe: the process is serving; touches no dependencies"""
+    return {"status": "healthy"}
+
+@app.get("/readyz", tags=["Health"])
+async def readiness_check():
+    """Readiness probe: state of each external dependency, 503 until the required ones are warm"""
+    stats = readiness.get_stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Per-stage chat pipeline latency and admission queue of this process, for Prometheus to scrape"""
+    return PlainTextResponse(tracer.prometheus() + chat_admission.prometheus(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     logger.info("Starting Shashtra API server")
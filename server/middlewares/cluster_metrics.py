@@ -0,0 +1,227 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from middlewares.evaluation import (
+    ResponseEvaluator,
+    aggregate_snapshot,
+    evaluator,
+    rollup_key,
+    QUANTILE_SERIES,
+    WINDOWS,
+)
+from redis.exceptions import WatchError
+from storage.redis import async_redis_client
+from utils.config import METRICS_PUBLISH_INTERVAL_SECONDS, METRICS_SNAPSHOT_TTL_SECONDS
+from utils.metrics import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+INSTANCES_KEY = "metrics:live_instances"  # zset of instance IDs, scored by when their snapshot expires
+RETIRED_KEY = "metrics:retired"  # lifetime counters and sketches of instances that have shut down
+QUANTILE_LOCK_TTL_SECONDS = 120
+
+
+def _snapshot_key(instance_id: str) -> str:
+    return f"metrics:snapshot:{instance_id}"
+
+
+def encode_snapshot(snapshot: Dict[str, Any]) -> str:
+    return json.dumps({
+        "counters": snapshot["counters"],
+        "sketches": {name: sketch.to_dict() for name, sketch in snapshot["sketches"].items()},
+    })
+
+
+def decode_snapshot(payload: bytes) -> Dict[str, Any]:
+    data = json.loads(payload)
+    return {
+        "counters": data["counters"],
+        "sketches": {name: QuantileSketch.from_dict(sketch) for name, sketch in data["sketches"].items()},
+    }
+
+
+def _decode(value: Any) -> Any:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _mrange_series(reply: Any) -> List[Tuple[Dict[str, str], List[Any]]]:
+    """(labels, samples) per series of a TS.MRANGE WITHLABELS reply, RESP2 list or RESP3 map"""
+    if isinstance(reply, dict):
+        entries = [(labels, samples) for labels, _, samples in reply.values()]
+    else:
+        entries = [(dict(labels), samples) for _, labels, samples in reply]
+    return [({_decode(k): _decode(v) for k, v in labels.items()}, samples) for labels, samples in entries]
+
+
+async def query_time_series(window_ms: int, bucket: str, aggregation: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Every metric's rollup for one bucket size and aggregation, fetched with a single TS.MRANGE"""
+    end_time = int(time.time() * 1000)
+    reply = await async_redis_client.execute_command(
+        "TS.MRANGE", end_time - window_ms, end_time, "WITHLABELS",
+        "FILTER", "kind=rollup", f"bucket={bucket}", f"aggregation={aggregation}"
+    )
+    return {
+        labels["metric"]: [{"timestamp": int(point[0]), "value": float(point[1])} for point in samples]
+        for labels, samples in _mrange_series(reply)
+    }
+
+
+def _is_windowed(sketch_name: str) -> bool:
+    windowed = {f"{metric}_{name}" for metric in ("latency", "time_to_first_token") for name, _ in WINDOWS}
+    return sketch_name in windowed or sketch_name.endswith(":5m")
+
+
+def split_lifetime(snapshot: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(lifetime part, windowed part) of a snapshot; only the lifetime part outlives its instance"""
+    lifetime = {"counters": snapshot["counters"], "sketches": {}}
+    windowed = {"counters": {}, "sketches": {}}
+    for name, sketch in snapshot["sketches"].items():
+        (windowed if _is_windowed(name) else lifetime)["sketches"][name] = sketch
+    return lifetime, windowed
+
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum counters and merge sketches across processes"""
+    merged = {"counters": {}, "sketches": {}}
+    for snapshot in snapshots:
+        for name, value in snapshot["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for name, sketch in snapshot["sketches"].items():
+            if name not in merged["sketches"]:
+                merged["sketches"][name] = QuantileSketch(sketch.relative_accuracy)
+            merged["sketches"][name].merge(sketch)
+    return merged
+
+
+class MetricsPublisher:
+    """Periodically publishes this process's evaluator snapshot to Redis and merges everyone's on read"""
+
+    def __init__(self, evaluator: ResponseEvaluator, interval: float, ttl: int):
+        self.evaluator = evaluator
+        self.interval = interval
+        self.ttl = ttl
+        self._task: Optional[asyncio.Task] = None
+        self._quantile_minute = int(time.time() // 60)
+        self.publishes = 0
+        self.publish_errors = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.retire()
+        except Exception as e:
+            logger.warning(f"Could not publish final metrics snapshot: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.publish()
+                await self.publish_quantiles()
+            except Exception as e:
+                self.publish_errors += 1
+                logger.warning(f"Metrics snapshot publish failed: {e}")
+
+    async def publish(self) -> None:
+        """One pipelined round-trip per interval, independent of request volume"""
+        payload = encode_snapshot(self.evaluator.snapshot())
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.set(_snapshot_key(INSTANCE_ID), payload, ex=self.ttl)
+        pipe.zadd(INSTANCES_KEY, {INSTANCE_ID: time.time() + self.ttl})
+        await pipe.execute()
+        self.publishes += 1
+
+    async def retire(self) -> None:
+        """Leave the cluster view without losing this process's numbers.
+
+        Lifetime counters and sketches are folded into the cluster's retired
+        totals; the windowed sketches stay published until the snapshot expires,
+        so recent percentiles still include the last interval.
+        """
+        lifetime, windowed = split_lifetime(self.evaluator.snapshot())
+        async with async_redis_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(RETIRED_KEY)
+                    retired = await pipe.get(RETIRED_KEY)
+                    snapshots = [lifetime] if retired is None else [decode_snapshot(retired), lifetime]
+                    pipe.multi()
+                    pipe.set(RETIRED_KEY, encode_snapshot(merge_snapshots(snapshots)))
+                    pipe.set(_snapshot_key(INSTANCE_ID), encode_snapshot(windowed), ex=self.ttl)
+                    pipe.zadd(INSTANCES_KEY, {INSTANCE_ID: time.time() + self.ttl})
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    # Another instance retired at the same moment; merge again on top of its totals
+                    continue
+
+    async def publish_quantiles(self) -> None:
+        """Once per minute, one instance writes the cluster-wide p95 of the minute that just ended"""
+        minute = int(time.time() // 60)
+        if minute == self._quantile_minute:
+            return
+        self._quantile_minute = minute
+        if not await async_redis_client.set(f"metrics:quantiles:{minute}", INSTANCE_ID, nx=True, ex=QUANTILE_LOCK_TTL_SECONDS):
+            return
+
+        # The 1m sliding window lags the minute boundary by at most one publish interval
+        merged = merge_snapshots(list((await self.collect()).values()))
+        timestamp = (minute - 1) * 60 * 1000
+        samples = []
+        for metric_name, sketch_name in QUANTILE_SERIES.items():
+            p95 = merged["sketches"][f"{sketch_name}_1m"].quantile(0.95)
+            if p95 is not None:
+                samples.extend([rollup_key(metric_name, "p95", "1m"), timestamp, p95])
+        if samples:
+            await async_redis_client.execute_command("TS.MADD", *samples)
+
+    async def collect(self) -> Dict[str, Dict[str, Any]]:
+        """Latest snapshot of every live instance, with this process's taken fresh"""
+        # Members whose snapshot has expired drop out here; retired instances stay until then
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.zremrangebyscore(INSTANCES_KEY, "-inf", time.time())
+        pipe.zrange(INSTANCES_KEY, 0, -1)
+        _, members = await pipe.execute()
+        instance_ids = [i.decode("utf-8") if isinstance(i, bytes) else i for i in members]
+        snapshots = {INSTANCE_ID: self.evaluator.snapshot()}
+        others = [i for i in instance_ids if i != INSTANCE_ID]
+        if others:
+            payloads = await async_redis_client.mget([_snapshot_key(i) for i in others])
+            for instance_id, payload in zip(others, payloads):
+                if payload is not None:
+                    snapshots[instance_id] = decode_snapshot(payload)
+        return snapshots
+
+    async def get_retired(self) -> Optional[Dict[str, Any]]:
+        payload = await async_redis_client.get(RETIRED_KEY)
+        return decode_snapshot(payload) if payload is not None else None
+
+    async def get_cluster_metrics(self, breakdown: bool = False) -> Dict[str, Any]:
+        """Cluster-wide totals and percentiles, optionally with per-instance metrics"""
+        snapshots = await self.collect()
+        retired = await self.get_retired()
+        metrics = aggregate_snapshot(merge_snapshots(list(snapshots.values()) + ([retired] if retired else [])))
+        metrics["instance_count"] = len(snapshots)
+        if breakdown:
+            metrics["instances"] = {
+                # A shut-down instance keeps only its windowed sketches until they expire
+                instance_id: aggregate_snapshot(snapshot) if "latency" in snapshot["sketches"] else {"retired": True}
+                for instance_id, snapshot in snapshots.items()
+            }
+        return metrics
+
+
+# Global publisher for this process
+metrics_publisher = MetricsPublisher(evaluator, METRICS_PUBLISH_INTERVAL_SECONDS, METRICS_SNAPSHOT_TTL_SECONDS)
@@ -1,19 +1,127 @@
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Optional
+import asyncio
+import random
 import time
 import numpy as np
+import redis
 from models.embedding import get_embedding
 from storage.redis import redis_client
+from storage import session_metrics
+from utils.concurrency import run_blocking
+from utils.config import EVALUATION_QUEUE_SIZE, EVALUATION_WORKERS, EVALUATION_SAMPLE_RATE
+from utils.metrics import Histogram, WindowedSketch, summarize
+from utils.tracing import tracer
 import logging
-import json
 logger = logging.getLogger(__name__)
 
+WINDOWS = (("1m", 60), ("5m", 5 * 60), ("1h", 60 * 60))
+
+# Time series name -> field of the per-response metrics it samples
+TIME_SERIES = {
+    "latency_seconds": "latency_seconds",
+    "time_to_first_token_seconds": "time_to_first_token_seconds",
+    "query_relevance": "query_response_relevance",
+    "context_relevance": "context_relevance",
+    "prompt_tokens": "prompt_tokens",
+}
+TIME_SERIES_RETENTION_MS = 60*60*24*30*1000  # 30 days
+TIME_SERIES_RETRY_SECONDS = (5, 300)  # backoff between setup attempts while Redis TimeSeries is unavailable
+
+# Server-side rollups of every raw series: bucket -> (bucket length, retention), both in ms
+ROLLUP_BUCKETS = {
+    "1m": (60*1000, 60*60*24*7*1000),  # 7 days
+    "1h": (60*60*1000, 60*60*24*90*1000),  # 90 days
+}
+ROLLUP_AGGREGATIONS = ("avg", "max", "min", "count", "sum")
+
+# Percentiles can't be compacted by Redis, so a per-minute p95 is published from the merged cluster sketch
+QUANTILE_SERIES = {
+    "latency_seconds": "latency",
+    "time_to_first_token_seconds": "time_to_first_token",
+}
+
+
+def rollup_key(metric_name: str, aggregation: str, bucket: str) -> str:
+    return f"metric:{metric_name}:{aggregation}:{bucket}"
+
+def aggregate_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn counters and sketches (from one process or merged across many) into the metrics payload"""
+    counters = snapshot["counters"]
+    sketches = snapshot["sketches"]
+    latency = sketches["latency"]
+    if latency.count == 0:
+        return {"error": "No responses recorded yet"}
+
+    total_requests = counters["total_requests"]
+    time_to_first_token = sketches["time_to_first_token"]
+    return {
+        "total_requests": total_requests,
+        "successful_requests": counters["successful_requests"],
+        "success_rate": counters["successful_requests"] / total_requests if total_requests > 0 else 0,
+        "avg_latency": latency.mean(),
+        "p50_latency": latency.quantile(0.50),
+        "p95_latency": latency.quantile(0.95),
+        "p99_latency": latency.quantile(0.99),
+        "avg_context_relevance": counters["context_relevance_sum"] / counters["context_relevance_count"] if counters["context_relevance_count"] else None,
+        "avg_time_to_first_token": time_to_first_token.mean(),
+        "p50_time_to_first_token": time_to_first_token.quantile(0.50),
+        "p95_time_to_first_token": time_to_first_token.quantile(0.95),
+        "windows": {
+            name: {
+                "latency": summarize(sketches[f"latency_{name}"]),
+                "time_to_first_token": summarize(sketches[f"time_to_first_token_{name}"]),
+            }
+            for name, _ in WINDOWS
+        },
+        "semantic_cache": _cache_summary(counters),
+        "stages": _stage_summary(sketches),
+    }
+
+def _stage_summary(sketches: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-stage latency of the chat pipeline, lifetime and over the last 5 minutes"""
+    return {
+        name.split(":", 1)[1]: {
+            "lifetime": summarize(sketch),
+            "5m": summarize(sketches[f"{name}:5m"]),
+        }
+        for name, sketch in sorted(sketches.items())
+        if name.startswith("stage:") and not name.endswith(":5m")
+    }
+
+def _cache_summary(counters: Dict[str, Any]) -> Dict[str, Any]:
+    """Hit rate and latency saved by answers served from the semantic cache"""
+    hits, misses = counters["cache_hits"], counters["cache_misses"]
+    total = hits + misses
+    avg_hit_latency = counters["cache_hit_latency_total"] / hits if hits else None
+    avg_miss_latency = counters["cache_miss_latency_total"] / misses if misses else None
+    latency_saved = None
+    if avg_hit_latency is not None and avg_miss_latency is not None:
+        latency_saved = (avg_miss_latency - avg_hit_latency) * hits
+    return {
+        "hits": hits,
+        "hit_rate": hits / total if total > 0 else 0,
+        "avg_hit_latency": avg_hit_latency,
+        "avg_miss_latency": avg_miss_latency,
+        "estimated_latency_saved_seconds": latency_saved,
+    }
+
 class ResponseEvaluator:
     def __init__(self):
         self.metrics = {}
-        self.response_times = []
-        self.context_relevance_scores = []
+        # Fixed-memory sketches: lifetime totals plus 10s slices covering the last hour
+        self.response_times = WindowedSketch()
+        self.time_to_first_token = WindowedSketch()
+        self.context_relevance_sum = 0.0
+        self.context_relevance_count = 0
         self.total_requests = 0
         self.successful_requests = 0
+        self.cache_hits = 0
+        self.cache_hit_latency_total = 0.0
+        self.cache_misses = 0
+        self.cache_miss_latency_total = 0.0
+        self._time_series_ready = False
+        self._time_series_retry_at = 0.0
+        self._time_series_backoff = 0.0
     
     def start_timer(self) -> float:
         """Start timing a request"""
@@ -22,35 +130,60 @@ class ResponseEvaluator:
     def record_latency(self, start_time: float) -> float:
         """Record the latency of a request"""
         latency = time.time() - start_time
-        self.response_times.append(latency)
+        self.response_times.add(latency)
         return latency
+
+    def record_cache_result(self, cache_hit: bool, latency: float) -> None:
+        """Split latency by semantic cache outcome so the time saved by hits is visible"""
+        if cache_hit:
+            self.cache_hits += 1
+            self.cache_hit_latency_total += latency
+        else:
+            self.cache_misses += 1
+            self.cache_miss_latency_total += latency
+
+    def record_time_to_first_token(self, start_time: float) -> float:
+        """Record the time until the first streamed chunk of a request"""
+        time_to_first_token = time.time() - start_time
+        self.time_to_first_token.add(time_to_first_token)
+        return time_to_first_token
     
     def evaluate_response(self, 
                           user_query: str, 
                           response: str, 
                           context: str, 
                           session_id: str, 
-                          start_time: float) -> Dict[str, Any]:
+                          start_time: float,
+                          time_to_first_token: Optional[float] = None,
+                          latency: Optional[float] = None,
+                          score_relevance: bool = True,
+                          cache_hit: bool = False,
+                          prompt_tokens: Optional[int] = None) -> Dict[str, Any]:
         """Evaluate a single response against multiple metrics"""
         self.total_requests += 1
         
         try:
-            # 1. Latency measurement
-            latency = self.record_latency(start_time)
+            # 1. Latency measurement (may already have been recorded on the request path)
+            if latency is None:
+                latency = self.record_latency(start_time)
             
             # 2. Response length analysis
             response_length = len(response.split())
             
             # 3. Calculate semantic similarity between query and response
-            query_embedding = get_embedding(user_query)
-            response_embedding = get_embedding(response)
-            relevance_score = self._calculate_cosine_similarity(query_embedding, response_embedding)
+            if score_relevance:
+                query_embedding = get_embedding(user_query)
+                response_embedding = get_embedding(response)
+                relevance_score = self._calculate_cosine_similarity(query_embedding, response_embedding)
+            else:
+                relevance_score = None
             
             # 4. Calculate semantic similarity between context and response
-            if context and context != "No context found.":
+            if score_relevance and context and context != "No context found.":
                 context_embedding = get_embedding(context)
                 context_relevance = self._calculate_cosine_similarity(context_embedding, response_embedding)
-                self.context_relevance_scores.append(context_relevance)
+                self.context_relevance_sum += float(context_relevance)
+                self.context_relevance_count += 1
             else:
                 context_relevance = None
             
@@ -63,10 +196,14 @@ class ResponseEvaluator:
             # Compile all metrics
             response_metrics = {
                 "latency_seconds": latency,
+                "time_to_first_token_seconds": time_to_first_token,
                 "response_length_words": response_length,
                 "query_response_relevance": relevance_score,
                 "context_relevance": context_relevance,
                 "token_count": token_count,
+                "prompt_tokens": prompt_tokens,
+                "relevance_sampled": score_relevance,
+                "cache_hit": cache_hit,
                 "session_id": session_id,
                 "timestamp": time.time()
             }
@@ -82,20 +219,36 @@ class ResponseEvaluator:
     
     def get_aggregate_metrics(self) -> Dict[str, Any]:
         """Get aggregate metrics across all responses"""
-        if not self.response_times:
-            return {"error": "No responses recorded yet"}
-        
+        return aggregate_snapshot(self.snapshot())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and sketches of this process, in a form that can be merged with other processes"""
+        sketches = {
+            "latency": self.response_times.total,
+            "time_to_first_token": self.time_to_first_token.total,
+        }
+        for name, seconds in WINDOWS:
+            sketches[f"latency_{name}"] = self.response_times.window(seconds)
+            sketches[f"time_to_first_token_{name}"] = self.time_to_first_token.window(seconds)
+        # Pipeline stages: lifetime and the last 5 minutes keep the published snapshot small
+        for stage, sketch in tracer.stage_sketches().items():
+            sketches[f"stage:{stage}"] = sketch.total
+            sketches[f"stage:{stage}:5m"] = sketch.window(5 * 60)
+
         return {
-            "total_requests": self.total_requests,
-            "successful_requests": self.successful_requests,
-            "success_rate": self.successful_requests / self.total_requests if self.total_requests > 0 else 0,
-            "avg_latency": np.mean(self.response_times),
-            "p50_latency": np.percentile(self.response_times, 50),
-            "p95_latency": np.percentile(self.response_times, 95),
-            "p99_latency": np.percentile(self.response_times, 99),
-            "avg_context_relevance": np.mean(self.context_relevance_scores) if self.context_relevance_scores else None
+            "counters": {
+                "total_requests": self.total_requests,
+                "successful_requests": self.successful_requests,
+                "context_relevance_sum": self.context_relevance_sum,
+                "context_relevance_count": self.context_relevance_count,
+                "cache_hits": self.cache_hits,
+                "cache_hit_latency_total": self.cache_hit_latency_total,
+                "cache_misses": self.cache_misses,
+                "cache_miss_latency_total": self.cache_miss_latency_total,
+            },
+            "sketches": sketches,
         }
-    
+
     def _calculate_cosine_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """Calculate cosine similarity between two embeddings"""
         dot_product = np.dot(embedding1, embedding2)
@@ -103,8 +256,64 @@ class ResponseEvaluator:
         norm2 = np.linalg.norm(embedding2)
         return dot_product / (norm1 * norm2)
     
+    def ensure_time_series(self) -> None:
+        """Create the metric:* time series (with labels) and their compaction rules once, instead of checking on every write"""
+        if self._time_series_ready:
+            return
+        for metric_name in TIME_SERIES:
+            self._create_series(f"metric:{metric_name}", TIME_SERIES_RETENTION_MS, "metric", metric_name, "kind", "raw")
+            for bucket, (bucket_ms, retention_ms) in ROLLUP_BUCKETS.items():
+                for aggregation in ROLLUP_AGGREGATIONS:
+                    key = rollup_key(metric_name, aggregation, bucket)
+                    self._create_series(key, retention_ms, "metric", metric_name, "kind", "rollup",
+                                        "aggregation", aggregation, "bucket", bucket)
+                    self._ignore_existing("TS.CREATERULE", f"metric:{metric_name}", key,
+                                          "AGGREGATION", aggregation, bucket_ms)
+        for metric_name in QUANTILE_SERIES:
+            self._create_series(rollup_key(metric_name, "p95", "1m"), ROLLUP_BUCKETS["1m"][1], "metric", metric_name,
+                                "kind", "rollup", "aggregation", "p95", "bucket", "1m")
+        self._time_series_ready = True
+
+    def _time_series_available(self) -> bool:
+        """Set the series up if needed; after a failure, try again only once the backoff has passed"""
+        if self._time_series_ready:
+            return True
+        now = time.monotonic()
+        if now < self._time_series_retry_at:
+            return False
+        try:
+            self.ensure_time_series()
+            self._time_series_backoff = 0.0
+            return True
+        except Exception as e:
+            self._time_series_unavailable(e)
+            return False
+
+    def _time_series_unavailable(self, error: Exception) -> None:
+        low, high = TIME_SERIES_RETRY_SECONDS
+        self._time_series_ready = False
+        self._time_series_backoff = min(high, max(low, self._time_series_backoff * 2))
+        self._time_series_retry_at = time.monotonic() + self._time_series_backoff
+        logger.warning(f"Redis time series unavailable, retrying in {self._time_series_backoff:.0f}s: {error}")
+
+    def _create_series(self, key: str, retention_ms: int, *labels) -> None:
+        self._ignore_existing(
+            "TS.CREATE", key,
+            "RETENTION", retention_ms,
+            "DUPLICATE_POLICY", "LAST",  # workers may write the same millisecond
+            "LABELS", *labels
+        )
+
+    def _ignore_existing(self, *command) -> None:
+        try:
+            redis_client.execute_command(*command)
+        except redis.ResponseError as e:
+            # "key already exists" / "destination key already has a src rule"
+            if "already" not in str(e).lower():
+                raise
+
     def _store_metrics(self, session_id: str, metrics: Dict[str, Any]) -> None:
-        """Store metrics in Redis using JSON format"""
+        """Store per-response metrics, the session summary and time-series samples in one pipelined round-trip"""
         try:
             
             # Convert numpy values to native Python types
@@ -114,39 +323,139 @@ class ResponseEvaluator:
                     serializable_metrics[k] = float(v.item())
                 else:
                     serializable_metrics[k] = v
-                    
-            # Store as JSON string
-            redis_client.lpush(f"response_metrics:{session_id}", json.dumps(serializable_metrics))
-            
-            # Set expiry to prevent unlimited growth
-            redis_client.expire(f"response_metrics:{session_id}", 60*60*24*30)  # 30 days
+
+            timestamp = int(serializable_metrics["timestamp"] * 1000)  # Redis TS uses milliseconds
+            samples = []
+            for metric_name, field in TIME_SERIES.items():
+                if serializable_metrics.get(field) is not None:
+                    samples.extend([f"metric:{metric_name}", timestamp, serializable_metrics[field]])
+
+            pipe = redis_client.pipeline(transaction=False)
+            # Compact per-interaction record plus the session's running summary, whether or not TS works
+            session_metrics.record(pipe, session_id, serializable_metrics)
+            add_samples = bool(samples) and self._time_series_available()
+            if add_samples:
+                pipe.execute_command("TS.MADD", *samples)
+            results = pipe.execute(raise_on_error=False)
+            if add_samples and isinstance(results[-1], Exception):
+                self._time_series_unavailable(results[-1])
+            for result in results[:-1] if add_samples else results:
+                if isinstance(result, Exception):
+                    raise result
         except Exception as e:
             logger.error(f"Error storing metrics in Redis: {e}")
 
-    def _store_time_metrics(self, metric_name: str, value: float):
-        """Store time-based metrics using Redis Time Series"""
+
+class EvaluationQueue:
+    """Bounded queue of finished turns, scored off the request path by background workers"""
+
+    def __init__(self, evaluator: ResponseEvaluator, maxsize: int, workers: int, sample_rate: float):
+        self.evaluator = evaluator
+        self.maxsize = maxsize
+        self.workers = workers
+        self.sample_rate = sample_rate
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.last_lag = None
+        self.lag_histogram = Histogram([0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30])
+
+    async def start(self) -> None:
+        """Create the queue and spawn the worker pool on the running loop"""
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Give queued evaluations a moment to finish, then cancel the workers"""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {self._queue.qsize()} pending evaluations on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self,
+               user_query: str,
+               response: str,
+               context: str,
+               session_id: str,
+               start_time: float,
+               time_to_first_token: Optional[float] = None,
+               cache_hit: bool = False,
+               prompt_tokens: Optional[int] = None) -> bool:
+        """Record latency inline and queue the rest of the evaluation; never blocks"""
+        latency = self.evaluator.record_latency(start_time)
+        self.evaluator.record_cache_result(cache_hit, latency)
+        job = {
+            "user_query": user_query,
+            "response": response,
+            "context": context,
+            "session_id": session_id,
+            "start_time": start_time,
+            "time_to_first_token": time_to_first_token,
+            "latency": latency,
+            "score_relevance": random.random() < self.sample_rate,
+            "cache_hit": cache_hit,
+            "prompt_tokens": prompt_tokens,
+            "enqueued_at": time.time(),
+        }
+
+        if self._queue is None:
+            self.dropped += 1
+            return False
         try:
-            print("metric_name: ",metric_name)
-            # Convert NumPy float to Python float
-            if hasattr(value, "item") and callable(getattr(value, "item")):
-                value = float(value.item())
-            
-            # Check if timeseries exists, create if not
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
             try:
-                redis_client.execute_command("TS.INFO", f"metric:{metric_name}")
-            except:
-                # Create timeseries with retention of 30 days
-                redis_client.execute_command(
-                    "TS.CREATE", f"metric:{metric_name}", 
-                    "RETENTION", 60*60*24*30*1000  # 30 days in milliseconds
-                )
-            
-            # Add data point with current timestamp
-            timestamp = int(time.time() * 1000)  # Redis TS uses milliseconds
-            redis_client.execute_command("TS.ADD", f"metric:{metric_name}", timestamp, value)
-            
-        except Exception as e:
-            logger.error(f"Error storing time metrics: {e}")
+                enqueued_at = job.pop("enqueued_at")
+                tracer.record("evaluation_wait", time.time() - enqueued_at)
+                with tracer.span("evaluation"):
+                    await run_blocking(self._evaluate_and_store, **job)
+                self.processed += 1
+                self.last_lag = time.time() - enqueued_at
+                self.lag_histogram.observe(self.last_lag)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Background evaluation failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _evaluate_and_store(self, **job) -> Dict[str, Any]:
+        """Run the (blocking) evaluator, which stores the turn's metrics in one pipeline"""
+        metrics = self.evaluator.evaluate_response(**job)
+        if "error" in metrics:
+            raise RuntimeError(metrics["error"])
+        return metrics
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, drops and lag for the metrics endpoint"""
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "sample_rate": self.sample_rate,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "failed": self.failed,
+            "last_lag_seconds": self.last_lag,
+            "lag_seconds": self.lag_histogram.snapshot(),
+        }
 
 # Global evaluator instance
-evaluator = ResponseEvaluator()
\ No newline at end of file
+evaluator = ResponseEvaluator()
+evaluation_queue = EvaluationQueue(evaluator, EVALUATION_QUEUE_SIZE, EVALUATION_WORKERS, EVALUATION_SAMPLE_RATE)
\ No newline at end of file
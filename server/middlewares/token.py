@@ -1,35 +1,179 @@
 import jwt
 from fastapi import HTTPException, Request, WebSocket, WebSocketDisconnect
-import os
-from datetime import datetime
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import threading
+import time
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from storage.redis import get_redis_client
+from storage.redis import async_redis_client
+from utils.config import JWT_SECRET_KEY, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
 
 security = HTTPBearer()
 
-def verify_jwt_token(request: Request = None, websocket: WebSocket = None):
-    # Extract token from either HTTP request or WebSocket
-    token = None
-    
-    if request:
-        # Regular HTTP request
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-    elif websocket:
-        # WebSocket connection
-        headers = websocket.headers
-        auth_header = headers.get("authorization")
+ALGORITHM = "HS256"
+REVOKED_KEY = "auth:revoked"  # sorted set: token id -> expiry, so entries can be pruned once the token is dead anyway
+REVOCATIONS_CHANNEL = "auth:revocations"
+
+
+def token_id(payload: Dict[str, Any], token: str) -> str:
+    """The jti claim, or a digest of the token for tokens issued before jti was added"""
+    return payload.get("jti") or hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenVerifier:
+    """Verifies JWTs locally against the shared key, with a small cache of validated tokens
+    and an in-process denylist kept current over Redis pub/sub"""
+
+    def __init__(self, secret: Optional[str], cache_size: int, cache_ttl: float):
+        self.secret = secret
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()  # token -> (user_id, jti, valid until)
+        self._revoked: Dict[str, float] = {}  # jti -> token expiry
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.cache_hits = 0
+        self.verifications = 0
+        self.rejected = 0
+        self.revoked_rejections = 0
+
+    def verify(self, token: str) -> Optional[str]:
+        """user_id for a valid, unexpired, unrevoked token, otherwise None; never touches Redis"""
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None and entry[2] > now:
+                self._cache.move_to_end(token)
+                if entry[1] in self._revoked:
+                    self.revoked_rejections += 1
+                    return None
+                self.cache_hits += 1
+                return entry[0]
+
+        self.verifications += 1
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[ALGORITHM], options={"require": ["exp"]})
+        except jwt.InvalidTokenError:
+            self.rejected += 1
+            return None
+        user_id = payload.get("user_id")
+        if not user_id:
+            self.rejected += 1
+            return None
+
+        jti = token_id(payload, token)
+        with self._lock:
+            if jti in self._revoked:
+                self.revoked_rejections += 1
+                return None
+            self._cache[token] = (user_id, jti, min(now + self.cache_ttl, payload["exp"]))
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user_id
+
+    def _add_revoked(self, jti: str, expires_at: float) -> None:
+        with self._lock:
+            now = time.time()
+            if expires_at > now:
+                self._revoked[jti] = expires_at
+            if len(self._revoked) > self.cache_size:
+                self._revoked = {j: e for j, e in self._revoked.items() if e > now}
+
+    async def revoke(self, token: str) -> bool:
+        """Deny a token on every worker until it expires; False if it wasn't a valid token"""
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[ALGORITHM], options={"require": ["exp"]})
+        except jwt.InvalidTokenError:
+            return False
+        jti = token_id(payload, token)
+        self._add_revoked(jti, payload["exp"])
+        pipe = async_redis_client.pipeline(transaction=True)
+        pipe.zadd(REVOKED_KEY, {jti: payload["exp"]})
+        pipe.zremrangebyscore(REVOKED_KEY, "-inf", time.time())
+        pipe.publish(REVOCATIONS_CHANNEL, f"{jti} {payload['exp']}")
+        await pipe.execute()
+        return True
+
+    async def _load_denylist(self) -> None:
+        entries = await async_redis_client.zrangebyscore(REVOKED_KEY, time.time(), "+inf", withscores=True)
+        for jti, expires_at in entries:
+            self._add_revoked(jti.decode("utf-8") if isinstance(jti, bytes) else jti, expires_at)
+
+    async def start(self) -> None:
+        if not self.secret:
+            raise RuntimeError("JWT_SECRET_KEY must be set to the key shared by every worker and instance")
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = async_redis_client.pubsub()
+            try:
+                await pubsub.subscribe(REVOCATIONS_CHANNEL)
+                # Load after subscribing, so a revocation published in between isn't missed
+                await self._load_denylist()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = message["data"].decode("utf-8") if isinstance(message["data"], bytes) else message["data"]
+                    jti, expires_at = data.split(" ", 1)
+                    self._add_revoked(jti, float(expires_at))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Token revocation listener disconnected: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached_tokens": len(self._cache),
+                "revoked_tokens": len(self._revoked),
+                "cache_hits": self.cache_hits,
+                "verifications": self.verifications,
+                "rejected": self.rejected,
+                "revoked_rejections": self.revoked_rejections,
+            }
+
+
+# Global verifier; the revocation listener starts with the app
+token_verifier = TokenVerifier(JWT_SECRET_KEY, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        return auth_header.split(" ")[1]
+    return None
+
+
+async def verify_jwt_token(request: Request) -> Optional[str]:
+    """user_id of the bearer token on an HTTP request, or None"""
+    token = bearer_token(request)
+    if not token:
+        return None
+    return token_verifier.verify(token)
+
+
+async def verify_ws_token(websocket: WebSocket, token: Optional[str] = None) -> Optional[str]:
+    """user_id for a WebSocket, from the `token` query parameter (browsers can't set headers) or the header"""
+    if not token:
+        auth_header = websocket.headers.get("authorization")
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
-    
     if not token:
         return None
-        
-    # Verify token in Redis
-    redis_client = get_redis_client()
-    user_id = redis_client.get(token)
-    if user_id:
-        return user_id.decode("utf-8") if isinstance(user_id, bytes) else user_id
-    
-    return None
\ No newline at end of file
+    return token_verifier.verify(token)
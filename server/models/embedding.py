@@ -1,23 +1,171 @@
-from google.cloud import aiplatform as vertexai
-from google.generativeai import GenerativeModel, embed_content
-import os
-import random
-from utils.config import REGIONS
+from typing import Dict, List, Tuple
+import asyncio
+import logging
+import time
+from utils.config import (
+    REGIONS,
+    EMBEDDING_MODEL,
+    EMBEDDING_VERTEX,
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_BATCH_WAIT_MS,
+    REGION_EWMA_ALPHA,
+    REGION_FAILURE_THRESHOLD,
+    REGION_EJECTION_SECONDS,
+)
+from utils.metrics import Histogram
+from utils.concurrency import run_blocking
+from models.regions import RegionPool
+from storage.embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a region in the stats when embeddings go to the Gemini API's one global endpoint
+GEMINI_API_REGION = "gemini-api"
+
+# Embedding latencies are tracked apart from generation so they don't skew each other
+region_pool = RegionPool(REGIONS if EMBEDDING_VERTEX else [GEMINI_API_REGION], REGION_EWMA_ALPHA,
+                         REGION_FAILURE_THRESHOLD, REGION_EJECTION_SECONDS, vertexai=EMBEDDING_VERTEX)
 
 def get_text_embedding_model():
-    vertexai.init(project=os.getenv("PROJECT_ID"), location=REGIONS[random.randint(0, 25)])  # Initialize Vertex AI
-    
-    model = "models/embedding-001"
-    
-    return model
-
-def get_embedding(text):
-    model = get_text_embedding_model()
-    
-    result = embed_content(
-        model=model,
-        content=text,
-        task_type="retrieval_document"
-    )
-    
-    return result["embedding"]
+    return EMBEDDING_MODEL
+
+async def _probe_region(client) -> None:
+    genai_client = client.cached_client() or await run_blocking(client.get_client)
+    await genai_client.aio.models.embed_content(model=get_text_embedding_model(), contents=["ping"],
+                                                config={"task_type": "RETRIEVAL_QUERY"})
+
+async def warm_up() -> None:
+    """Build every embedding region's client and embed a word through it before the first request explores it"""
+    await region_pool.warm_up(_probe_region)
+
+def _embed_in_region(texts: List[str], task_type) -> List[List[float]]:
+    """Embed texts in one call through the region pool, feeding its statistics"""
+    client = region_pool.acquire()
+    genai_client = client.get_client()
+    start = time.perf_counter()
+    try:
+        result = genai_client.models.embed_content(
+            model=get_text_embedding_model(),
+            contents=texts,
+            config={"task_type": task_type.upper()}
+        )
+    except Exception:
+        region_pool.record_failure(client)
+        raise
+    region_pool.record_success(client, time.perf_counter() - start)
+    return [embedding.values for embedding in result.embeddings]
+
+def get_embedding(text, task_type="retrieval_document"):
+    cached = embedding_cache.get(text, EMBEDDING_MODEL, task_type)
+    if cached is not None:
+        return cached
+
+    embedding = _embed_in_region([text], task_type)[0]
+
+    embedding_cache.set(text, EMBEDDING_MODEL, task_type, embedding)
+    return embedding
+
+def get_embeddings(texts: List[str], task_type="retrieval_document") -> List[List[float]]:
+    """Embed several texts with a single embed_content call, using the cache where possible"""
+    embeddings: Dict[str, List[float]] = {}
+    missing = []
+    for text in texts:
+        if text in embeddings:
+            continue
+        cached = embedding_cache.get(text, EMBEDDING_MODEL, task_type)
+        if cached is not None:
+            embeddings[text] = cached
+        elif text not in missing:
+            missing.append(text)
+
+    if missing:
+        for text, embedding in zip(missing, _embed_in_region(missing, task_type)):
+            embedding_cache.set(text, EMBEDDING_MODEL, task_type, embedding)
+            embeddings[text] = embedding
+
+    return [embeddings[text] for text in texts]
+
+
+class EmbeddingBatcher:
+    """Gathers concurrent embedding requests and dispatches them as batched calls"""
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, str, asyncio.Future, float]] = []
+        self._flush_handle = None
+        self._tasks = set()
+        self.batch_size_histogram = Histogram([1, 2, 4, 8, 16, 32, 64, 100])
+        self.queue_wait_histogram = Histogram([0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25])
+
+    async def embed(self, text: str, task_type: str = "retrieval_document") -> List[float]:
+        """Queue a text for the next batch and wait for its vector"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, task_type, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        # embed_content takes one task type per call
+        by_task_type: Dict[str, List[Tuple[str, asyncio.Future, float]]] = {}
+        for text, task_type, future, enqueued_at in pending:
+            by_task_type.setdefault(task_type, []).append((text, future, enqueued_at))
+
+        for task_type, batch in by_task_type.items():
+            task = asyncio.create_task(self._dispatch(task_type, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, task_type: str, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        dispatched_at = time.perf_counter()
+        self.batch_size_histogram.observe(len(batch))
+        for _, _, enqueued_at in batch:
+            self.queue_wait_histogram.observe(dispatched_at - enqueued_at)
+
+        texts = [text for text, _, _ in batch]
+        try:
+            embeddings = await run_blocking(get_embeddings, texts, task_type)
+        except Exception as e:
+            logger.error(f"Batched embedding call failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def get_stats(self) -> Dict[str, object]:
+        """Batch-size and queue-wait histograms for the metrics endpoint"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_wait_seconds": self.queue_wait_histogram.snapshot(),
+        }
+
+
+# Global dispatcher instance
+embedding_batcher = EmbeddingBatcher(EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_WAIT_MS)
+
+async def get_embedding_async(text, task_type="retrieval_document"):
+    """Embed a text through the micro-batching dispatcher"""
+    cached = embedding_cache.peek(text, EMBEDDING_MODEL, task_type)
+    if cached is not None:
+        return cached
+    return await embedding_batcher.embed(text, task_type)
@@ -1,27 +1,195 @@
-import google.generativeai as genai
 from dotenv import load_dotenv
+from collections import deque
+from typing import Any, Dict, Optional
+import asyncio
+import logging
 import os
-from google.cloud import aiplatform as vertexai
-from utils.config import REGIONS
-import random
-from google.generativeai import GenerativeModel
+import threading
+import time
+import numpy as np
+from utils.config import (
+    REGIONS,
+    REGION_EWMA_ALPHA,
+    REGION_FAILURE_THRESHOLD,
+    REGION_EJECTION_SECONDS,
+    LLM_HEDGING_ENABLED,
+    LLM_HEDGE_DELAY_SECONDS,
+    LLM_HEDGE_BUDGET_PER_MINUTE,
+)
+from utils.concurrency import run_blocking
+from models.regions import RegionPool, RegionClient
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def get_model(temperature=0.3, top_p=0.7, top_k=40, max_output_tokens=1024):
-    vertexai.init(project=os.getenv("PROJECT_ID"), location=REGIONS[random.randint(0, 25)])  # Initialize Vertex AI
-    
-    generation_config = {
+MODEL_NAME = "gemini-1.5-pro-001"
+
+# Process-wide pool of per-region generation clients
+region_pool = RegionPool(REGIONS, REGION_EWMA_ALPHA, REGION_FAILURE_THRESHOLD, REGION_EJECTION_SECONDS)
+
+
+def _generation_config(temperature=0.3, top_p=0.7, top_k=40, max_output_tokens=1024):
+    return {
         "temperature": temperature,
         "top_p": top_p,
         "top_k": top_k,
         "max_output_tokens": max_output_tokens,
     }
-    
-    model = GenerativeModel(
-        "gemini-1.5-pro-001",
-        generation_config=generation_config
-    ) 
-    return model
 
 
+async def _get_region_client(client: RegionClient):
+    genai_client = client.cached_client()
+    if genai_client is None:
+        # Resolving credentials may touch the filesystem/metadata server, so build the client off-loop
+        genai_client = await run_blocking(client.get_client)
+    return genai_client
+
+
+async def _probe_region(client: RegionClient) -> None:
+    await (await _get_region_client(client)).aio.models.count_tokens(model=MODEL_NAME, contents="ping")
+
+
+async def warm_up() -> None:
+    """Build every region's client and make a count_tokens round-trip through it before the first chat"""
+    await region_pool.warm_up(_probe_region)
+
+
+async def _generate_in_region(client: RegionClient, prompt, generation_config, stream=False, observe=False):
+    """Run one generation against a region, feeding its latency/error statistics.
+
+    `observe` also feeds the hedge delay; only chat replies do, so background
+    calls such as memory summaries don't skew the p90 that triggers hedging.
+    """
+    models = (await _get_region_client(client)).aio.models
+    start = time.perf_counter()
+    try:
+        if stream:
+            response = await models.generate_content_stream(model=MODEL_NAME, contents=prompt, config=generation_config)
+        else:
+            response = await models.generate_content(model=MODEL_NAME, contents=prompt, config=generation_config)
+    except Exception:
+        region_pool.record_failure(client)
+        raise
+    latency = time.perf_counter() - start
+    region_pool.record_success(client, latency)
+    if observe and not stream:
+        hedger.observe_latency(latency)
+    return response
+
+
+class Hedger:
+    """Sends a backup request to another region when the primary is slower than usual"""
+
+    MIN_SAMPLES = 20  # don't hedge on a p90 computed from too few calls
+
+    def __init__(self, delay_seconds: float, budget_per_minute: int, window: int = 200):
+        self.delay_seconds = delay_seconds
+        self.budget_per_minute = budget_per_minute
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._budget_window = 0
+        self._budget_used = 0
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        self.no_alternative = 0
+        self.budget_exhausted = 0
+
+    def observe_latency(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def get_delay(self) -> Optional[float]:
+        """Configured delay, or the rolling p90 of generation latency"""
+        if self.delay_seconds > 0:
+            return self.delay_seconds
+        with self._lock:
+            if len(self._latencies) < self.MIN_SAMPLES:
+                return None
+            return float(np.percentile(self._latencies, 90))
+
+    def _try_spend_budget(self) -> bool:
+        window = int(time.time() // 60)
+        with self._lock:
+            if window != self._budget_window:
+                self._budget_window = window
+                self._budget_used = 0
+            if self._budget_used >= self.budget_per_minute:
+                self.budget_exhausted += 1
+                return False
+            self._budget_used += 1
+            return True
+
+    async def generate(self, prompt, generation_config: Dict[str, Any]):
+        """First successful response wins; the loser is cancelled"""
+        self.requests += 1
+        primary_client = region_pool.acquire()
+        primary = asyncio.create_task(_generate_in_region(primary_client, prompt, generation_config, observe=True))
+        tasks = {primary}
+        try:
+            delay = self.get_delay()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return await primary
+            # A backup only helps from an independent endpoint; never hedge into the same or an ejected region
+            if not region_pool.has_healthy(exclude=[primary_client.region]):
+                self.no_alternative += 1
+                return await primary
+            if not self._try_spend_budget():
+                return await primary
+
+            secondary_client = region_pool.acquire(exclude=[primary_client.region])
+            secondary = asyncio.create_task(_generate_in_region(secondary_client, prompt, generation_config, observe=True))
+            tasks.add(secondary)
+            self.hedges_sent += 1
+            logger.info(f"Hedging generation from {primary_client.region} to {secondary_client.region} after {delay:.2f}s")
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; surface the primary's error
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hedge counters for the metrics endpoint"""
+        return {
+            "enabled": LLM_HEDGING_ENABLED and len(region_pool.clients) > 1,
+            "delay_seconds": self.get_delay(),
+            "budget_per_minute": self.budget_per_minute,
+            "requests": self.requests,
+            "hedges_sent": self.hedges_sent,
+            "hedge_rate": self.hedges_sent / self.requests if self.requests > 0 else 0,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget_exhausted,
+            "no_alternative": self.no_alternative,
+        }
+
+
+hedger = Hedger(LLM_HEDGE_DELAY_SECONDS, LLM_HEDGE_BUDGET_PER_MINUTE)
+
+
+async def generate_content_async(prompt, background=False, **generation_config):
+    """Generate a response without blocking the event loop, hedging across regions if enabled.
+
+    Pass background=True for work nobody is waiting on; it is never hedged and
+    its latency stays out of the hedge delay.
+    """
+    if background:
+        return await _generate_in_region(region_pool.acquire(), prompt, _generation_config(**generation_config))
+    if LLM_HEDGING_ENABLED and len(region_pool.clients) > 1:
+        return await hedger.generate(prompt, _generation_config(**generation_config))
+    return await _generate_in_region(region_pool.acquire(), prompt, _generation_config(**generation_config), observe=True)
+
+
+async def generate_content_stream_async(prompt, **generation_config):
+    """Start a streaming generation; iterate the result with `async for` to receive chunks"""
+    return await _generate_in_region(region_pool.acquire(), prompt, _generation_config(**generation_config), stream=True)
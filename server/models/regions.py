@@ -0,0 +1,138 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RegionClient:
+    """A Vertex AI client bound to one region, built once and reused, plus its health statistics.
+
+    With `vertexai=False` the client calls the Gemini API instead, which has a single global endpoint.
+    """
+
+    def __init__(self, region: str, vertexai: bool = True):
+        self.region = region
+        self.vertexai = vertexai
+        self._client = None
+        self._lock = threading.Lock()
+        self.ewma_latency: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def cached_client(self):
+        """Return the client if it is already built, or None"""
+        return self._client
+
+    def get_client(self):
+        """Return this region's client, building it on first use.
+
+        Each client carries its own location, so its calls go to that region's
+        endpoint; nothing here touches process-wide Vertex AI state.
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # google.genai is imported here, and credentials are resolved on first use, not at startup
+                    from google import genai
+                    if self.vertexai:
+                        self._client = genai.Client(vertexai=True, project=os.getenv("PROJECT_ID"), location=self.region)
+                    else:
+                        self._client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        return self._client
+
+
+class RegionPool:
+    """Picks regions by observed latency (power-of-two-choices on EWMA) and ejects failing ones"""
+
+    def __init__(self, regions: Iterable[str], ewma_alpha: float, failure_threshold: int, ejection_seconds: float,
+                 vertexai: bool = True):
+        self.clients: Dict[str, RegionClient] = {region: RegionClient(region, vertexai) for region in regions}
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude: Iterable[str] = ()) -> RegionClient:
+        """Choose a region for the next call"""
+        excluded = set(exclude)
+        now = time.time()
+        with self._lock:
+            candidates = [c for c in self.clients.values() if c.region not in excluded]
+            healthy = [c for c in candidates if c.ejected_until <= now]
+            if not healthy:
+                # Everything is ejected: fail open on the region that comes back soonest
+                return min(candidates, key=lambda c: c.ejected_until)
+
+            unexplored = [c for c in healthy if c.ewma_latency is None]
+            if unexplored:
+                return random.choice(unexplored)
+
+            if len(healthy) == 1:
+                return healthy[0]
+            first, second = random.sample(healthy, 2)
+            return first if first.ewma_latency <= second.ewma_latency else second
+
+    async def warm_up(self, probe: Callable[[RegionClient], Awaitable[Any]]) -> None:
+        """Make one cheap call against every region concurrently; fails only if no region answers.
+
+        Regions that fail start with a recorded error, so routing already leans away from them.
+        """
+        clients = list(self.clients.values())
+        results = await asyncio.gather(*(probe(c) for c in clients), return_exceptions=True)
+        failed = [(c, r) for c, r in zip(clients, results) if isinstance(r, BaseException)]
+        if failed and len(failed) == len(clients):
+            raise failed[0][1]
+        for client, error in failed:
+            self.record_failure(client)
+            logger.warning(f"Warm-up call to region {client.region} failed: {error}")
+
+    def has_healthy(self, exclude: Iterable[str] = ()) -> bool:
+        """Whether a region outside `exclude` is currently accepting calls"""
+        excluded = set(exclude)
+        now = time.time()
+        with self._lock:
+            return any(c.region not in excluded and c.ejected_until <= now for c in self.clients.values())
+
+    def record_success(self, client: RegionClient, latency: float) -> None:
+        with self._lock:
+            client.requests += 1
+            client.consecutive_errors = 0
+            if client.ewma_latency is None:
+                client.ewma_latency = latency
+            else:
+                client.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * client.ewma_latency
+
+    def record_failure(self, client: RegionClient) -> None:
+        with self._lock:
+            client.requests += 1
+            client.errors += 1
+            client.consecutive_errors += 1
+            if client.consecutive_errors >= self.failure_threshold:
+                client.ejected_until = time.time() + self.ejection_seconds
+                client.ejections += 1
+                logger.warning(f"Ejecting region {client.region} for {self.ejection_seconds}s after {client.consecutive_errors} errors")
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Per-region latency, error and ejection statistics"""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "region": c.region,
+                    "ewma_latency": c.ewma_latency,
+                    "requests": c.requests,
+                    "errors": c.errors,
+                    "error_rate": c.errors / c.requests if c.requests > 0 else 0,
+                    "ejections": c.ejections,
+                    "ejected": c.ejected_until > now,
+                }
+                for c in self.clients.values()
+            ]
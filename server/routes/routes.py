@@ -1,18 +1,37 @@
-from fastapi import APIRouter, WebSocket , WebSocketDisconnect, Depends, HTTPException
-from storage.pinecone import pinecone_index
-from storage.redis import redis_client
-from middlewares.token import verify_jwt_token
+from fastapi import APIRouter, WebSocket , WebSocketDisconnect, Depends, HTTPException, Query, Request
+from storage.pinecone import upsert_buffer
+from storage.session_index import session_index, session_index_sync
+from storage.session_traces import session_traces
+from storage import session_metrics
+from storage.redis import async_redis_client
+from middlewares.token import verify_jwt_token, verify_ws_token, bearer_token, token_verifier
 from google.cloud import firestore
-from models.embedding import get_embedding
-from services.chat import get_chat_response
+from models.embedding import embedding_batcher
+from models.embedding import region_pool as embedding_region_pool
+from models.llm import region_pool as generation_region_pool, hedger
+from services.chat import get_chat_response, stream_chat_response
+from services.admission import chat_admission, ChatBusy
+from services.semantic_cache import semantic_cache
+from services.memory import conversation_memory
+from services.persistence import turn_persister
+from services.context import context_builder
 from services.login import login_user
+from services.passwords import password_hasher
+from services.readiness import readiness
 from schema.user import UserLogin
 from schema.user import UserSignup
-from middlewares.evaluation import evaluator
+from middlewares.evaluation import evaluator, evaluation_queue, ROLLUP_BUCKETS, ROLLUP_AGGREGATIONS
+from middlewares.cluster_metrics import metrics_publisher, query_time_series, INSTANCE_ID
+from storage.embedding_cache import embedding_cache
 from services.signup import signup_user
-import time
+from utils.concurrency import SingleFlightCache
+from utils.config import METRICS_RESPONSE_CACHE_SECONDS
+from utils.tracing import tracer, Trace
+from typing import Optional
+import asyncio
 import logging
 import json
+import re
 from services.getSessionId import generate_session_id
 logger = logging.getLogger(__name__)
 
@@ -20,15 +39,60 @@ router = APIRouter()
 
 active_connections: dict = {}
 
+WINDOW_UNITS_MS = {"m": 60*1000, "h": 60*60*1000, "d": 24*60*60*1000}
+metrics_response_cache = SingleFlightCache(METRICS_RESPONSE_CACHE_SECONDS)
+
+def _parse_window(window: str) -> Optional[int]:
+    """'90m', '24h', '7d' -> milliseconds, or None if malformed"""
+    match = re.fullmatch(r"(\d+)([mhd])", window)
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * WINDOW_UNITS_MS[match.group(2)]
+
 @router.get("/metrics")
-async def get_model_metrics(user_id: str = Depends(verify_jwt_token)):
-    """Get aggregated model performance metrics"""
+async def get_model_metrics(
+    breakdown: bool = False,
+    window: str = "24h",
+    bucket: Optional[str] = None,
+    aggregation: str = "avg",
+    user_id: str = Depends(verify_jwt_token)
+):
+    """Get aggregated model performance metrics, merged across every worker and instance,
+    plus every metric's time series downsampled to `bucket` (1m or 1h) over `window`"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    
+
+    window_ms = _parse_window(window)
+    if window_ms is None:
+        raise HTTPException(status_code=400, detail="window must look like 90m, 24h or 7d")
+    if bucket is None:
+        bucket = "1m" if window_ms <= 6 * WINDOW_UNITS_MS["h"] else "1h"
+    if bucket not in ROLLUP_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(ROLLUP_BUCKETS)}")
+    if aggregation not in ROLLUP_AGGREGATIONS + ("p95",):
+        raise HTTPException(status_code=400, detail=f"aggregation must be one of {', '.join(ROLLUP_AGGREGATIONS)}, p95")
+    if aggregation == "p95" and bucket != "1m":
+        raise HTTPException(status_code=400, detail="p95 is only available with bucket=1m")
+    if window_ms > ROLLUP_BUCKETS[bucket][1]:
+        raise HTTPException(status_code=400, detail=f"window exceeds the retention of {bucket} rollups")
+
+    # Dashboards poll this; concurrent viewers of the same query share one computation
+    return await metrics_response_cache.get(
+        (breakdown, window_ms, bucket, aggregation),
+        lambda: _build_metrics(breakdown, window_ms, bucket, aggregation)
+    )
+
+async def _build_metrics(breakdown: bool, window_ms: int, bucket: str, aggregation: str):
     try:
-        # Get real-time metrics from the evaluator instance
-        metrics = evaluator.get_aggregate_metrics()
+        try:
+            metrics = await metrics_publisher.get_cluster_metrics(breakdown=breakdown)
+            metrics["scope"] = "cluster"
+        except Exception as e:
+            # Fall back to this process's own view if the snapshots can't be read
+            logger.warning(f"Could not merge cluster metrics: {e}")
+            metrics = evaluator.get_aggregate_metrics()
+            metrics["scope"] = "local"
+        metrics["instance_id"] = INSTANCE_ID
         
         # Convert numpy values to native Python types
         serializable_metrics = {}
@@ -37,22 +101,43 @@ async def get_model_metrics(user_id: str = Depends(verify_jwt_token)):
                 serializable_metrics[k] = float(v.item())
             else:
                 serializable_metrics[k] = v
+
+        serializable_metrics["embedding_cache"] = embedding_cache.get_stats()
+        serializable_metrics["embedding_batcher"] = embedding_batcher.get_stats()
+        serializable_metrics["evaluation_queue"] = evaluation_queue.get_stats()
+        serializable_metrics["pinecone_upserts"] = upsert_buffer.get_stats()
+        serializable_metrics["regions"] = {
+            "generation": generation_region_pool.get_stats(),
+            "embedding": embedding_region_pool.get_stats(),
+        }
+        serializable_metrics["hedging"] = hedger.get_stats()
+        serializable_metrics["session_index"] = {**session_index.get_stats(), "sync": session_index_sync.get_stats()}
+        serializable_metrics.setdefault("semantic_cache", {})["lookups"] = semantic_cache.get_stats()
+        serializable_metrics["memory"] = conversation_memory.get_stats()
+        serializable_metrics["turn_persistence"] = turn_persister.get_stats()
+        serializable_metrics["admission"] = chat_admission.get_stats()
+        serializable_metrics["context"] = context_builder.get_stats()
+        serializable_metrics["password_hashing"] = password_hasher.get_stats()
+        serializable_metrics["auth"] = token_verifier.get_stats()
+        serializable_metrics["metrics_response_cache"] = metrics_response_cache.get_stats()
+        serializable_metrics["readiness"] = readiness.get_stats()
+        serializable_metrics["tracing"] = {
+            "traces": tracer.traces,
+            "sampled": tracer.sampled,
+            "stored": session_traces.get_stats(),
+        }
         
-        # If Redis TS is used, get time-series metrics
+        # Server-side rollups of the Redis TS series, all metrics in one TS.MRANGE
         try:
-            # Get average latency over time (last 24 hours)
-            end_time = int(time.time() * 1000)
-            start_time = end_time - (24 * 60 * 60 * 1000)  # 24 hours back
-            
-            latency_data = redis_client.execute_command(
-                "TS.RANGE", "metric:latency_seconds", start_time, end_time
-            )
-            
-            if latency_data:
-                serializable_metrics["latency_over_time"] = [
-                    {"timestamp": point[0], "value": point[1]} 
-                    for point in latency_data
-                ]
+            series = await query_time_series(window_ms, bucket, aggregation)
+            serializable_metrics["time_series"] = {
+                "window_ms": window_ms,
+                "bucket": bucket,
+                "aggregation": aggregation,
+                "series": series,
+            }
+            if series.get("latency_seconds"):
+                serializable_metrics["latency_over_time"] = series["latency_seconds"]
         except Exception as e:
             logger.warning(f"Could not retrieve time-series metrics: {e}")
             
@@ -69,36 +154,30 @@ async def get_session_id(user_id: str = Depends(verify_jwt_token)):
     return generate_session_id()
 
 @router.get("/metrics/sessions/{session_id}")
-async def get_session_metrics(session_id: str, user_id: str = Depends(verify_jwt_token)):
-    """Get metrics for a specific session"""
+async def get_session_metrics(
+    session_id: str,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    user_id: str = Depends(verify_jwt_token)
+):
+    """Get the summary and a newest-first page of interactions for a specific session"""
     if not user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     try:
-        metrics_list = redis_client.lrange(f"response_metrics:{session_id}", 0, -1)
-        if not metrics_list:
+        summary = await session_metrics.get_summary(async_redis_client, session_id)
+        if summary is None:
             raise HTTPException(status_code=404, detail="No metrics found for this session")
         
-        # Parse JSON strings
-        parsed_metrics = [json.loads(m.decode('utf-8')) for m in metrics_list]
-        
-        # Calculate session-level aggregates
-        if parsed_metrics:
-            avg_latency = sum(m.get("latency_seconds", 0) for m in parsed_metrics) / len(parsed_metrics)
-            avg_relevance = sum(m.get("query_response_relevance", 0) for m in parsed_metrics) / len(parsed_metrics)
-            
-            return {
-                "session_id": session_id,
-                "metrics": parsed_metrics,
-                "summary": {
-                    "total_interactions": len(parsed_metrics),
-                    "avg_latency": avg_latency,
-                    "avg_relevance_score": avg_relevance,
-                    "start_time": parsed_metrics[-1].get("timestamp"),
-                    "end_time": parsed_metrics[0].get("timestamp")
-                }
-            }
-        return {"session_id": session_id, "metrics": []}
+        metrics, next_cursor = await session_metrics.get_page(async_redis_client, session_id, cursor, limit)
+        return {
+            "session_id": session_id,
+            "metrics": metrics,
+            "next_cursor": next_cursor,
+            "summary": summary
+        }
+    except HTTPException:
+        raise
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing error: {e}")
         raise HTTPException(status_code=500, detail="Error parsing metrics data")
@@ -106,11 +185,87 @@ async def get_session_metrics(session_id: str, user_id: str = Depends(verify_jwt
         logger.error(f"Error retrieving session metrics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/metrics/sessions/{session_id}/traces")
+async def get_session_traces(
+    session_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(verify_jwt_token)
+):
+    """Sampled per-stage traces of a session's turns, newest first"""
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return {"session_id": session_id, "traces": await session_traces.get(session_id, limit)}
+
+async def _stream_reply(websocket: WebSocket, user_id: str, session_id: str, data: str):
+    """Forward model chunks as framed delta messages; returns the assembled text, or None on error"""
+    chunks = []
+    try:
+        async for chunk in stream_chat_response(user_id, session_id, data):
+            chunks.append(chunk)
+            await websocket.send_text(json.dumps({"type": "delta", "content": chunk}))
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        print(f"Error streaming chat response: {e}")
+        await websocket.send_text(json.dumps({
+            "type": "error",
+            "message": "I'm sorry, I encountered an error processing your request."
+        }))
+        return None
+
+    response = "".join(chunks)
+    await websocket.send_text(json.dumps({"type": "done", "content": response}))
+    return response
+
+async def _handle_turn(websocket: WebSocket, user_id: str, session_id: str, data: str, stream: bool):
+    """Answer one message, then hand the turn to the background persister; a "busy" frame if it isn't admitted.
+
+    Returns the persister's task for the turn, or None if nothing was saved.
+    """
+    try:
+        async with chat_admission.admit(user_id):
+            # Get response from model
+            if stream:
+                # Framed delta/done/error messages are sent as the model generates
+                response = await _stream_reply(websocket, user_id, session_id, data)
+            else:
+                try:
+                    response = await get_chat_response(user_id, session_id, data)
+                except Exception as e:
+                    print(f"Error getting chat response: {e}")
+                    response = "I'm sorry, I encountered an error processing your request."
+    except ChatBusy as busy:
+        await websocket.send_text(json.dumps({
+            "type": "busy",
+            "reason": busy.reason,
+            "retry_after_seconds": busy.retry_after,
+            "message": "Shashtra is handling a lot of questions right now. Please try again in a moment."
+        }))
+        return None
+    if response is None:
+        return None
+    
+    # History, turn counter and vector are saved in the background, in order per session, so the
+    # reply doesn't wait for them; queued first so a client leaving mid-send doesn't lose the turn
+    persisting = await turn_persister.submit(user_id, session_id, data, response)
+    if not stream:
+        with tracer.span("send"):
+            await websocket.send_text(response)
+    return persisting
+
+def _save_trace(trace: Trace, persisting: Optional[asyncio.Task]) -> None:
+    """Store a sampled trace once the turn's background persist stages have added their spans"""
+    if persisting is None:
+        session_traces.save(trace)
+    else:
+        persisting.add_done_callback(lambda task: None if task.cancelled() else session_traces.save(trace))
+
 @router.websocket("/chat")
 async def websocket_endpoint(
     websocket: WebSocket, 
     session_id: str,
-    user_id: str = Depends(lambda w=None: verify_jwt_token)
+    stream: bool = False,
+    user_id: str = Depends(verify_ws_token)
 ):
     await websocket.accept()
     if user_id is None:
@@ -125,35 +280,10 @@ async def websocket_endpoint(
         while True:
             data = await websocket.receive_text()
             
-            # Get response from model
-            try:
-                response = await get_chat_response(user_id, session_id, data)
-            except Exception as e:
-                print(f"Error getting chat response: {e}")
-                response = "I'm sorry, I encountered an error processing your request."
-            
-            # Save to Redis
-            try:
-                redis_client.rpush(f"chat_history:{user_id}:{session_id}", f"User: {data}")
-                redis_client.rpush(f"chat_history:{user_id}:{session_id}", f"Chatbot: {response}")
-            except Exception as e:
-                print(f"Error saving to Redis: {e}")
-            
-            # Save to Pinecone
-            try:
-                embedding = get_embedding(data + response)
-                pinecone_index.upsert(
-                    vectors=[{
-                        "id": str(hash(data + response + session_id)),
-                        "values": embedding,
-                        "metadata": {"text": data + response, "session_id": session_id}
-                    }]
-                )
-            except Exception as e:
-                print(f"Error upserting to Pinecone: {e}")
-            
-            # Send response
-            await websocket.send_text(response)
+            with tracer.trace(session_id) as trace:
+                persisting = await _handle_turn(websocket, user_id, session_id, data, stream)
+            if trace.sampled:
+                _save_trace(trace, persisting)
 
     except WebSocketDisconnect:
         if user_id in active_connections and session_id in active_connections[user_id]:
@@ -168,6 +298,14 @@ async def websocket_endpoint(
 async def login(user_data: UserLogin):
     return await login_user(user_data)
 
+@router.post("/logout")
+async def logout(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Revoke the current token on every worker"""
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    await token_verifier.revoke(bearer_token(request))
+    return {"status": "logged out"}
+
 @router.post("/signup")
 async def signup(user_data: UserSignup):
     return await signup_user(user_data)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""One-off backfill of the user_emails collection that makes signup emails unique.
+
+Signup now claims user_emails/{email_key(email)} with an atomic create()
+instead of querying users first, so every existing user needs its email
+document before the new signup path is deployed. When several users share an
+email (possible under the old check-then-write race, or differing only in
+case), the earliest created one claims it and the rest are reported.
+
+Run from the server directory:
+
+    python -m scripts.backfill_user_emails            # dry run, report only
+    python -m scripts.backfill_user_emails --apply    # write the missing documents
+"""
+import argparse
+from collections import defaultdict
+from storage.db import get_async_database
+from storage.users import USERS, USER_EMAILS, email_key
+
+BATCH_SIZE = 400  # Firestore allows 500 writes per batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apply", action="store_true", help="write missing email documents instead of only reporting them")
+    args = parser.parse_args()
+
+    db = get_async_database()
+    users_by_email = defaultdict(list)
+    for snapshot in db.collection(USERS).stream():
+        user = snapshot.to_dict()
+        if user.get("email"):
+            users_by_email[email_key(user["email"])].append(user)
+
+    claimed = {snapshot.id for snapshot in db.collection(USER_EMAILS).stream()}
+    missing = {}
+    for key, users in users_by_email.items():
+        if len(users) > 1:
+            print(f"{users[0]['email']} is shared by {len(users)} users: {', '.join(u['user_id'] for u in users)}")
+        if key not in claimed:
+            dated = [u for u in users if u.get("created_at")]
+            missing[key] = min(dated, key=lambda u: u["created_at"]) if dated else users[0]
+
+    print(f"Scanned {sum(len(u) for u in users_by_email.values())} users; {len(missing)} emails to backfill")
+    if not args.apply:
+        print("Dry run, nothing written. Re-run with --apply to write.")
+        return
+
+    items = list(missing.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = db.batch()
+        for key, user in items[start:start + BATCH_SIZE]:
+            batch.create(db.collection(USER_EMAILS).document(key), {"user_id": user["user_id"], "email": user["email"]})
+        batch.commit()
+    print(f"Wrote {len(missing)} email documents")
+
+
+if __name__ == "__main__":
+    main()
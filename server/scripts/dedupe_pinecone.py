@@ -0,0 +1,71 @@
+"""One-off cleanup of duplicate chat vectors in the Pinecone index.
+
+Vectors used to be keyed by Python's salted hash(), so every restart and every
+worker wrote its own copy of the same turn. Vectors are grouped by
+(session_id, text) and one per group is kept, preferring the deterministic
+sha256 IDs written by make_vector_id.
+
+Run from the server directory:
+
+    python -m scripts.dedupe_pinecone            # dry run, report only
+    python -m scripts.dedupe_pinecone --apply    # delete the duplicates
+"""
+import argparse
+import re
+from collections import defaultdict
+from storage.pinecone import get_pinecone_index
+from utils.config import PINECONE_INDEX
+
+FETCH_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
+DETERMINISTIC_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def collect_groups(index):
+    """Map (session_id, text) to every vector ID carrying that content"""
+    groups = defaultdict(list)
+    scanned = 0
+    for id_page in index.list():
+        ids = list(id_page)
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            fetched = index.fetch(ids=ids[start:start + FETCH_BATCH_SIZE])
+            for vector_id, vector in fetched.vectors.items():
+                metadata = vector.metadata or {}
+                groups[(metadata.get("session_id"), metadata.get("text"))].append(vector_id)
+                scanned += 1
+    return groups, scanned
+
+
+def pick_survivor(ids):
+    """Keep a deterministic ID if one exists, otherwise the lowest ID"""
+    deterministic = sorted(i for i in ids if DETERMINISTIC_ID.match(i))
+    return deterministic[0] if deterministic else sorted(ids)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apply", action="store_true", help="delete duplicates instead of only reporting them")
+    parser.add_argument("--index", default=PINECONE_INDEX, help="Pinecone index name")
+    args = parser.parse_args()
+
+    index = get_pinecone_index(name=args.index)
+    groups, scanned = collect_groups(index)
+
+    duplicates = []
+    for key, ids in groups.items():
+        if len(ids) > 1:
+            survivor = pick_survivor(ids)
+            duplicates.extend(i for i in ids if i != survivor)
+
+    print(f"Scanned {scanned} vectors in {len(groups)} distinct turns; {len(duplicates)} duplicates")
+    if not args.apply:
+        print("Dry run, nothing deleted. Re-run with --apply to delete.")
+        return
+
+    for start in range(0, len(duplicates), DELETE_BATCH_SIZE):
+        index.delete(ids=duplicates[start:start + DELETE_BATCH_SIZE])
+    print(f"Deleted {len(duplicates)} duplicate vectors")
+
+
+if __name__ == "__main__":
+    main()
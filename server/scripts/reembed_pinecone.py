@@ -0,0 +1,82 @@
+"""Copy the chat vectors of one Pinecone index into another, re-embedded with the configured model.
+
+Query vectors and stored vectors have to come from the same embedding model;
+two models with the same dimension still embed into different spaces. To
+change EMBEDDING_MODEL, re-embed the turns into a new index with the new
+model's settings, then point PINECONE_INDEX at it:
+
+    EMBEDDING_VERTEX=true EMBEDDING_MODEL=text-embedding-005 \\
+        python -m scripts.reembed_pinecone --target chats-db-005 --apply
+
+Vector IDs and metadata are kept, so re-running only rewrites the same
+vectors. Turns written to the old index while the copy ran, or until the
+deploy switched over, are picked up by a second run with --skip-existing.
+
+Run from the server directory; without --apply it only counts the vectors.
+"""
+import argparse
+from models.embedding import get_embeddings
+from storage.pinecone import get_pinecone_index
+from utils.config import EMBEDDING_MODEL, EMBEDDING_BATCH_MAX_SIZE, PINECONE_INDEX
+
+FETCH_BATCH_SIZE = 100
+
+
+def reembed(source, target, apply: bool, skip_existing: bool):
+    """Returns (scanned, re-embedded, skipped) vector counts"""
+    scanned = reembedded = skipped = 0
+    for id_page in source.list():
+        ids = list(id_page)
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            batch_ids = ids[start:start + FETCH_BATCH_SIZE]
+            fetched = source.fetch(ids=batch_ids).vectors
+            scanned += len(fetched)
+            existing = set(target.fetch(ids=batch_ids).vectors) if skip_existing else set()
+
+            pending = []
+            for vector_id, vector in fetched.items():
+                metadata = vector.metadata or {}
+                if vector_id in existing or not metadata.get("text"):
+                    skipped += 1
+                else:
+                    pending.append((vector_id, metadata))
+            if not apply:
+                reembedded += len(pending)
+                continue
+
+            for offset in range(0, len(pending), EMBEDDING_BATCH_MAX_SIZE):
+                chunk = pending[offset:offset + EMBEDDING_BATCH_MAX_SIZE]
+                # Same text and task type that persistence embeds a turn with
+                embeddings = get_embeddings([metadata["text"] for _, metadata in chunk], "retrieval_document")
+                target.upsert(vectors=[
+                    {"id": vector_id, "values": values, "metadata": metadata}
+                    for (vector_id, metadata), values in zip(chunk, embeddings)
+                ])
+                reembedded += len(chunk)
+    return scanned, reembedded, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apply", action="store_true", help="embed and write vectors instead of only counting them")
+    parser.add_argument("--source", default=PINECONE_INDEX, help="Pinecone index to read turns from")
+    parser.add_argument("--target", required=True, help="Pinecone index to write re-embedded vectors to (created if missing)")
+    parser.add_argument("--skip-existing", action="store_true", help="leave vectors already in the target alone")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--target must differ from --source; the live index keeps serving the old model until the switch")
+
+    source = get_pinecone_index(name=args.source)
+    # A dry run doesn't create the target index
+    target = get_pinecone_index(name=args.target) if args.apply or args.skip_existing else None
+    scanned, reembedded, skipped = reembed(source, target, args.apply, args.skip_existing)
+
+    print(f"Scanned {scanned} vectors in '{args.source}'; {skipped} skipped")
+    if not args.apply:
+        print(f"Dry run: {reembedded} vectors would be re-embedded with {EMBEDDING_MODEL}. Re-run with --apply.")
+        return
+    print(f"Re-embedded {reembedded} vectors with {EMBEDDING_MODEL} into '{args.target}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List
+import asyncio
+import logging
+import time
+from storage.redis import async_redis_client
+from utils.config import (
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_PER_USER_IN_FLIGHT, ADMISSION_MAX_QUEUED, ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_CLUSTER_RATE, ADMISSION_CLUSTER_BURST, ADMISSION_USER_RATE, ADMISSION_USER_BURST
+)
+from utils.metrics import Histogram
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# The hash tag keeps every bucket in one slot, so a turn can take from several atomically on Redis Cluster
+GLOBAL_BUCKET_KEY = "{admission}:global"
+
+# Token buckets refilled from Redis' own clock. ARGV holds a (rate, burst) pair per key.
+# A token is taken from every bucket or from none; returns {allowed, ms until a token is free}.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = now_parts[1] * 1000 + math.floor(now_parts[2] / 1000)
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens) * 1000 / rate))
+    end
+    levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+if wait == 0 then
+    return {1, 0}
+end
+return {0, wait}
+"""
+
+
+def user_bucket_key(user_id: str) -> str:
+    return f"{{admission}}:user:{user_id}"
+
+
+class ChatBusy(Exception):
+    """A turn was not admitted; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounds the chat turns generating at once, so a spike queues instead of fanning out upstream.
+
+    Turns beyond the worker's in-flight limit wait in a bounded queue and are
+    let in round-robin across users, with no user holding more than its
+    per-user share; a user with many open sessions can't starve the others.
+    A wait that would outlast the deadline, or a full queue, is answered with
+    ChatBusy at once. Optional Redis token buckets cap the turn rate of the
+    whole cluster and of each user.
+    """
+
+    def __init__(self, max_in_flight: int, per_user_limit: int, max_queued: int, queue_timeout: float,
+                 cluster_rate: float, cluster_burst: int, user_rate: float, user_burst: int):
+        self.max_in_flight = max_in_flight
+        self.per_user_limit = per_user_limit
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.cluster_rate = cluster_rate
+        self.cluster_burst = cluster_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._script = async_redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._in_flight = 0
+        self._user_in_flight: Counter = Counter()
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()  # users with waiting turns, in serving order
+        self._queued = 0
+        self._hold_seconds = 0.0  # EWMA of how long a turn keeps its slot; drives the retry hint
+        self.admitted = 0
+        self.queued_total = 0
+        self.peak_queued = 0
+        self.rate_limited_waits = 0
+        self.bucket_errors = 0
+        self.rejected: Counter = Counter()  # reason -> count
+        self.queue_wait_histogram = Histogram([0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        """Hold a generation slot for the body; raises ChatBusy if none frees up in time"""
+        deadline = asyncio.get_running_loop().time() + self.queue_timeout
+        with tracer.span("admission_wait"):
+            await self._take_tokens(user_id, deadline)
+            await self._acquire(user_id, deadline)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._hold_seconds += 0.1 * (time.perf_counter() - started_at - self._hold_seconds)
+            self._release(user_id)
+
+    def _retry_after(self) -> float:
+        """Rough time for the current queue to drain, as a client back-off hint"""
+        estimate = self._hold_seconds * (self._queued + 1) / self.max_in_flight
+        return round(min(max(estimate, 1.0), self.queue_timeout), 1)
+
+    def _reject(self, reason: str, retry_after: float) -> ChatBusy:
+        self.rejected[reason] += 1
+        return ChatBusy(reason, retry_after)
+
+    async def _take_tokens(self, user_id: str, deadline: float) -> None:
+        keys: List[str] = []
+        args: List[float] = []
+        if self.cluster_rate > 0:
+            keys.append(GLOBAL_BUCKET_KEY)
+            args += [self.cluster_rate, self.cluster_burst]
+        if self.user_rate > 0:
+            keys.append(user_bucket_key(user_id))
+            args += [self.user_rate, self.user_burst]
+        if not keys:
+            return
+
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                allowed, wait_ms = await self._script(keys=keys, args=args)
+            except Exception as e:
+                # Fail open: the worker's own limits still protect the upstream services
+                self.bucket_errors += 1
+                logger.warning(f"Could not check the admission token bucket: {e}")
+                return
+            if allowed:
+                return
+            wait = wait_ms / 1000
+            if loop.time() + wait > deadline:
+                raise self._reject("rate_limited", round(max(wait, 1.0), 1))
+            self.rate_limited_waits += 1
+            await asyncio.sleep(wait)
+
+    def _can_run(self, user_id: str) -> bool:
+        return self._in_flight < self.max_in_flight and self._user_in_flight[user_id] < self.per_user_limit
+
+    def _start(self, user_id: str) -> None:
+        self._in_flight += 1
+        self._user_in_flight[user_id] += 1
+        self.admitted += 1
+
+    async def _acquire(self, user_id: str, deadline: float) -> None:
+        # Free slots only exist while every waiting user is at their cap, so taking one never jumps the queue
+        if self._can_run(user_id):
+            self._start(user_id)
+            self.queue_wait_histogram.observe(0.0)
+            return
+        if self._queued >= self.max_queued:
+            raise self._reject("queue_full", self._retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self.queued_total += 1
+        self.peak_queued = max(self.peak_queued, self._queued)
+        enqueued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, deadline - loop.time())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted as the wait ended
+                if isinstance(e, asyncio.CancelledError):
+                    self._release(user_id)
+                    raise
+            else:
+                self._remove_waiter(user_id, waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise self._reject("timeout", self._retry_after()) from None
+        self.queue_wait_histogram.observe(time.perf_counter() - enqueued_at)
+
+    def _remove_waiter(self, user_id: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[user_id]
+
+    def _release(self, user_id: str) -> None:
+        self._in_flight -= 1
+        self._user_in_flight[user_id] -= 1
+        if self._user_in_flight[user_id] <= 0:
+            del self._user_in_flight[user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting turns, one user at a time in rotation"""
+        while self._in_flight < self.max_in_flight and self._queues:
+            user_id = next((u for u in self._queues if self._user_in_flight[u] < self.per_user_limit), None)
+            if user_id is None:
+                return
+            queue = self._queues[user_id]
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if waiter.done():
+                continue  # cancelled, and not yet removed by its own task
+            self._start(user_id)
+            waiter.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "per_user_limit": self.per_user_limit,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "users_queued": len(self._queues),
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected": dict(self.rejected),
+            "rate_limited_waits": self.rate_limited_waits,
+            "bucket_errors": self.bucket_errors,
+            "queue_wait": self.queue_wait_histogram.snapshot(),
+        }
+
+    def prometheus(self) -> str:
+        """Queue depth and rejections in the text exposition format; wait time is the admission_wait stage"""
+        lines = [
+            "# HELP shashtra_admission_in_flight Chat turns holding a generation slot",
+            "# TYPE shashtra_admission_in_flight gauge",
+            f"shashtra_admission_in_flight {self._in_flight}",
+            "# HELP shashtra_admission_queued Chat turns waiting for a generation slot",
+            "# TYPE shashtra_admission_queued gauge",
+            f"shashtra_admission_queued {self._queued}",
+            "# HELP shashtra_admission_rejected_total Chat turns answered with a busy message",
+            "# TYPE shashtra_admission_rejected_total counter",
+        ]
+        for reason in ("queue_full", "timeout", "rate_limited"):
+            lines.append(f'shashtra_admission_rejected_total{{reason="{reason}"}} {self.rejected[reason]}')
+        return "\n".join(lines) + "\n"
+
+
+# Global controller in front of the chat service
+chat_admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_PER_USER_IN_FLIGHT, ADMISSION_MAX_QUEUED, ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_CLUSTER_RATE, ADMISSION_CLUSTER_BURST, ADMISSION_USER_RATE, ADMISSION_USER_BURST
+)
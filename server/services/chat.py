@@ -1,50 +1,108 @@
 from storage.db import get_async_database
-from storage.redis import redis_client
-from models.embedding import get_embedding
-from models.llm import get_model
-from storage.pinecone import pinecone_index
-from middlewares.evaluation import evaluator
-async def get_chat_response(user_id: str, session_id: str, data: str):
-    # try:
-    #     # db = get_async_database()
-    #     # db.collection("chat_history").document(user_id).collection("sessions").document(session_id).collection("messages").add({"role": "user", "content": data})
-    # except Exception as e:
-    #     print(f"Error adding message to database: {e}")
-    #     return "Error processing your request."
-    start_time = evaluator.start_timer()
+from services.memory import conversation_memory
+from models.embedding import get_embedding_async
+from models.llm import generate_content_async, generate_content_stream_async
+from storage.pinecone import query_async
+from storage.session_index import session_index, HOT, PARTIAL
+from middlewares.evaluation import evaluator, evaluation_queue
+from services.semantic_cache import semantic_cache, context_fingerprint
+from services.context import context_builder
+from services.persistence import turn_persister
+from utils.tracing import tracer
+from utils.config import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MATCH_CONTEXT, SESSION_INDEX_MAX_VECTORS, CONTEXT_CANDIDATES
+import asyncio
+import time
+
+async def _embed_query(data: str):
     try:
-        user_message_embedding = get_embedding(data)
+        with tracer.span("embed_query"):
+            return await get_embedding_async(data)
     except Exception as e:
         print(f"Error getting embedding: {e}")
-        return "Error processing your request."
+        return None
 
-    try:
-        pinecone_results = pinecone_index.query(
-            vector=user_message_embedding,  # Use 'vector' keyword
-            top_k=5,
+async def _retrieve(session_id: str, user_message_embedding, top_k: int = CONTEXT_CANDIDATES):
+    """Serve hot sessions from the local index; warm it from Pinecone the first time a session is seen"""
+    state = session_index.state(session_id)
+    if state == HOT:
+        return session_index.query(session_id, user_message_embedding, top_k)
+    if state == PARTIAL:
+        return await query_async(
+            vector=user_message_embedding,
+            top_k=top_k,
+            include_values=True,  # the context builder compares candidates with each other
             include_metadata=True,
             filter={"session_id": session_id}
         )
-        print(pinecone_results)
-        if pinecone_results["matches"]:
-            context = " ".join([r["metadata"]["text"] for r in pinecone_results["matches"]])
-        else:
-            context = "No context found."
-    except Exception as e:
-        print(f"Error querying Pinecone: {e}")
-        return "Error processing your request."
 
-    # context = " ".join([r["metadata"]["text"] for r in pinecone_results["matches"]])
+    pinecone_results = await query_async(
+        vector=user_message_embedding,
+        top_k=SESSION_INDEX_MAX_VECTORS,
+        include_values=True,
+        include_metadata=True,
+        filter={"session_id": session_id}
+    )
+    session_index.warm(session_id, pinecone_results["matches"])
+    if session_index.state(session_id) == HOT:
+        # The warmed index also has other workers' turns that haven't reached Pinecone yet
+        return session_index.query(session_id, user_message_embedding, top_k)
+    return {"matches": pinecone_results["matches"][:top_k]}
+
+def _cached_answer(scope: str, embedding, context_digest: str = None):
+    """Check the semantic cache at the stage matching the configured mode (before or after retrieval).
+
+    Entries live for a short TTL within one session or user, so a repeated question is answered
+    from the cache while a paraphrase asked much later, in a conversation that has moved on, is not.
+    """
+    if not SEMANTIC_CACHE_ENABLED or SEMANTIC_CACHE_MATCH_CONTEXT != (context_digest is not None):
+        return None
+    with tracer.span("semantic_cache"):
+        return semantic_cache.lookup(scope, embedding, context_digest or "")
+
+def _cache_answer(scope: str, embedding, context_digest: str, response: str) -> None:
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.store(scope, embedding, context_digest if SEMANTIC_CACHE_MATCH_CONTEXT else "", response)
 
+async def _load_history(user_id: str, session_id: str) -> str:
     try:
-        recent_history = redis_client.lrange(f"chat_history:{user_id}:{session_id}", 0, 10)
-        recent_history = [message.decode('utf-8') for message in recent_history]
-        print(recent_history)
+        # The previous turn is saved after its reply; make sure it has landed
+        await turn_persister.wait(session_id)
+        with tracer.span("history"):
+            return await conversation_memory.load(user_id, session_id)
     except Exception as e:
         print(f"Error retrieving history from Redis: {e}")
-        recent_history = []
+        return ""
+
+async def _retrieve_context(session_id: str, user_message_embedding):
+    """(context, fingerprint) for a turn, or None on failure"""
+    try:
+        await turn_persister.wait(session_id)
+        with tracer.span("retrieve"):
+            pinecone_results = await _retrieve(session_id, user_message_embedding)
+        with tracer.span("context_build"):
+            context, matches = context_builder.build(pinecone_results["matches"])
+            return context, context_fingerprint(matches)
+    except Exception as e:
+        print(f"Error querying Pinecone: {e}")
+        return None
+
+async def _build_prompt(user_id: str, session_id: str, data: str, user_message_embedding, history: asyncio.Task):
+    """Gather context and history for a turn; returns (prompt, context, fingerprint, prompt_tokens) or None on failure.
+
+    `history` was started with the turn, so the Redis read overlaps the embedding and the Pinecone query.
+    """
+    # try:
+    #     # db = get_async_database()
+    #     # db.collection("chat_history").document(user_id).collection("sessions").document(session_id).collection("messages").add({"role": "user", "content": data})
+    # except Exception as e:
+    #     print(f"Error adding message to database: {e}")
+    #     return "Error processing your request."
+    retrieved, history_string = await asyncio.gather(_retrieve_context(session_id, user_message_embedding), history)
+    if retrieved is None:
+        return None
+    context, fingerprint = retrieved
 
-    history_string = "\n".join(recent_history)
+    # context = " ".join([r["metadata"]["text"] for r in pinecone_results["matches"]])
 
     prompt = f"""
     # System Instructions
@@ -76,28 +134,89 @@ async def get_chat_response(user_id: str, session_id: str, data: str):
     ## Response
     Assistant: """
 
+    return prompt, context, fingerprint, context_builder.record_prompt(prompt)
+
+async def get_chat_response(user_id: str, session_id: str, data: str):
+    start_time = evaluator.start_timer()
+    history = asyncio.create_task(_load_history(user_id, session_id))
+    user_message_embedding = await _embed_query(data)
+    if user_message_embedding is None:
+        history.cancel()
+        return "Error processing your request."
+
+    scope = semantic_cache.scope_key(user_id, session_id)
+    cached = _cached_answer(scope, user_message_embedding)
+    if cached is not None:
+        history.cancel()
+        evaluation_queue.submit(data, cached, "", session_id, start_time, cache_hit=True)
+        return cached
+
+    prepared = await _build_prompt(user_id, session_id, data, user_message_embedding, history)
+    if prepared is None:
+        return "Error processing your request."
+    prompt, context, fingerprint, prompt_tokens = prepared
+
+    cached = _cached_answer(scope, user_message_embedding, fingerprint)
+    if cached is not None:
+        evaluation_queue.submit(data, cached, context, session_id, start_time, cache_hit=True)
+        return cached
+
     try:
-        response = get_model().generate_content(prompt)
-        response_text = response.text
-        metrics = evaluator.evaluate_response(
-            user_query=data,
-            response=response_text,
-            context=context,
-            session_id=session_id,
-            start_time=start_time
-        )
-        print("metrics: ",metrics)
-        evaluator._store_time_metrics("latency_seconds", metrics["latency_seconds"])
-        print("latency_seconds: ",metrics["latency_seconds"])
-        # Only store relevance metrics if they exist and aren't None
-        if metrics.get("query_response_relevance") is not None:
-            evaluator._store_time_metrics("query_relevance", metrics["query_response_relevance"])
-        
-        if metrics.get("context_relevance") is not None:
-            evaluator._store_time_metrics("context_relevance", metrics["context_relevance"])
+        with tracer.span("generate"):
+            response = await generate_content_async(prompt)
+            response_text = response.text
+        _cache_answer(scope, user_message_embedding, fingerprint, response_text)
+        evaluation_queue.submit(data, response_text, context, session_id, start_time, prompt_tokens=prompt_tokens)
     
     except Exception as e:
         print(f"Error generating content: {e}")
         return "Error processing your request."
 
-    return response_text
\ No newline at end of file
+    return response_text
+
+async def stream_chat_response(user_id: str, session_id: str, data: str):
+    """Yield response chunks as the model produces them, evaluating the assembled text at the end"""
+    start_time = evaluator.start_timer()
+    history = asyncio.create_task(_load_history(user_id, session_id))
+    user_message_embedding = await _embed_query(data)
+    if user_message_embedding is None:
+        history.cancel()
+        raise RuntimeError("Error processing your request.")
+
+    scope = semantic_cache.scope_key(user_id, session_id)
+    cached = _cached_answer(scope, user_message_embedding)
+    if cached is not None:
+        history.cancel()
+        time_to_first_token = evaluator.record_time_to_first_token(start_time)
+        evaluation_queue.submit(data, cached, "", session_id, start_time, time_to_first_token, cache_hit=True)
+        yield cached
+        return
+
+    prepared = await _build_prompt(user_id, session_id, data, user_message_embedding, history)
+    if prepared is None:
+        raise RuntimeError("Error processing your request.")
+    prompt, context, fingerprint, prompt_tokens = prepared
+
+    cached = _cached_answer(scope, user_message_embedding, fingerprint)
+    if cached is not None:
+        time_to_first_token = evaluator.record_time_to_first_token(start_time)
+        evaluation_queue.submit(data, cached, context, session_id, start_time, time_to_first_token, cache_hit=True)
+        yield cached
+        return
+
+    chunks = []
+    time_to_first_token = None
+    with tracer.span("generate") as span:
+        response = await generate_content_stream_async(prompt)
+        async for chunk in response:
+            if not chunk.text:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = evaluator.record_time_to_first_token(start_time)
+                tracer.record("generate_first_chunk", time.perf_counter() - span.start, span.start, span.trace)
+            chunks.append(chunk.text)
+            yield chunk.text
+
+    response_text = "".join(chunks)
+    _cache_answer(scope, user_message_embedding, fingerprint, response_text)
+    evaluation_queue.submit(data, response_text, context, session_id, start_time, time_to_first_token, prompt_tokens=prompt_tokens)
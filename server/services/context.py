@@ -0,0 +1,137 @@
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import numpy as np
+from utils.config import (
+    CONTEXT_TOP_K,
+    CONTEXT_MIN_SCORE,
+    CONTEXT_DEDUPE_THRESHOLD,
+    CONTEXT_MMR_LAMBDA,
+    CONTEXT_TOKEN_BUDGET,
+)
+from utils.metrics import Histogram
+from utils.tokens import estimate_tokens
+
+NO_CONTEXT = "No context found."
+TOKEN_BUCKETS = [128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192]
+
+
+class ContextBuilder:
+    """Turns retrieved matches into prompt context: score cutoff, near-duplicate removal,
+    maximal marginal relevance reranking, then packing into a token budget"""
+
+    def __init__(self, top_k: int, min_score: float, dedupe_threshold: float, mmr_lambda: float, token_budget: int):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.dedupe_threshold = dedupe_threshold
+        self.mmr_lambda = mmr_lambda
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self.candidates = 0
+        self.below_min_score = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.selected = 0
+        self.context_tokens_histogram = Histogram(TOKEN_BUCKETS)
+        self.prompt_tokens_histogram = Histogram(TOKEN_BUCKETS)
+
+    @staticmethod
+    def _vectors(matches: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """L2-normalized match vectors, or None when the query didn't return values"""
+        values = [match.get("values") for match in matches]
+        if any(v is None or len(v) == 0 for v in values):
+            return None
+        matrix = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _rerank(self, matches: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Drop near-duplicates and order by MMR; returns (matches, duplicates dropped)"""
+        if not matches:
+            return [], 0
+        vectors = self._vectors(matches)
+        if vectors is None:
+            # No vectors to compare: only exact duplicate texts can be detected
+            seen, unique = set(), []
+            for match in matches:
+                text = match["metadata"]["text"].strip()
+                if text not in seen:
+                    seen.add(text)
+                    unique.append(match)
+            return unique[:self.top_k], len(matches) - len(unique)
+
+        similarity = vectors @ vectors.T
+        scores = np.array([match["score"] for match in matches], dtype=np.float32)
+        remaining = list(range(len(matches)))
+        selected: List[int] = []
+        duplicates = 0
+        while remaining and len(selected) < self.top_k:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            # Candidates too close to something already chosen are duplicates, not just less useful
+            keep = redundancy < self.dedupe_threshold
+            duplicates += int((~keep).sum())
+            remaining = [i for i, k in zip(remaining, keep) if k]
+            if not remaining:
+                break
+            redundancy = redundancy[keep]
+            mmr = self.mmr_lambda * scores[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining[int(np.argmax(mmr))]
+            selected.append(best)
+            remaining.remove(best)
+        return [matches[i] for i in selected], duplicates
+
+    def build(self, matches: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """Context string and the matches it was built from"""
+        candidates = [m for m in matches if m["score"] >= self.min_score and (m.get("metadata") or {}).get("text")]
+        below_min_score = len(matches) - len(candidates)
+        reranked, duplicates = self._rerank(candidates)
+
+        used = 0
+        chosen, texts = [], []
+        for match in reranked:
+            text = match["metadata"]["text"]
+            tokens = estimate_tokens(text)
+            if used + tokens > self.token_budget:
+                if chosen:
+                    continue
+                # The best match alone is over budget: keep its beginning rather than nothing
+                text = text[:self.token_budget * 4]
+                tokens = estimate_tokens(text)
+            chosen.append(match)
+            texts.append(text)
+            used += tokens
+
+        with self._lock:
+            self.candidates += len(matches)
+            self.below_min_score += below_min_score
+            self.duplicates += duplicates
+            self.over_budget += len(reranked) - len(chosen)
+            self.selected += len(chosen)
+        self.context_tokens_histogram.observe(used)
+        return (" ".join(texts) if texts else NO_CONTEXT), chosen
+
+    def record_prompt(self, prompt: str) -> int:
+        """Estimated prompt tokens for a turn"""
+        tokens = estimate_tokens(prompt)
+        self.prompt_tokens_histogram.observe(tokens)
+        return tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "candidates": self.candidates,
+                "below_min_score": self.below_min_score,
+                "duplicates": self.duplicates,
+                "over_budget": self.over_budget,
+                "selected": self.selected,
+                "context_tokens": self.context_tokens_histogram.snapshot(),
+                "prompt_tokens": self.prompt_tokens_histogram.snapshot(),
+            }
+
+
+# Global context builder
+context_builder = ContextBuilder(CONTEXT_TOP_K, CONTEXT_MIN_SCORE, CONTEXT_DEDUPE_THRESHOLD, CONTEXT_MMR_LAMBDA, CONTEXT_TOKEN_BUDGET)
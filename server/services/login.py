@@ -1,57 +1,59 @@
 from fastapi import HTTPException
-from storage.db import get_async_database
-from storage.redis import redis_client
+from storage.users import user_store
+from services.passwords import password_hasher, PasswordHasherBusy
+from middlewares.token import ALGORITHM
 from schema.user import UserLogin
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
-import os
-import secrets
+from utils.config import JWT_SECRET_KEY
+import logging
+import time
+import uuid
 import jwt
 
+logger = logging.getLogger(__name__)
+
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 async def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    """Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated cost"""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress, please retry")
 
 async def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire.timestamp()})
-    
-    secret_key = os.getenv("JWT_SECRET_KEY")
-    if not secret_key:
-        secret_key = secrets.token_hex(32)
-        os.environ["JWT_SECRET_KEY"] = secret_key
+    issued_at = int(time.time())
+    # jti identifies the token for revocation; every worker verifies with the same shared key
+    to_encode.update({"iat": issued_at, "exp": issued_at + ACCESS_TOKEN_EXPIRE_MINUTES * 60, "jti": uuid.uuid4().hex})
     
-    encoded_jwt = jwt.encode(to_encode, secret_key, algorithm="HS256")
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 async def login_user(user_data: UserLogin):
-    db = get_async_database()
-    users_ref = db.collection("users")
-    query = users_ref.where("email", "==", user_data.email).limit(1)
-    results = list(query.stream())
+    user_doc = await user_store.get_by_email(user_data.email)
     
-    if not results:
+    if user_doc is None:
         raise HTTPException(
             status_code=401,
             detail="Incorrect email or password"
         )
     
-    user_doc = results[0].to_dict()
-    
-    if not await verify_password(user_data.password, user_doc["password_hash"]):
+    valid, new_hash = await verify_password(user_data.password, user_doc["password_hash"])
+    if not valid:
         raise HTTPException(
             status_code=401,
             detail="Incorrect email or password"
         )
     
     user_id = user_doc["user_id"]
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this password was stored
+        try:
+            await user_store.update_password_hash(user_id, new_hash)
+        except Exception as e:
+            logger.warning(f"Could not rehash password for {user_id}: {e}")
     access_token = await create_access_token({"user_id": user_id})
     
-    redis_client.set(access_token, user_id, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60) 
-    
     return {
         "access_token": access_token,
         "token_type": "bearer",
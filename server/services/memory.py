@@ -0,0 +1,223 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import time
+import uuid
+from models.llm import generate_content_async
+from storage.redis import async_redis_client
+from utils.config import (
+    MEMORY_WINDOW_MESSAGES,
+    MEMORY_HISTORY_TOKEN_BUDGET,
+    MEMORY_COMPACT_BATCH_MESSAGES,
+    MEMORY_SUMMARY_MAX_TOKENS,
+    MEMORY_TTL_SECONDS,
+)
+from utils.metrics import Histogram
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_LOCK_TTL_SECONDS = 60
+
+# Saves a new summary and drops the messages it covers from the head of the history.
+# While the model was summarizing, append's length cap may already have trimmed some
+# of them, so only the summarized messages still at the head are removed.
+# KEYS: history, summary. ARGV: summary text, updated, ttl, then the summarized messages.
+APPLY_SUMMARY_SCRIPT = """
+local summarized = {}
+for i = 4, #ARGV do
+    summarized[#summarized + 1] = ARGV[i]
+end
+local n = #summarized
+local head = redis.call('LRANGE', KEYS[1], 0, n - 1)
+local dropped = n
+for offset = 0, n - 1 do
+    local matches = true
+    for i = 1, n - offset do
+        if head[i] ~= summarized[offset + i] then
+            matches = false
+            break
+        end
+    end
+    if matches then
+        dropped = offset
+        break
+    end
+end
+local remaining = n - dropped
+if remaining > 0 then
+    redis.call('LTRIM', KEYS[1], remaining, -1)
+end
+redis.call('HSET', KEYS[2], 'text', ARGV[1], 'updated', ARGV[2])
+redis.call('HINCRBY', KEYS[2], 'messages', n)
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+return remaining
+"""
+
+# Deletes the lock only if it still holds our token, so an expired lock taken over by another worker survives
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ConversationMemory:
+    """Bounded per-session chat history: the newest messages verbatim plus a rolling summary of older ones"""
+
+    def __init__(self, window_messages: int, token_budget: int, compact_batch: int,
+                 summary_max_tokens: int, ttl_seconds: int):
+        self.window_messages = window_messages
+        self.token_budget = token_budget
+        self.compact_batch = compact_batch
+        self.summary_max_tokens = summary_max_tokens
+        self.ttl_seconds = ttl_seconds
+        # Hard cap so the list stays bounded even if summarization keeps failing
+        self.max_messages = window_messages + 4 * compact_batch
+        self._tasks = set()
+        self._apply_summary = async_redis_client.register_script(APPLY_SUMMARY_SCRIPT)
+        self._release_lock = async_redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self.compactions = 0
+        self.compaction_errors = 0
+        self.history_tokens_histogram = Histogram([64, 128, 256, 512, 1024, 1536, 2048, 4096])
+
+    @staticmethod
+    def history_key(user_id: str, session_id: str) -> str:
+        return f"chat_history:{user_id}:{session_id}"
+
+    @staticmethod
+    def summary_key(user_id: str, session_id: str) -> str:
+        return f"chat_summary:{user_id}:{session_id}"
+
+    @staticmethod
+    def turns_key(user_id: str, session_id: str) -> str:
+        return f"chat_turns:{user_id}:{session_id}"
+
+    async def append(self, user_id: str, session_id: str, user_message: str, bot_message: str) -> int:
+        """Record a turn in one MULTI/EXEC round-trip; returns the turn number"""
+        history_key = self.history_key(user_id, session_id)
+        turns_key = self.turns_key(user_id, session_id)
+        pipe = async_redis_client.pipeline(transaction=True)
+        pipe.rpush(history_key, f"User: {user_message}", f"Chatbot: {bot_message}")
+        pipe.ltrim(history_key, -self.max_messages, -1)
+        pipe.incr(turns_key)
+        pipe.expire(history_key, self.ttl_seconds)
+        pipe.expire(turns_key, self.ttl_seconds)
+        pipe.expire(self.summary_key(user_id, session_id), self.ttl_seconds)
+        length, _, turn, *_ = await pipe.execute()
+
+        if length > self.window_messages + self.compact_batch:
+            task = asyncio.create_task(self._compact_in_background(user_id, session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return turn
+
+    async def load(self, user_id: str, session_id: str) -> str:
+        """History for the prompt: the summary, then the newest messages that fit the token budget, oldest first"""
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.lrange(self.history_key(user_id, session_id), -self.window_messages, -1)
+        pipe.hget(self.summary_key(user_id, session_id), "text")
+        messages, summary = await pipe.execute()
+
+        lines = []
+        used = 0
+        if summary:
+            lines.append(f"Summary of earlier conversation: {summary.decode('utf-8')}")
+            used = estimate_tokens(lines[0])
+
+        # Whole turns only, so a reply never appears without the question it answers
+        recent: List[str] = []
+        turn: List[str] = []
+        for raw in reversed(messages):
+            turn.insert(0, raw.decode("utf-8"))
+            if not turn[0].startswith("User: "):
+                continue
+            tokens = sum(estimate_tokens(message) for message in turn)
+            if used + tokens > self.token_budget:
+                break
+            recent[:0] = turn
+            used += tokens
+            turn = []
+        self.history_tokens_histogram.observe(used)
+        return "\n".join(lines + recent)
+
+    async def _compact_in_background(self, user_id: str, session_id: str) -> None:
+        try:
+            await self.compact(user_id, session_id)
+        except Exception as e:
+            self.compaction_errors += 1
+            logger.warning(f"Conversation summary for {session_id} failed: {e}")
+
+    async def compact(self, user_id: str, session_id: str) -> None:
+        """Fold the messages that fell out of the window into the session summary"""
+        lock_key = f"chat_summary_lock:{user_id}:{session_id}"
+        token = uuid.uuid4().hex
+        # One compaction per session at a time, across every worker
+        if not await async_redis_client.set(lock_key, token, nx=True, ex=SUMMARY_LOCK_TTL_SECONDS):
+            return
+        try:
+            history_key = self.history_key(user_id, session_id)
+            summary_key = self.summary_key(user_id, session_id)
+            pipe = async_redis_client.pipeline(transaction=True)
+            pipe.llen(history_key)
+            pipe.hget(summary_key, "text")
+            length, summary = await pipe.execute()
+            excess = length - self.window_messages
+            if excess <= 0:
+                return
+
+            old_messages = [m.decode("utf-8") for m in await async_redis_client.lrange(history_key, 0, excess - 1)]
+            new_summary = await self._summarize(summary.decode("utf-8") if summary else None, old_messages)
+
+            # Summary and trim in one script, which removes exactly the summarized messages still in the list
+            await self._apply_summary(
+                keys=[history_key, summary_key],
+                args=[new_summary, time.time(), self.ttl_seconds, *old_messages]
+            )
+            self.compactions += 1
+        finally:
+            await self._release_lock(keys=[lock_key], args=[token])
+
+    async def _summarize(self, summary: Optional[str], messages: List[str]) -> str:
+        transcript = "\n".join(messages)
+        prompt = f"""
+    Update the running summary of a conversation between a user and an assistant.
+    Keep facts about the user, their goals and preferences, decisions made and open questions.
+    Drop greetings and small talk. Answer with the summary only, in at most {self.summary_max_tokens * 3 // 4} words.
+
+    ## Current Summary
+    {summary or "(none yet)"}
+
+    ## New Messages
+    {transcript}
+
+    ## Updated Summary
+    """
+        response = await generate_content_async(prompt, background=True, temperature=0.2, max_output_tokens=self.summary_max_tokens)
+        return response.text.strip()
+
+    async def stop(self) -> None:
+        """Let in-flight compactions finish before the Redis pool is closed"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window_messages": self.window_messages,
+            "token_budget": self.token_budget,
+            "compactions": self.compactions,
+            "compaction_errors": self.compaction_errors,
+            "compactions_in_flight": len(self._tasks),
+            "history_tokens": self.history_tokens_histogram.snapshot(),
+        }
+
+
+# Global conversation memory
+conversation_memory = ConversationMemory(
+    MEMORY_WINDOW_MESSAGES,
+    MEMORY_HISTORY_TOKEN_BUDGET,
+    MEMORY_COMPACT_BATCH_MESSAGES,
+    MEMORY_SUMMARY_MAX_TOKENS,
+    MEMORY_TTL_SECONDS,
+)
@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import multiprocessing
+import time
+from passlib.context import CryptContext
+from utils.config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_WAITING
+from utils.metrics import Histogram
+
+# Pinning min and max rounds to the configured cost makes any other cost "needs update"
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt in a small process pool so hashing never holds the event loop (or its GIL)"""
+
+    def __init__(self, workers: int, max_waiting: int):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.queue_wait_histogram = Histogram([0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+        self.run_time_histogram = Histogram([0.05, 0.1, 0.2, 0.3, 0.5, 1, 2])
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the server process already runs threads
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._semaphore = asyncio.Semaphore(self.workers)
+        return self._executor
+
+    async def _run(self, func, *args):
+        executor = self._get_executor()
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        enqueued_at = time.perf_counter()
+        # Queue here rather than inside the pool, so waiting work stays visible and cancellable
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        started_at = time.perf_counter()
+        self.queue_wait_histogram.observe(started_at - enqueued_at)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.run_time_histogram.observe(time.perf_counter() - started_at)
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; the second value is a new hash when the stored one uses another cost"""
+        valid, new_hash = await self._run(_verify_and_update, password, password_hash)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "rounds": BCRYPT_ROUNDS,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "queue_wait": self.queue_wait_histogram.snapshot(),
+            "run_time": self.run_time_histogram.snapshot(),
+        }
+
+
+# Global hasher; worker processes start on the first login or signup
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_WAITING)
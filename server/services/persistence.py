@@ -0,0 +1,132 @@
+from collections import Counter
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import time
+from models.embedding import get_embedding_async
+from services.memory import conversation_memory
+from storage.pinecone import upsert_buffer, make_vector_id
+from storage.session_index import session_index, session_index_sync
+from utils.config import TURN_PERSIST_MAX_PENDING, TURN_PERSIST_DRAIN_SECONDS
+from utils.metrics import Histogram
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class TurnPersister:
+    """Saves finished turns after the reply has gone out, in order within each session.
+
+    A turn's write waits for the previous write of its session, so history and
+    turn numbers never interleave; different sessions persist concurrently. The
+    next turn of a session waits (via wait()) only if its predecessor is still
+    being saved, so it always reads its own history.
+    """
+
+    def __init__(self, max_pending: int, drain_seconds: float):
+        self.max_pending = max_pending
+        self.drain_seconds = drain_seconds
+        self._slots = asyncio.Semaphore(max_pending)
+        self._tails: Dict[str, asyncio.Task] = {}  # newest pending write of each session
+        self._tasks = set()
+        self.submitted = 0
+        self.persisted = 0
+        self.backpressure_waits = 0
+        self.failures: Counter = Counter()  # step -> count
+        self.last_error: Optional[str] = None
+        self.lag_histogram = Histogram([0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+
+    async def submit(self, user_id: str, session_id: str, user_message: str, bot_message: str) -> asyncio.Task:
+        """Hand a turn to the background and return its task; only waits when max_pending turns are already unsaved"""
+        if self._slots.locked():
+            self.backpressure_waits += 1
+        await self._slots.acquire()
+        previous = self._tails.get(session_id)
+        task = asyncio.create_task(
+            self._persist(previous, user_id, session_id, user_message, bot_message, time.perf_counter())
+        )
+        self._tails[session_id] = task
+        self._tasks.add(task)
+        self.submitted += 1
+        task.add_done_callback(lambda t: self._done(session_id, t))
+        return task
+
+    def _done(self, session_id: str, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if self._tails.get(session_id) is task:
+            del self._tails[session_id]
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            self._fail("unexpected", session_id, task.exception())
+
+    def _fail(self, step: str, session_id: str, error: BaseException) -> None:
+        self.failures[step] += 1
+        self.last_error = f"{step}: {error}"
+        logger.error(f"Could not persist turn of session {session_id} ({step}): {error}")
+
+    async def wait(self, session_id: str) -> None:
+        """Return once the session's earlier turns are saved; immediate in the usual case"""
+        task = self._tails.get(session_id)
+        if task is not None:
+            with tracer.span("persist_wait"):
+                await asyncio.wait([task])
+
+    async def _persist(self, previous: Optional[asyncio.Task], user_id: str, session_id: str,
+                       user_message: str, bot_message: str, submitted_at: float) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        # History and the turn counter in one MULTI/EXEC round-trip
+        try:
+            with tracer.span("persist_history"):
+                turn = await conversation_memory.append(user_id, session_id, user_message, bot_message)
+        except Exception as e:
+            self._fail("history", session_id, e)
+            return
+
+        # Vector for the turn: buffered for Pinecone, and added to the hot local index of every worker
+        try:
+            with tracer.span("embed_turn"):
+                embedding = await get_embedding_async(user_message + bot_message)
+            vector = {
+                "id": make_vector_id(session_id, turn),
+                "values": embedding,
+                "metadata": {"text": user_message + bot_message, "session_id": session_id, "turn": turn}
+            }
+            upsert_buffer.add(vector)
+            session_index.add(session_id, vector)
+            await session_index_sync.publish(session_id, vector)
+        except Exception as e:
+            self._fail("vector", session_id, e)
+            return
+
+        self.persisted += 1
+        self.lag_histogram.observe(time.perf_counter() - submitted_at)
+
+    async def stop(self) -> None:
+        """Let in-flight turns finish within the drain period, then cancel the rest"""
+        pending = list(self._tasks)
+        if not pending:
+            return
+        _, unfinished = await asyncio.wait(pending, timeout=self.drain_seconds)
+        if unfinished:
+            logger.warning(f"Dropping {len(unfinished)} unsaved turns on shutdown")
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._tasks),
+            "sessions_pending": len(self._tails),
+            "submitted": self.submitted,
+            "persisted": self.persisted,
+            "backpressure_waits": self.backpressure_waits,
+            "failures": dict(self.failures),
+            "last_error": self.last_error,
+            "lag": self.lag_histogram.snapshot(),
+        }
+
+
+# Global persister; drained on shutdown before the Pinecone buffer's final flush
+turn_persister = TurnPersister(TURN_PERSIST_MAX_PENDING, TURN_PERSIST_DRAIN_SECONDS)
@@ -0,0 +1,149 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import time
+from utils.config import WARMUP_TIMEOUT_SECONDS, WARMUP_MAX_RETRY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"  # last attempt failed; still retrying in the background
+
+
+class Dependency:
+    """One external client and the result of warming it up"""
+
+    def __init__(self, name: str, warm_up: Callable[[], Awaitable[Any]], required: bool):
+        self.name = name
+        self.warm_up = warm_up
+        self.required = required
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.attempt: Optional[asyncio.Future] = None  # the warm-up call in progress, if any
+        self.warmup_seconds: Optional[float] = None  # duration of the successful attempt
+        self.ready_after_seconds: Optional[float] = None  # since the app module was imported
+
+
+class Readiness:
+    """Warms external clients up concurrently once the app is serving, and reports their state.
+
+    Nothing here blocks startup: liveness is answered immediately, and the readiness
+    probe turns healthy once every required dependency has connected. Failed
+    dependencies are retried with backoff instead of crashing the process.
+    """
+
+    def __init__(self, imported_at: float, timeout: float, max_retry_seconds: float):
+        self.imported_at = imported_at
+        self.timeout = timeout
+        self.max_retry_seconds = max_retry_seconds
+        self._dependencies: Dict[str, Dependency] = {}
+        self._tasks = set()
+        self.startup_seconds: Optional[float] = None
+        self.first_request_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+
+    def register(self, name: str, warm_up: Callable[[], Awaitable[Any]], required: bool = True) -> None:
+        self._dependencies[name] = Dependency(name, warm_up, required)
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self.imported_at
+
+    async def start(self) -> None:
+        """Begin warming every dependency; returns immediately"""
+        self.startup_seconds = self._elapsed()
+        logger.info(f"App started {self.startup_seconds:.3f}s after import")
+        for dependency in self._dependencies.values():
+            task = asyncio.create_task(self._warm(dependency))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks) + [d.attempt for d in self._dependencies.values() if d.attempt is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _warm(self, dependency: Dependency) -> None:
+        delay = 0.5
+        while True:
+            # At most one attempt per dependency: a timed-out attempt may still hold an executor
+            # thread, so it is waited on again rather than joined by another
+            if dependency.attempt is None or dependency.attempt.done():
+                dependency.attempts += 1
+                dependency.attempt = asyncio.ensure_future(dependency.warm_up())
+                started = time.perf_counter()
+            done, _ = await asyncio.wait({dependency.attempt}, timeout=self.timeout)
+            error = None
+            if not done:
+                error = f"no answer within {self.timeout:.0f}s"
+            elif dependency.attempt.exception() is not None:
+                e = dependency.attempt.exception()
+                error = str(e) or type(e).__name__
+            if error is not None:
+                dependency.state = FAILED
+                dependency.error = error
+                logger.warning(f"Warm-up of {dependency.name} failed (attempt {dependency.attempts}), retrying in {delay:.1f}s: {dependency.error}")
+                await asyncio.sleep(delay)
+                delay = min(self.max_retry_seconds, delay * 2)
+                continue
+            dependency.state = READY
+            dependency.error = None
+            dependency.warmup_seconds = time.perf_counter() - started
+            dependency.ready_after_seconds = self._elapsed()
+            logger.info(f"{dependency.name} ready in {dependency.warmup_seconds:.3f}s ({dependency.ready_after_seconds:.3f}s after import)")
+            if self.ready_seconds is None and self.is_ready():
+                self.ready_seconds = dependency.ready_after_seconds
+            return
+
+    def record_request(self) -> None:
+        """Called for every request until the first one has been timed"""
+        if self.first_request_seconds is None:
+            self.first_request_seconds = self._elapsed()
+            logger.info(f"First request {self.first_request_seconds:.3f}s after import")
+
+    def is_ready(self) -> bool:
+        return all(d.state == READY for d in self._dependencies.values() if d.required)
+
+    def get_startup_stats(self) -> Dict[str, Optional[float]]:
+        """Seconds from importing the app to each startup milestone"""
+        return {
+            "import_to_startup_seconds": self.startup_seconds,
+            "import_to_first_request_seconds": self.first_request_seconds,
+            "import_to_ready_seconds": self.ready_seconds,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.is_ready(),
+            "dependencies": {
+                d.name: {
+                    "state": d.state,
+                    "required": d.required,
+                    "attempts": d.attempts,
+                    "error": d.error,
+                    "warmup_seconds": d.warmup_seconds,
+                    "ready_after_seconds": d.ready_after_seconds,
+                }
+                for d in self._dependencies.values()
+            },
+            "startup": self.get_startup_stats(),
+        }
+
+
+class FirstRequestTimer:
+    """ASGI middleware timing the first HTTP or WebSocket request after import; a flag check afterwards"""
+
+    def __init__(self, app, readiness: Readiness):
+        self.app = app
+        self.readiness = readiness
+
+    async def __call__(self, scope, receive, send):
+        if self.readiness.first_request_seconds is None and scope["type"] in ("http", "websocket"):
+            self.readiness.record_request()
+        await self.app(scope, receive, send)
+
+
+# main.py imports this module before anything else, so its import time is the app's
+readiness = Readiness(time.perf_counter(), WARMUP_TIMEOUT_SECONDS, WARMUP_MAX_RETRY_SECONDS)
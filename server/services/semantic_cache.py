@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import hashlib
+import itertools
+import threading
+import time
+import numpy as np
+from utils.config import (
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_SCOPE,
+)
+
+
+def context_fingerprint(matches: List[Dict[str, Any]]) -> str:
+    """Digest of the retrieved match IDs, independent of their order"""
+    ids = sorted(str(match["id"]) for match in matches)
+    return hashlib.sha1("\x00".join(ids).encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Answers near-duplicate queries from earlier responses in the same scope"""
+
+    def __init__(self, threshold: float, ttl_seconds: int, max_entries: int, scope: str):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.scope = scope
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._by_scope: Dict[str, set] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def scope_key(self, user_id: str, session_id: str) -> str:
+        return f"user:{user_id}" if self.scope == "user" else f"session:{session_id}"
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        scope_ids = self._by_scope.get(entry["scope"])
+        if scope_ids is not None:
+            scope_ids.discard(entry_id)
+            if not scope_ids:
+                del self._by_scope[entry["scope"]]
+
+    def lookup(self, scope: str, embedding: List[float], fingerprint: str) -> Optional[str]:
+        """Return the cached response most similar to the query, if above the threshold and with the same fingerprint"""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_scope.get(scope, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created_at"] > self.ttl_seconds:
+                    self._remove(entry_id)
+                elif entry["fingerprint"] == fingerprint:
+                    candidates.append(entry_id)
+
+            if candidates:
+                matrix = np.stack([self._entries[i]["embedding"] for i in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return self._entries[entry_id]["response"]
+
+            self.misses += 1
+            return None
+
+    def store(self, scope: str, embedding: List[float], fingerprint: str, response: str) -> None:
+        """Remember a response, evicting the least recently used entries past the size cap"""
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "scope": scope,
+                "embedding": self._normalize(embedding),
+                "fingerprint": fingerprint,
+                "response": response,
+                "created_at": time.time(),
+            }
+            self._by_scope.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "scope": self.scope,
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_SCOPE)
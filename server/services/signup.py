@@ -1,30 +1,18 @@
 from fastapi import HTTPException
-from storage.db import get_async_database
-from storage.redis import get_redis_client
+from storage.users import user_store, UserAlreadyExists
+from services.passwords import password_hasher, PasswordHasherBusy
 from schema.user import UserSignup
 import uuid
 from datetime import datetime
-from passlib.context import CryptContext
 from services.login import create_access_token
-from services.login import ACCESS_TOKEN_EXPIRE_MINUTES
-from services.login import pwd_context
 
 async def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many signups in progress, please retry")
 
 async def signup_user(user_data: UserSignup):
-    # Check if user already exists
-    db = get_async_database()
-    users_ref = db.collection("users")
-    query = users_ref.where("email", "==", user_data.email).limit(1)
-    results = query.stream()
-    
-    if any(results):
-        raise HTTPException(
-            status_code=400,
-            detail="User with this email already exists"
-        )
-    
     # Create new user
     user_id = str(uuid.uuid4())
     user_doc = {
@@ -35,16 +23,18 @@ async def signup_user(user_data: UserSignup):
         "created_at": datetime.utcnow()
     }
     
-    # Save user to Firestore
-    users_ref.document(user_id).set(user_doc)
+    # Save user to Firestore; fails if the email is already registered
+    try:
+        await user_store.create(user_doc)
+    except UserAlreadyExists:
+        raise HTTPException(
+            status_code=400,
+            detail="User with this email already exists"
+        )
     
     # Create access token
     access_token = await create_access_token({"user_id": user_id})
     
-    # Store token in Redis for verification
-    redis_client = get_redis_client()
-    redis_client.set(access_token, user_id, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)  # Expire in Redis too
-    
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import hashlib
+import logging
+import threading
+import numpy as np
+from storage.redis import redis_client
+from utils.config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-process LRU backed by Redis"""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, model: str, task_type: str) -> str:
+        """Build the cache key from a digest of the model, task type and text"""
+        digest = hashlib.sha256(f"{model}\x00{task_type}\x00{text}".encode("utf-8")).hexdigest()
+        return f"embedding:{digest}"
+
+    @staticmethod
+    def _encode(embedding: List[float]) -> bytes:
+        """Pack an embedding as little-endian float32 bytes"""
+        return np.asarray(embedding, dtype="<f4").tobytes()
+
+    @staticmethod
+    def _decode(payload: bytes) -> List[float]:
+        """Unpack float32 bytes back into a list of floats"""
+        return np.frombuffer(payload, dtype="<f4").tolist()
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def peek(self, text: str, model: str, task_type: str) -> Optional[List[float]]:
+        """Check only the in-process tier, never touching Redis"""
+        key = self.make_key(text, model, task_type)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                return None
+            self._entries.move_to_end(key)
+            self.local_hits += 1
+        return self._decode(payload)
+
+    def get(self, text: str, model: str, task_type: str) -> Optional[List[float]]:
+        """Return the cached embedding, or None on a miss"""
+        key = self.make_key(text, model, task_type)
+
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return self._decode(payload)
+
+        try:
+            payload = redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            payload = None
+
+        if payload is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.redis_hits += 1
+        self._remember(key, payload)
+        return self._decode(payload)
+
+    def set(self, text: str, model: str, task_type: str, embedding: List[float]) -> None:
+        """Store an embedding in both tiers"""
+        key = self.make_key(text, model, task_type)
+        payload = self._encode(embedding)
+        self._remember(key, payload)
+        try:
+            redis_client.set(key, payload, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def get_stats(self) -> Dict[str, float]:
+        """Hit/miss counters for the metrics endpoint"""
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            lookups = hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups > 0 else 0,
+                "local_entries": len(self._entries),
+            }
+
+
+# Global cache instance
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
@@ -1,9 +1,26 @@
 from pinecone import Pinecone
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import logging
 import os
+import random
+import threading
 from dotenv import load_dotenv
+from utils.concurrency import run_blocking
+from utils.tracing import tracer
+from utils.config import (
+    PINECONE_INDEX,
+    PINECONE_UPSERT_BATCH_SIZE,
+    PINECONE_UPSERT_FLUSH_SECONDS,
+    PINECONE_UPSERT_MAX_RETRIES,
+    PINECONE_UPSERT_MAX_BUFFERED,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def get_pinecone_client():
     api_key = os.getenv("PINECONE_API_KEY")
     # Add environment parameter which is required
@@ -13,7 +30,7 @@ def get_pinecone_client():
     
     return Pinecone(api_key=api_key)
 
-def get_pinecone_index(name="chats-db", dimension=768):
+def get_pinecone_index(name=PINECONE_INDEX, dimension=768):
     pc = get_pinecone_client()
     
     # List available indexes
@@ -38,4 +55,137 @@ def get_pinecone_index(name="chats-db", dimension=768):
     return pc.Index(name)
 
 
-pinecone_index = get_pinecone_index()
\ No newline at end of file
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """The shared index, connected on first use rather than at import (listing/creating indexes is a network call)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = get_pinecone_index()
+    return _index
+
+
+async def query_async(**kwargs):
+    """Query the index on the blocking-I/O pool"""
+    return await run_blocking(lambda: get_index().query(**kwargs))
+
+async def upsert_async(**kwargs):
+    """Upsert into the index on the blocking-I/O pool"""
+    return await run_blocking(lambda: get_index().upsert(**kwargs))
+
+
+def make_vector_id(session_id: str, turn: int) -> str:
+    """Stable vector ID for a conversation turn, identical across processes and restarts"""
+    return hashlib.sha256(f"{session_id}:{turn}".encode("utf-8")).hexdigest()
+
+
+class UpsertBuffer:
+    """Write-behind buffer that flushes vectors to Pinecone in bulk upserts"""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_retries: int, max_buffered: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_buffered = max_buffered
+        self._buffer: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.upserted = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def add(self, vector: Dict[str, Any]) -> None:
+        """Queue a vector; a full batch wakes the flusher immediately"""
+        self._buffer.append(vector)
+        if len(self._buffer) > self.max_buffered:
+            overflow = len(self._buffer) - self.max_buffered
+            del self._buffer[:overflow]
+            self.dropped += overflow
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Let the flusher finish its current flush, then push out whatever is still buffered"""
+        if self._task is not None:
+            # Not cancelled: a cancel landing mid-upsert would lose the batch being sent
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break  # stop() does the final flush
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Pinecone flush failed: {e}")
+
+    async def flush(self) -> None:
+        """Upsert everything currently buffered in batch_size chunks"""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:len(batch)]
+                try:
+                    upserted = await self._upsert_with_retry(batch)
+                except asyncio.CancelledError:
+                    self._buffer[:0] = batch
+                    raise
+                if not upserted:
+                    # Put the batch back for the next flush instead of losing it
+                    self._buffer[:0] = batch
+                    break
+
+    async def _upsert_with_retry(self, batch: List[Dict[str, Any]]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with tracer.span("pinecone_upsert"):
+                    await upsert_async(vectors=batch)
+                self.upserted += len(batch)
+                self.batches += 1
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Giving up on Pinecone upsert of {len(batch)} vectors for now: {e}")
+                    return False
+                self.retries += 1
+                delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+                logger.warning(f"Pinecone upsert failed, retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+        return False
+
+    def get_stats(self) -> Dict[str, int]:
+        """Buffer counters for the metrics endpoint"""
+        return {
+            "buffered": len(self._buffer),
+            "upserted": self.upserted,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+        }
+
+
+# Global write-behind buffer
+upsert_buffer = UpsertBuffer(
+    PINECONE_UPSERT_BATCH_SIZE,
+    PINECONE_UPSERT_FLUSH_SECONDS,
+    PINECONE_UPSERT_MAX_RETRIES,
+    PINECONE_UPSERT_MAX_BUFFERED,
+)
@@ -1,16 +1,30 @@
 import redis
+import redis.asyncio as aioredis
 import os
+from utils.config import REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT_SECONDS
+
 def get_redis_client():
     redis_host = os.environ.get("REDIS_HOST", "redis")
     redis_port = int(os.environ.get("REDIS_PORT", 6379))
-    try:
-        redis_client = redis.Redis(host=redis_host, port=redis_port, username=os.environ.get("REDIS_USERNAME"), password=os.environ.get("REDIS_PASSWORD"))
-        print("Connected to Redis successfully")
-    except Exception as e:
-        print(f"Error connecting to Redis: {str(e)}")
-        raise e
-    return redis_client
+    # Connections are opened by the first command, so creating clients at import costs no network time
+    return redis.Redis(host=redis_host, port=redis_port, username=os.environ.get("REDIS_USERNAME"), password=os.environ.get("REDIS_PASSWORD"))
 
+def get_async_redis_client():
+    """Async client backed by a connection pool shared across all sessions of this worker.
 
-redis_client = get_redis_client()
+    The pool is blocking: past max_connections a command waits for a free
+    connection (up to the timeout) instead of failing with "Too many connections".
+    """
+    pool = aioredis.BlockingConnectionPool(
+        host=os.environ.get("REDIS_HOST", "redis"),
+        port=int(os.environ.get("REDIS_PORT", 6379)),
+        username=os.environ.get("REDIS_USERNAME"),
+        password=os.environ.get("REDIS_PASSWORD"),
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_SECONDS,
+    )
+    return aioredis.Redis(connection_pool=pool)
 
+
+redis_client = get_redis_client()
+async_redis_client = get_async_redis_client()
@@ -0,0 +1,255 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import json
+import logging
+import threading
+import time
+import uuid
+import numpy as np
+from storage.redis import async_redis_client
+from utils.config import (
+    SESSION_INDEX_MAX_SESSIONS,
+    SESSION_INDEX_MAX_VECTORS,
+    SESSION_INDEX_IDLE_SECONDS,
+    SESSION_INDEX_RECENT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+HOT = "hot"          # every vector of the session is held locally
+PARTIAL = "partial"  # the session outgrew the local index; use Pinecone
+
+TURNS_CHANNEL = "session_index:turns"
+
+
+class _Session:
+    def __init__(self):
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.matrix: Optional[np.ndarray] = None  # (n, dim) float32, rows L2-normalized
+        self.state = HOT
+        self.last_used = time.time()
+
+
+class SessionVectorIndex:
+    """Local top-k search over a session's turns, with Pinecone kept as the durable tier"""
+
+    def __init__(self, max_sessions: int, max_vectors: int, idle_seconds: int, recent_seconds: int):
+        self.max_sessions = max_sessions
+        self.max_vectors = max_vectors
+        self.idle_seconds = idle_seconds
+        self.recent_seconds = recent_seconds
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        # Turns of sessions not held here, kept briefly since Pinecone may not have them yet
+        self._recent: "OrderedDict[str, List[Tuple[float, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_queries = 0
+        self.warmups = 0
+        self.evictions = 0
+        self.resets = 0
+
+    @staticmethod
+    def _normalize(values) -> np.ndarray:
+        matrix = np.atleast_2d(np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - session.last_used > self.idle_seconds:
+                del self._sessions[session_id]
+                self.evictions += 1
+            else:
+                break
+
+    def state(self, session_id: str) -> Optional[str]:
+        """HOT, PARTIAL, or None if the session has not been seen by this worker"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.state if session is not None else None
+
+    def warm(self, session_id: str, matches: List[Dict[str, Any]]) -> None:
+        """Load a session from a Pinecone query made with include_values=True.
+
+        Recent turns from other workers are merged in: they may still be in a write-behind buffer.
+        """
+        with self._lock:
+            known = {m["id"] for m in matches}
+            matches = list(matches) + [
+                vector for _, vector in self._recent.pop(session_id, []) if vector["id"] not in known
+            ]
+            session = _Session()
+            if len(matches) >= self.max_vectors:
+                session.state = PARTIAL
+            elif matches:
+                session.ids = [m["id"] for m in matches]
+                session.metadata = [dict(m["metadata"] or {}) for m in matches]
+                session.matrix = self._normalize([m["values"] for m in matches])
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self.warmups += 1
+            self._evict()
+
+    def _remember_recent(self, session_id: str, vector: Dict[str, Any]) -> None:
+        now = time.time()
+        self._recent.setdefault(session_id, []).append((now, vector))
+        self._recent.move_to_end(session_id)
+        while self._recent:
+            oldest_id, entries = next(iter(self._recent.items()))
+            if len(self._recent) > self.max_sessions or now - entries[-1][0] > self.recent_seconds:
+                del self._recent[oldest_id]
+            else:
+                break
+
+    def add(self, session_id: str, vector: Dict[str, Any]) -> None:
+        """Add a freshly upserted turn; sessions not held locally only remember it until Pinecone has caught up"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._remember_recent(session_id, vector)
+                return
+            if session.state != HOT or vector["id"] in session.ids:
+                return
+            if len(session.ids) >= self.max_vectors:
+                # Dropping old turns would make local results incomplete
+                session.state = PARTIAL
+                session.ids, session.metadata, session.matrix = [], [], None
+                return
+            row = self._normalize(vector["values"])
+            session.matrix = row if session.matrix is None else np.vstack([session.matrix, row])
+            session.ids.append(vector["id"])
+            session.metadata.append(dict(vector.get("metadata") or {}))
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+
+    def reset(self) -> None:
+        """Forget every session, so each is warmed again from Pinecone on its next turn"""
+        with self._lock:
+            self._sessions.clear()
+            self._recent.clear()
+            self.resets += 1
+
+    def query(self, session_id: str, vector: List[float], top_k: int) -> Dict[str, Any]:
+        """Cosine top-k over a hot session, shaped like a Pinecone query response"""
+        with self._lock:
+            session = self._sessions[session_id]
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            self.local_queries += 1
+            if session.matrix is None:
+                return {"matches": []}
+
+            scores = session.matrix @ self._normalize(vector)[0]
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return {
+                "matches": [
+                    {
+                        "id": session.ids[i],
+                        "score": float(scores[i]),
+                        "values": session.matrix[i],
+                        "metadata": session.metadata[i],
+                    }
+                    for i in top
+                ]
+            }
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "partial_sessions": sum(1 for s in self._sessions.values() if s.state == PARTIAL),
+                "vectors": sum(len(s.ids) for s in self._sessions.values()),
+                "local_queries": self.local_queries,
+                "warmups": self.warmups,
+                "evictions": self.evictions,
+                "resets": self.resets,
+            }
+
+
+def _encode_turn(origin: str, session_id: str, vector: Dict[str, Any]) -> str:
+    values = base64.b64encode(np.asarray(vector["values"], dtype=np.float32).tobytes()).decode("ascii")
+    return json.dumps({"origin": origin, "session_id": session_id, "id": vector["id"],
+                       "metadata": vector.get("metadata") or {}, "values": values})
+
+
+def _decode_turn(data) -> Tuple[str, str, Dict[str, Any]]:
+    message = json.loads(data)
+    values = np.frombuffer(base64.b64decode(message["values"]), dtype=np.float32)
+    return message["origin"], message["session_id"], {"id": message["id"], "metadata": message["metadata"], "values": values}
+
+
+class SessionIndexSync:
+    """Keeps hot sessions complete across workers and instances.
+
+    Each turn's vector is published once on Redis pub/sub, and every other worker
+    adds it to its index, so retrieval stays local with no per-turn Redis read. A
+    worker whose listener drops may have missed turns, so it forgets its sessions
+    and warms them again from Pinecone.
+    """
+
+    def __init__(self, index: SessionVectorIndex):
+        self.index = index
+        self.origin = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.publish_errors = 0
+        self.received = 0
+
+    async def publish(self, session_id: str, vector: Dict[str, Any]) -> None:
+        """Share a turn that was just added locally; failures are counted, not raised"""
+        try:
+            await async_redis_client.publish(TURNS_CHANNEL, _encode_turn(self.origin, session_id, vector))
+            self.published += 1
+        except Exception as e:
+            self.publish_errors += 1
+            logger.warning(f"Could not publish turn of session {session_id} to other workers: {e}")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _listen(self) -> None:
+        connected_before = False
+        while True:
+            pubsub = async_redis_client.pubsub()
+            try:
+                await pubsub.subscribe(TURNS_CHANNEL)
+                if connected_before:
+                    # Turns published while disconnected were missed
+                    self.index.reset()
+                connected_before = True
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, session_id, vector = _decode_turn(message["data"])
+                    if origin != self.origin:
+                        self.received += 1
+                        self.index.add(session_id, vector)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Session index listener disconnected: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"published": self.published, "publish_errors": self.publish_errors, "received": self.received}
+
+
+# Global per-worker index; turns written by other workers arrive through session_index_sync
+session_index = SessionVectorIndex(SESSION_INDEX_MAX_SESSIONS, SESSION_INDEX_MAX_VECTORS, SESSION_INDEX_IDLE_SECONDS,
+                                   SESSION_INDEX_RECENT_SECONDS)
+session_index_sync = SessionIndexSync(session_index)
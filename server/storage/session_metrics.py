@@ -0,0 +1,182 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import math
+import struct
+from utils.metrics import QuantileSketch, summarize
+
+SESSION_METRICS_TTL_SECONDS = 60*60*24*30  # 30 days
+SUMMARY_SKETCH_ACCURACY = 0.05  # ~100 buckets cover 10ms..10min of latency
+
+# version, timestamp, latency, time to first token, query relevance, context relevance,
+# response length, token count, flags[, prompt tokens]; NaN stands in for None
+_ENTRY_V1 = struct.Struct("<BdffffIIB")
+_ENTRY = struct.Struct("<BdffffIIBf")
+_ENTRY_VERSION = 2
+_FLAG_RELEVANCE_SAMPLED = 1
+_FLAG_CACHE_HIT = 2
+
+_sketch = QuantileSketch(SUMMARY_SKETCH_ACCURACY)
+
+
+def metrics_key(session_id: str) -> str:
+    return f"response_metrics:{session_id}"
+
+
+def summary_key(session_id: str) -> str:
+    return f"response_summary:{session_id}"
+
+
+def _pack_optional(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def _unpack_optional(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def encode_entry(metrics: Dict[str, Any]) -> bytes:
+    """Pack one interaction's metrics into a fixed 38-byte record (the session ID lives in the key)"""
+    flags = (_FLAG_RELEVANCE_SAMPLED if metrics.get("relevance_sampled") else 0) | \
+            (_FLAG_CACHE_HIT if metrics.get("cache_hit") else 0)
+    return _ENTRY.pack(
+        _ENTRY_VERSION,
+        metrics["timestamp"],
+        metrics["latency_seconds"],
+        _pack_optional(metrics.get("time_to_first_token_seconds")),
+        _pack_optional(metrics.get("query_response_relevance")),
+        _pack_optional(metrics.get("context_relevance")),
+        metrics.get("response_length_words", 0),
+        metrics.get("token_count", 0),
+        flags,
+        _pack_optional(metrics.get("prompt_tokens")),
+    )
+
+
+def decode_entry(payload: bytes, session_id: str) -> Dict[str, Any]:
+    """Unpack a record written by encode_entry, or a JSON entry written before it existed"""
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    if payload[0] == 1:
+        fields, prompt_tokens = _ENTRY_V1.unpack(payload), math.nan
+    else:
+        *fields, prompt_tokens = _ENTRY.unpack(payload)
+    _, timestamp, latency, ttft, relevance, context_relevance, length, tokens, flags = fields
+    prompt_tokens = _unpack_optional(prompt_tokens)
+    return {
+        "latency_seconds": latency,
+        "time_to_first_token_seconds": _unpack_optional(ttft),
+        "response_length_words": length,
+        "query_response_relevance": _unpack_optional(relevance),
+        "context_relevance": _unpack_optional(context_relevance),
+        "token_count": tokens,
+        "prompt_tokens": None if prompt_tokens is None else int(prompt_tokens),
+        "relevance_sampled": bool(flags & _FLAG_RELEVANCE_SAMPLED),
+        "cache_hit": bool(flags & _FLAG_CACHE_HIT),
+        "session_id": session_id,
+        "timestamp": timestamp,
+    }
+
+
+def record(pipe, session_id: str, metrics: Dict[str, Any]) -> None:
+    """Queue the interaction entry and running-summary updates on a pipeline; every update is an atomic increment"""
+    key = summary_key(session_id)
+    pipe.lpush(metrics_key(session_id), encode_entry(metrics))
+    pipe.hincrby(key, "count", 1)
+    pipe.hincrbyfloat(key, "latency_sum", metrics["latency_seconds"])
+    index = _sketch.bucket_index(metrics["latency_seconds"])
+    pipe.hincrby(key, "latency_zero" if index is None else f"latency_bucket:{index}", 1)
+    if metrics.get("query_response_relevance") is not None:
+        pipe.hincrby(key, "relevance_count", 1)
+        pipe.hincrbyfloat(key, "relevance_sum", metrics["query_response_relevance"])
+    if metrics.get("context_relevance") is not None:
+        pipe.hincrby(key, "context_relevance_count", 1)
+        pipe.hincrbyfloat(key, "context_relevance_sum", metrics["context_relevance"])
+    pipe.hincrby(key, "token_count", metrics.get("token_count", 0))
+    if metrics.get("prompt_tokens") is not None:
+        pipe.hincrby(key, "prompt_token_count", 1)
+        pipe.hincrby(key, "prompt_tokens", metrics["prompt_tokens"])
+    if metrics.get("cache_hit"):
+        pipe.hincrby(key, "cache_hits", 1)
+    pipe.hsetnx(key, "start_time", metrics["timestamp"])
+    pipe.hset(key, "end_time", metrics["timestamp"])
+    # Set expiry to prevent unlimited growth
+    pipe.expire(metrics_key(session_id), SESSION_METRICS_TTL_SECONDS)
+    pipe.expire(key, SESSION_METRICS_TTL_SECONDS)
+
+
+def _summary_from_hash(fields: Dict[str, str]) -> Dict[str, Any]:
+    count = int(fields["count"])
+    latency_sum = float(fields.get("latency_sum", 0))
+    buckets = {int(name.split(":", 1)[1]): int(value)
+               for name, value in fields.items() if name.startswith("latency_bucket:")}
+    latency = QuantileSketch.from_buckets(buckets, int(fields.get("latency_zero", 0)), latency_sum,
+                                          SUMMARY_SKETCH_ACCURACY)
+    relevance_count = int(fields.get("relevance_count", 0))
+    context_relevance_count = int(fields.get("context_relevance_count", 0))
+    prompt_token_count = int(fields.get("prompt_token_count", 0))
+    return {
+        "total_interactions": count,
+        "avg_latency": latency_sum / count,
+        "latency": summarize(latency),
+        "avg_relevance_score": float(fields["relevance_sum"]) / relevance_count if relevance_count else None,
+        "avg_context_relevance": float(fields["context_relevance_sum"]) / context_relevance_count if context_relevance_count else None,
+        "total_tokens": int(fields.get("token_count", 0)),
+        "avg_prompt_tokens": int(fields["prompt_tokens"]) / prompt_token_count if prompt_token_count else None,
+        "cache_hits": int(fields.get("cache_hits", 0)),
+        "start_time": float(fields["start_time"]),
+        "end_time": float(fields["end_time"]),
+    }
+
+
+def _summary_from_entries(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One-off O(n) summary for sessions written before the summary hash existed"""
+    latency = QuantileSketch(SUMMARY_SKETCH_ACCURACY)
+    for entry in entries:
+        latency.add(entry.get("latency_seconds") or 0)
+    relevance = [e["query_response_relevance"] for e in entries if e.get("query_response_relevance") is not None]
+    context_relevance = [e["context_relevance"] for e in entries if e.get("context_relevance") is not None]
+    prompt_tokens = [e["prompt_tokens"] for e in entries if e.get("prompt_tokens") is not None]
+    timestamps = [e["timestamp"] for e in entries]
+    return {
+        "total_interactions": len(entries),
+        "avg_latency": latency.mean(),
+        "latency": summarize(latency),
+        "avg_relevance_score": sum(relevance) / len(relevance) if relevance else None,
+        "avg_context_relevance": sum(context_relevance) / len(context_relevance) if context_relevance else None,
+        "total_tokens": sum(e.get("token_count", 0) for e in entries),
+        "avg_prompt_tokens": sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else None,
+        "cache_hits": sum(1 for e in entries if e.get("cache_hit")),
+        "start_time": min(timestamps),
+        "end_time": max(timestamps),
+    }
+
+
+async def get_summary(client, session_id: str) -> Optional[Dict[str, Any]]:
+    """Session summary from the running aggregates: one HGETALL, independent of session length"""
+    fields = await client.hgetall(summary_key(session_id))
+    if fields:
+        return _summary_from_hash({k.decode("utf-8"): v.decode("utf-8") for k, v in fields.items()})
+
+    entries = await client.lrange(metrics_key(session_id), 0, -1)
+    if not entries:
+        return None
+    return _summary_from_entries([decode_entry(e, session_id) for e in entries])
+
+
+async def get_page(client, session_id: str, cursor: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Newest-first page of interactions and the cursor of the next (older) page, or None at the end.
+
+    The cursor counts entries from the oldest, so it stays valid while new interactions are pushed.
+    """
+    key = metrics_key(session_id)
+    if cursor is None:
+        pipe = client.pipeline(transaction=True)
+        pipe.llen(key)
+        pipe.lrange(key, 0, limit - 1)
+        length, entries = await pipe.execute()
+        remaining = length - len(entries)
+    else:
+        oldest = max(cursor - limit, 0)
+        entries = await client.lrange(key, -cursor, -(oldest + 1)) if cursor > 0 else []
+        remaining = oldest
+    return [decode_entry(e, session_id) for e in entries], (remaining if remaining > 0 else None)
@@ -0,0 +1,53 @@
+from typing import Any, Dict, List
+import asyncio
+import json
+import logging
+from storage.redis import async_redis_client
+from utils.config import TRACE_MAX_PER_SESSION, TRACE_TTL_SECONDS
+from utils.tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+
+def traces_key(session_id: str) -> str:
+    return f"traces:{session_id}"
+
+
+class SessionTraceStore:
+    """Sampled turn traces in Redis, newest first, so any instance can serve a session's traces"""
+
+    def __init__(self, max_per_session: int, ttl_seconds: int):
+        self.max_per_session = max_per_session
+        self.ttl_seconds = ttl_seconds
+        self._tasks = set()
+        self.saved = 0
+        self.failed = 0
+
+    def save(self, trace: Trace) -> None:
+        """Write a sampled trace in the background; one pipelined round-trip"""
+        task = asyncio.create_task(self._save(trace.session_id, json.dumps(trace.to_dict())))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save(self, session_id: str, payload: str) -> None:
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            pipe.lpush(traces_key(session_id), payload)
+            pipe.ltrim(traces_key(session_id), 0, self.max_per_session - 1)
+            pipe.expire(traces_key(session_id), self.ttl_seconds)
+            await pipe.execute()
+            self.saved += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Could not store trace for session {session_id}: {e}")
+
+    async def get(self, session_id: str, limit: int) -> List[Dict[str, Any]]:
+        entries = await async_redis_client.lrange(traces_key(session_id), 0, limit - 1)
+        return [json.loads(entry) for entry in entries]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"saved": self.saved, "failed": self.failed, "pending": len(self._tasks)}
+
+
+# Global store for sampled traces
+session_traces = SessionTraceStore(TRACE_MAX_PER_SESSION, TRACE_TTL_SECONDS)
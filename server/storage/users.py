@@ -0,0 +1,96 @@
+from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import logging
+import os
+from dotenv import load_dotenv
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
+from utils.concurrency import run_blocking
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+USERS = "users"
+USER_EMAILS = "user_emails"  # one document per email, holding the owning user_id
+
+
+def email_key(email: str) -> str:
+    """Document ID claiming an email in USER_EMAILS.
+
+    Emails may contain "/", which Firestore reads as a path separator, so the
+    ID is a digest of the normalized address; case and surrounding spaces don't
+    make a second account.
+    """
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()
+
+
+class UserAlreadyExists(Exception):
+    pass
+
+
+class UserStore:
+    """User documents in Firestore, served by one long-lived AsyncClient"""
+
+    def __init__(self, key_file: Optional[str]):
+        self.key_file = key_file
+        self._client: Optional[firestore.AsyncClient] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> firestore.AsyncClient:
+        """Create the client once; reading credentials touches the filesystem, so it runs off-loop"""
+        async with self._lock:
+            if self._client is None:
+                self._client = await run_blocking(firestore.AsyncClient.from_service_account_json, self.key_file)
+                logger.info("Connected to firestore database successfully")
+        return self._client
+
+    async def ping(self) -> None:
+        """Create the client and read one document, proving Firestore is reachable with these credentials"""
+        client = await self.start()
+        await client.collection(USERS).limit(1).get()
+
+    async def close(self) -> None:
+        """Close the gRPC channel too; AsyncClient.close() only closes its HTTP session"""
+        if self._client is not None:
+            api = self._client._firestore_api_internal  # None until the first call opened a channel
+            if api is not None:
+                await api.transport.close()
+            self._client.close()
+            self._client = None
+
+    async def _get_client(self) -> firestore.AsyncClient:
+        return self._client if self._client is not None else await self.start()
+
+    async def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """The user document for an email, or None"""
+        client = await self._get_client()
+        query = client.collection(USERS).where(filter=firestore.FieldFilter("email", "==", email)).limit(1)
+        async for snapshot in query.stream():
+            return snapshot.to_dict()
+        return None
+
+    async def create(self, user_doc: Dict[str, Any]) -> None:
+        """Write a new user and claim its email in one atomic commit.
+
+        create() on user_emails/{email_key(email)} fails if the email is taken,
+        so the existence check and the write are a single round-trip.
+        """
+        client = await self._get_client()
+        batch = client.batch()
+        batch.create(client.collection(USER_EMAILS).document(email_key(user_doc["email"])),
+                     {"user_id": user_doc["user_id"], "email": user_doc["email"]})
+        batch.set(client.collection(USERS).document(user_doc["user_id"]), user_doc)
+        try:
+            await batch.commit()
+        except Conflict:
+            raise UserAlreadyExists(user_doc["email"])
+
+    async def update_password_hash(self, user_id: str, password_hash: str) -> None:
+        client = await self._get_client()
+        await client.collection(USERS).document(user_id).update({"password_hash": password_hash})
+
+
+# Global user store; the client is created at app startup
+user_store = UserStore(os.getenv("FIRESTORE_ACCOUNT_KEY_FILE"))
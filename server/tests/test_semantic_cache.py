@@ -0,0 +1,61 @@
+import asyncio
+import types
+import services.chat as chat
+from services.semantic_cache import SemanticCache
+
+
+def _run_session(monkeypatch, questions):
+    """Ask `questions` in order in one session; returns (answers, model calls)"""
+    cache = SemanticCache(threshold=0.95, ttl_seconds=600, max_entries=100, scope="session")
+    history = []
+    calls = []
+
+    async def embed(text):
+        return [1.0, 0.0] if "capital" in text else [0.0, 1.0]
+
+    async def load_history(user_id, session_id):
+        return "\n".join(history)
+
+    async def build_prompt(user_id, session_id, data, embedding, history_task):
+        return f"{await history_task}\nUser: {data}", "", "context", 1
+
+    async def generate(prompt, **kwargs):
+        calls.append(prompt)
+        return types.SimpleNamespace(text=f"answer {len(calls)}")
+
+    monkeypatch.setattr(chat, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(chat, "SEMANTIC_CACHE_MATCH_CONTEXT", False)
+    monkeypatch.setattr(chat, "semantic_cache", cache)
+    monkeypatch.setattr(chat, "_embed_query", embed)
+    monkeypatch.setattr(chat, "_load_history", load_history)
+    monkeypatch.setattr(chat, "_build_prompt", build_prompt)
+    monkeypatch.setattr(chat, "generate_content_async", generate)
+    monkeypatch.setattr(chat.evaluation_queue, "submit", lambda *args, **kwargs: None)
+
+    async def session():
+        answers = []
+        for question in questions:
+            answer = await chat.get_chat_response("user-1", "session-1", question)
+            history.extend([f"User: {question}", f"Assistant: {answer}"])
+            answers.append(answer)
+        return answers
+
+    return asyncio.run(session()), calls
+
+
+def test_repeated_question_in_a_session_is_a_hit(monkeypatch):
+    answers, calls = _run_session(monkeypatch, [
+        "What is the capital of France?",
+        "Tell me about rivers",
+        "What is the capital of France?",
+    ])
+
+    assert answers == ["answer 1", "answer 2", "answer 1"]
+    assert len(calls) == 2
+    assert chat.semantic_cache.hits == 1
+
+
+def test_other_sessions_do_not_share_answers(monkeypatch):
+    _run_session(monkeypatch, ["What is the capital of France?"])
+
+    assert chat.semantic_cache.lookup(chat.semantic_cache.scope_key("user-1", "session-2"), [1.0, 0.0], "") is None
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+import asyncio
+import functools
+import time
+from utils.config import BLOCKING_IO_MAX_WORKERS
+
+# Shared, bounded pool for client libraries that only offer blocking calls
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_MAX_WORKERS, thread_name_prefix="blocking-io")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared thread pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def get_executor() -> ThreadPoolExecutor:
+    return _executor
+
+
+class SingleFlightCache:
+    """Caches coroutine results for a short TTL; concurrent callers of the same key share one computation"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._compute(key, compute))
+            self._inflight[key] = future
+        else:
+            self.coalesced += 1
+        # A disconnecting caller must not cancel the computation the others are waiting on
+        return await asyncio.shield(future)
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await compute()
+            now = time.monotonic()
+            self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+            self._entries[key] = (now + self.ttl_seconds, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
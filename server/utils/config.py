@@ -1,3 +1,8 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
 REGIONS = ["me-central1",
            "me-central2",
            "me-west1",
@@ -26,4 +31,107 @@ REGIONS = ["me-central1",
            "australia-southeast1",
            "asia-northeast3",
            "asia-northeast1"
-           ]
\ No newline at end of file
+           ]
+
+# Embeddings
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")  # must be the model the Pinecone index was built with
+EMBEDDING_VERTEX = os.getenv("EMBEDDING_VERTEX", "false").lower() == "true"  # embed through the Vertex AI regions (e.g. text-embedding-005) instead of the Gemini API
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))  # entries kept in process
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 60*60*24*7))  # 7 days in Redis
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 32))  # embed_content accepts up to 100 texts (Gemini API), 250 (Vertex AI)
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+
+# Concurrency
+BLOCKING_IO_MAX_WORKERS = int(os.getenv("BLOCKING_IO_MAX_WORKERS", 32))  # threads for sync-only client libraries
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))  # per worker, including one held by each pub/sub listener
+REDIS_POOL_TIMEOUT_SECONDS = float(os.getenv("REDIS_POOL_TIMEOUT_SECONDS", 5))  # wait for a free connection before failing
+
+# Background evaluation
+EVALUATION_QUEUE_SIZE = int(os.getenv("EVALUATION_QUEUE_SIZE", 1000))  # overflow is dropped and counted
+EVALUATION_WORKERS = int(os.getenv("EVALUATION_WORKERS", 4))
+EVALUATION_SAMPLE_RATE = float(os.getenv("EVALUATION_SAMPLE_RATE", 1.0))  # fraction of turns scored for relevance
+
+# Pinecone write-behind buffer
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "chats-db")  # point at a re-embedded copy when changing EMBEDDING_MODEL
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", 100))
+PINECONE_UPSERT_FLUSH_SECONDS = float(os.getenv("PINECONE_UPSERT_FLUSH_SECONDS", 1.0))
+PINECONE_UPSERT_MAX_RETRIES = int(os.getenv("PINECONE_UPSERT_MAX_RETRIES", 5))
+PINECONE_UPSERT_MAX_BUFFERED = int(os.getenv("PINECONE_UPSERT_MAX_BUFFERED", 10000))  # oldest vectors are dropped past this
+
+# Regional model clients
+REGION_EWMA_ALPHA = float(os.getenv("REGION_EWMA_ALPHA", 0.3))  # weight of the newest latency sample
+REGION_FAILURE_THRESHOLD = int(os.getenv("REGION_FAILURE_THRESHOLD", 3))  # consecutive errors before ejection
+REGION_EJECTION_SECONDS = float(os.getenv("REGION_EJECTION_SECONDS", 30))
+
+# Hedged generation requests
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", 0))  # 0 = use the rolling p90 of generation latency
+LLM_HEDGE_BUDGET_PER_MINUTE = int(os.getenv("LLM_HEDGE_BUDGET_PER_MINUTE", 60))  # caps the extra calls hedging may add
+
+# Semantic response cache
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"  # opt-in: hits replace model answers
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))  # minimum cosine similarity for a hit
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 10*60))  # short: a hit skips the conversation since the cached answer
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 10000))
+SEMANTIC_CACHE_SCOPE = os.getenv("SEMANTIC_CACHE_SCOPE", "session")  # "session" or "user"
+SEMANTIC_CACHE_MATCH_CONTEXT = os.getenv("SEMANTIC_CACHE_MATCH_CONTEXT", "false").lower() == "true"  # also require identical retrieved context
+
+# In-process per-session vector index
+SESSION_INDEX_MAX_SESSIONS = int(os.getenv("SESSION_INDEX_MAX_SESSIONS", 500))
+SESSION_INDEX_MAX_VECTORS = int(os.getenv("SESSION_INDEX_MAX_VECTORS", 100))  # larger sessions stay on Pinecone
+SESSION_INDEX_IDLE_SECONDS = int(os.getenv("SESSION_INDEX_IDLE_SECONDS", 60*30))
+SESSION_INDEX_RECENT_SECONDS = int(os.getenv("SESSION_INDEX_RECENT_SECONDS", 60))  # other workers' turns kept for sessions not held yet; covers the upsert buffer's lag
+
+# Cluster-wide metrics
+METRICS_PUBLISH_INTERVAL_SECONDS = float(os.getenv("METRICS_PUBLISH_INTERVAL_SECONDS", 10))
+METRICS_SNAPSHOT_TTL_SECONDS = int(os.getenv("METRICS_SNAPSHOT_TTL_SECONDS", 60))  # instances silent this long drop out
+METRICS_RESPONSE_CACHE_SECONDS = float(os.getenv("METRICS_RESPONSE_CACHE_SECONDS", 2))  # concurrent dashboards share one computation
+
+# Conversation memory
+MEMORY_WINDOW_MESSAGES = int(os.getenv("MEMORY_WINDOW_MESSAGES", 40))  # newest messages kept verbatim in Redis
+MEMORY_HISTORY_TOKEN_BUDGET = int(os.getenv("MEMORY_HISTORY_TOKEN_BUDGET", 1500))  # summary + history in the prompt
+MEMORY_COMPACT_BATCH_MESSAGES = int(os.getenv("MEMORY_COMPACT_BATCH_MESSAGES", 20))  # older messages folded into the summary at a time
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", 256))
+MEMORY_TTL_SECONDS = int(os.getenv("MEMORY_TTL_SECONDS", 60*60*24*30))  # idle sessions expire after 30 days
+
+# Retrieved context packing
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 20))  # matches retrieved before dedupe and reranking
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", 5))
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", 0.4))  # matches below this similarity are dropped
+CONTEXT_DEDUPE_THRESHOLD = float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", 0.95))  # near-duplicate cosine similarity
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))  # 1 = pure relevance, 0 = pure diversity
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+
+# Password hashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))  # hashes with another cost are rehashed on login
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))  # processes
+PASSWORD_HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", 200))  # logins past this get a 503
+
+# Authentication
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")  # required; must be the same for every worker and instance
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", 60))
+
+# Startup and readiness
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", 20))  # per attempt, per dependency
+WARMUP_MAX_RETRY_SECONDS = float(os.getenv("WARMUP_MAX_RETRY_SECONDS", 30))  # backoff cap between failed attempts
+
+# Per-stage tracing
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.05))  # turns whose full span list is kept
+TRACE_MAX_PER_SESSION = int(os.getenv("TRACE_MAX_PER_SESSION", 50))  # newest sampled traces kept per session
+TRACE_TTL_SECONDS = int(os.getenv("TRACE_TTL_SECONDS", 60*60*24*7))
+TRACE_SUMMARY_WINDOW_SECONDS = int(os.getenv("TRACE_SUMMARY_WINDOW_SECONDS", 5*60))  # quantile window for the scrape endpoint
+
+# Background turn persistence
+TURN_PERSIST_MAX_PENDING = int(os.getenv("TURN_PERSIST_MAX_PENDING", 1000))  # turns in flight before replies wait for a slot
+TURN_PERSIST_DRAIN_SECONDS = float(os.getenv("TURN_PERSIST_DRAIN_SECONDS", 10))  # shutdown grace for unsaved turns
+
+# Chat admission control
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 64))  # turns generating at once in this worker
+ADMISSION_PER_USER_IN_FLIGHT = int(os.getenv("ADMISSION_PER_USER_IN_FLIGHT", 4))  # a user's further turns queue behind other users
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", 256))  # turns past this get a "busy" reply at once
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 10))  # longest wait for a slot
+ADMISSION_CLUSTER_RATE = float(os.getenv("ADMISSION_CLUSTER_RATE", 0))  # turns/s across every instance; 0 = no limit
+ADMISSION_CLUSTER_BURST = int(os.getenv("ADMISSION_CLUSTER_BURST", 50))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", 0))  # turns/s per user across every instance; 0 = no limit
+ADMISSION_USER_BURST = int(os.getenv("ADMISSION_USER_BURST", 5))
@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional, Sequence
+import bisect
+import math
+import threading
+import time
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative counts, sum and count"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: List[float] = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a single observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return cumulative bucket counts keyed by upper bound"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+            cumulative += bucket_count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+
+        return {
+            "count": count,
+            "sum": total,
+            "avg": total / count if count > 0 else 0,
+            "buckets": buckets,
+        }
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error (DDSketch-style log buckets)"""
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0  # values <= 0 (latencies of exactly zero, non-positive scores)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def _index(self, value: float) -> int:
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def bucket_index(self, value: float) -> Optional[int]:
+        """Bucket a value lands in, or None for the zero bucket; lets callers keep counts elsewhere (e.g. a Redis hash)"""
+        return self._index(value) if value > 0 else None
+
+    def _value(self, index: int) -> float:
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value > 0:
+            index = self._index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        else:
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self) -> None:
+        # Fold the lowest buckets together; upper quantiles keep their accuracy
+        keys = sorted(self.buckets)
+        overflow = keys[:len(keys) - self.max_buckets + 1]
+        folded = sum(self.buckets.pop(k) for k in overflow)
+        target = keys[len(overflow)]
+        self.buckets[target] = self.buckets.get(target, 0) + folded
+
+    def merge(self, other: "QuantileSketch") -> None:
+        for index, bucket_count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket_count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None when empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return min(self.min, 0.0)
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count > 0 else None
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "QuantileSketch":
+        sketch = cls(relative_accuracy=data["relative_accuracy"])
+        sketch.buckets = {int(k): v for k, v in data["buckets"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+    @classmethod
+    def from_buckets(cls, buckets: Dict[int, int], zero_count: int, total: float,
+                     relative_accuracy: float = 0.01) -> "QuantileSketch":
+        """Rebuild a sketch from bucket counts; min/max are approximated by the outermost buckets"""
+        sketch = cls(relative_accuracy=relative_accuracy)
+        sketch.buckets = dict(buckets)
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(buckets.values())
+        sketch.sum = total
+        if sketch.count:
+            sketch.min = 0.0 if zero_count else sketch._value(min(buckets))
+            sketch.max = sketch._value(max(buckets)) if buckets else 0.0
+        return sketch
+
+
+class WindowedSketch:
+    """Lifetime sketch plus a ring of time-sliced sketches for sliding-window views"""
+
+    def __init__(self, slot_seconds: int = 10, horizon_seconds: int = 60 * 60, relative_accuracy: float = 0.01):
+        self.slot_seconds = slot_seconds
+        self.relative_accuracy = relative_accuracy
+        self._slots: List[Optional[QuantileSketch]] = [None] * (horizon_seconds // slot_seconds)
+        self._slot_ids: List[int] = [-1] * len(self._slots)
+        self.total = QuantileSketch(relative_accuracy)
+        self._lock = threading.Lock()
+
+    def add(self, value: float) -> None:
+        slot_id = int(time.time() // self.slot_seconds)
+        position = slot_id % len(self._slots)
+        with self._lock:
+            if self._slot_ids[position] != slot_id:
+                self._slots[position] = QuantileSketch(self.relative_accuracy)
+                self._slot_ids[position] = slot_id
+            self._slots[position].add(value)
+            self.total.add(value)
+
+    def window(self, seconds: int) -> QuantileSketch:
+        """Merged sketch over the last `seconds` (rounded up to whole slots)"""
+        merged = QuantileSketch(self.relative_accuracy)
+        current = int(time.time() // self.slot_seconds)
+        oldest = current - min(len(self._slots), math.ceil(seconds / self.slot_seconds)) + 1
+        with self._lock:
+            for position, slot_id in enumerate(self._slot_ids):
+                if oldest <= slot_id <= current:
+                    merged.merge(self._slots[position])
+        return merged
+
+
+def summarize(sketch: QuantileSketch) -> Dict[str, Optional[float]]:
+    """Count, mean and the usual latency percentiles of a sketch"""
+    return {
+        "count": sketch.count,
+        "avg": sketch.mean(),
+        "p50": sketch.quantile(0.50),
+        "p95": sketch.quantile(0.95),
+        "p99": sketch.quantile(0.99),
+    }
@@ -0,0 +1,3 @@
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English), cheap enough for every prompt"""
+    return (len(text) + 3) // 4
@@ -0,0 +1,171 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+import random
+import threading
+import time
+import uuid
+from utils.config import TRACE_SAMPLE_RATE, TRACE_SUMMARY_WINDOW_SECONDS
+from utils.metrics import WindowedSketch, summarize
+
+PROMETHEUS_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """One chat turn. Spans always feed the stage sketches; a sampled trace also keeps each span"""
+
+    __slots__ = ("session_id", "sampled", "trace_id", "started_at", "start", "duration", "spans", "_token")
+
+    def __init__(self, session_id: str, sampled: bool):
+        self.session_id = session_id
+        self.sampled = sampled
+        self.trace_id = uuid.uuid4().hex if sampled else None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Tuple[str, float, float, bool]] = []  # (stage, offset, duration, error)
+        self._token = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "timestamp": self.started_at,
+            "duration_seconds": self.duration,
+            "spans": [
+                {"stage": stage, "offset_seconds": offset, "duration_seconds": duration, "error": error}
+                for stage, offset, duration, error in sorted(self.spans, key=lambda s: s[1])
+            ],
+        }
+
+
+class Span:
+    """Times one stage; closing it is a perf_counter() call and a sketch update"""
+
+    __slots__ = ("tracer", "stage", "trace", "start")
+
+    def __init__(self, tracer: "Tracer", stage: str, trace: Optional[Trace]):
+        self.tracer = tracer
+        self.stage = stage
+        self.trace = trace
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.tracer.record(self.stage, time.perf_counter() - self.start, self.start, self.trace,
+                           error=exc_type is not None and exc_type is not GeneratorExit)
+
+
+class _TraceScope:
+    __slots__ = ("tracer", "trace")
+
+    def __init__(self, tracer: "Tracer", trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+
+    def __enter__(self) -> Trace:
+        self.trace._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_trace.reset(self.trace._token)
+        self.trace.duration = time.perf_counter() - self.trace.start
+        self.tracer.record("turn", self.trace.duration, error=exc_type is not None)
+
+
+class Tracer:
+    """Per-stage latency of the chat pipeline.
+
+    Open a trace per turn with `with tracer.trace(session_id)`, and time stages
+    inside it (including in tasks it spawns) with `with tracer.span("stage")`.
+    """
+
+    def __init__(self, sample_rate: float, summary_window: int):
+        self.sample_rate = sample_rate
+        self.summary_window = summary_window
+        self._stages: Dict[str, WindowedSketch] = {}
+        self._errors: Counter = Counter()
+        self._lock = threading.Lock()
+        self.traces = 0
+        self.sampled = 0
+
+    def trace(self, session_id: str) -> _TraceScope:
+        sampled = random.random() < self.sample_rate
+        self.traces += 1
+        if sampled:
+            self.sampled += 1
+        return _TraceScope(self, Trace(session_id, sampled))
+
+    def span(self, stage: str) -> Span:
+        return Span(self, stage, _current_trace.get())
+
+    def current(self) -> Optional[Trace]:
+        return _current_trace.get()
+
+    def _sketch(self, stage: str) -> WindowedSketch:
+        sketch = self._stages.get(stage)
+        if sketch is None:
+            with self._lock:
+                sketch = self._stages.setdefault(stage, WindowedSketch())
+        return sketch
+
+    def record(self, stage: str, duration: float, start: Optional[float] = None,
+               trace: Optional[Trace] = None, error: bool = False) -> None:
+        """Add a measured duration to a stage, and to the trace if it is sampled"""
+        self._sketch(stage).add(duration)
+        if error:
+            self._errors[stage] += 1
+        if trace is not None and trace.sampled:
+            offset = (start if start is not None else time.perf_counter() - duration) - trace.start
+            trace.spans.append((stage, offset, duration, error))
+
+    def stage_sketches(self) -> Dict[str, WindowedSketch]:
+        with self._lock:
+            return dict(self._stages)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Stage-by-stage latency of this process, lifetime and over the summary window"""
+        return {
+            "traces": self.traces,
+            "sampled": self.sampled,
+            "stages": {
+                stage: {
+                    "lifetime": summarize(sketch.total),
+                    "recent": summarize(sketch.window(self.summary_window)),
+                    "errors": self._errors[stage],
+                }
+                for stage, sketch in sorted(self.stage_sketches().items())
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Stage durations as a Prometheus summary, in the text exposition format"""
+        lines = [
+            f"# HELP shashtra_stage_duration_seconds Chat pipeline stage durations; quantiles over the last {self.summary_window}s",
+            "# TYPE shashtra_stage_duration_seconds summary",
+        ]
+        stages = sorted(self.stage_sketches().items())
+        for stage, sketch in stages:
+            recent = sketch.window(self.summary_window)
+            for q in PROMETHEUS_QUANTILES:
+                value = recent.quantile(q)
+                lines.append(f'shashtra_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} {"NaN" if value is None else repr(value)}')
+            lines.append(f'shashtra_stage_duration_seconds_sum{{stage="{stage}"}} {sketch.total.sum!r}')
+            lines.append(f'shashtra_stage_duration_seconds_count{{stage="{stage}"}} {sketch.total.count}')
+        lines.append("# HELP shashtra_stage_errors_total Stages that ended with an exception")
+        lines.append("# TYPE shashtra_stage_errors_total counter")
+        for stage, _ in stages:
+            lines.append(f'shashtra_stage_errors_total{{stage="{stage}"}} {self._errors[stage]}')
+        lines.append("# HELP shashtra_traces_total Chat turns traced, and those sampled for detailed traces")
+        lines.append("# TYPE shashtra_traces_total counter")
+        lines.append(f'shashtra_traces_total{{sampled="false"}} {self.traces - self.sampled}')
+        lines.append(f'shashtra_traces_total{{sampled="true"}} {self.sampled}')
+        return "\n".join(lines) + "\n"
+
+
+# Global tracer shared by the request path and the background workers
+tracer = Tracer(TRACE_SAMPLE_RATE, TRACE_SUMMARY_WINDOW_SECONDS)